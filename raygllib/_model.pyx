@@ -12,7 +12,7 @@ cdef class HalfEdge:
 def make_adj_indices(ID[:] indices):
     cdef:
         int i, k, v1, v2
-        ID[:] adjIndices = np.zeros(len(indices) * 2, dtype=np.uint)
+        ID[:] adjIndices = np.zeros(len(indices) * 2, dtype=GLuint)
         dict edges = {}
         HalfEdge edge
 
@@ -36,6 +36,42 @@ def make_adj_indices(ID[:] indices):
     return adjIndices
 
 
+def make_adj_indices_1(indices):
+    """
+    Edge table version of make_adj_indices.
+
+    Every directed edge (v1, v2) is packed into one uint64 key and the keys
+    are sorted, so the twin (v2, v1) of an edge is found with a binary search.
+    The vertex opposite to the twin is written as the adjacent vertex. When
+    an edge has no twin (boundary or degenerate edge), the vertex opposite to
+    the edge in its own triangle is used instead, as make_adj_indices does.
+    For non-manifold edges the twin from the first triangle is used.
+    """
+    indices = np.asarray(indices, dtype=GLuint)
+    n = len(indices) - len(indices) % 3
+    indices = indices[:n]
+    adjIndices = np.empty(n * 2, dtype=GLuint)
+    if n == 0:
+        return adjIndices
+    corner = np.arange(n) % 3
+    # next and opposite corner of each corner, in the same triangle
+    nextCorner = np.arange(n) - corner + (corner + 1) % 3
+    oppCorner = np.arange(n) - corner + (corner + 2) % 3
+    v1 = indices.astype(np.uint64)
+    v2 = v1[nextCorner]
+    keys = (v1 << np.uint64(32)) | v2
+    twinKeys = (v2 << np.uint64(32)) | v1
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    pos = np.searchsorted(sortedKeys, twinKeys)
+    pos[pos == n] = 0
+    twin = order[pos]
+    found = (sortedKeys[pos] == twinKeys) & (v1 != v2)
+    adjIndices[0::2] = indices
+    adjIndices[1::2] = indices[np.where(found, oppCorner[twin], oppCorner)]
+    return adjIndices
+
+
 def make_single_index_1(list bufs, index_):
     cdef:
         int n, m, i, j, k, newBufSize
@@ -73,6 +109,60 @@ def make_single_index_1(list bufs, index_):
     return newBufs, newIndex_
 
 
+def make_single_index_3(list bufs, index_):
+    """
+    Vectorized version of make_single_index_1.
+
+    The rows of each attribute buffer are first reduced to canonical ids, so
+    that an index row can be packed into one int64 key which is then
+    de-duplicated by sorting. New vertices keep the order of their first
+    occurrence, so the result is identical to make_single_index_1.
+    """
+    index_ = np.asarray(index_)
+    n, m = index_.shape
+    if n == 0:
+        return [np.zeros((0, buf.shape[1]), dtype=GLfloat) for buf in bufs],\
+            np.zeros(0, dtype=GLuint)
+    key = np.zeros(n, dtype=np.int64)
+    radix = 1
+    for j in range(m):
+        first, canonical = unique_rows(bufs[j])
+        radix *= len(first)
+        if radix >= 2 ** 63:
+            # Too many distinct values to pack, compare the raw rows instead.
+            key = np.hstack([np.asarray(bufs[j])[index_[:, j]] for j in range(m)])
+            break
+        key = key * len(first) + canonical[index_[:, j]]
+    first, newIndex = unique_rows(key.reshape((n, -1)))
+    newBufs = [np.ascontiguousarray(np.asarray(bufs[j])[index_[first, j]], dtype=GLfloat)
+        for j in range(m)]
+    utils.debug('compress: nBefore={}, nAfter={}, rate={}'.format(
+        n, len(first), len(first) / float(n)))
+    return newBufs, newIndex
+
+
+def unique_rows(rows):
+    """
+    De-duplicate the rows of a 2D array.
+
+    Return (first, inverse) where rows[first] are the distinct rows in order
+    of first occurrence and rows[first][inverse] == rows.
+    """
+    rows = np.ascontiguousarray(rows)
+    if rows.dtype.kind == 'f':
+        # Make -0.0 and 0.0 share a key, as they do in a dict.
+        rows = rows + rows.dtype.type(0)
+    if rows.shape[1] == 1 and rows.dtype.kind in 'iu':
+        keys = rows.ravel()
+    else:
+        keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=GLuint)
+    rank[order] = np.arange(len(order), dtype=GLuint)
+    return first[order], rank[inverse.ravel()]
+
+
 def make_single_index_2(bufs, index_):
     cdef:
         int n, m, i, j, newBufSize
@@ -87,7 +177,7 @@ def make_single_index_2(bufs, index_):
     for j in range(m):
         h = {}
         for i in range(n):
-            v = tuple(buf[index[i, j]])
+            v = tuple(bufs[j][index[i, j]])
             try:
                 index[i, j] = h[v]
             except:
@@ -105,3 +195,121 @@ def make_single_index_2(bufs, index_):
     utils.debug('compress: nBefore={}, nAfter={}, rate={}'.format(
         n, newBufSize, newBufSize / float(n)))
     return newBufs, newIndex_
+
+
+def tipsify(indices_, int nVertices, int cacheSize):
+    """
+    Reorder triangles for a post-transform vertex cache of `cacheSize`
+    entries, with Tipsify (Sander et al., "Fast Triangle Reordering for Vertex
+    Locality and Reduced Overdraw", 2007).
+
+    Return (newIndices, starts), `starts` being the offsets in triangles
+    where the order has to jump to a vertex out of the cache. The clusters
+    between them can be sorted without losing much cache locality.
+    """
+    indices_ = np.ascontiguousarray(indices_, dtype=GLuint)
+    counts = np.bincount(indices_, minlength=nVertices).astype(np.int32)
+    offsets_ = np.zeros(nVertices + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets_[1:])
+    cdef:
+        ID[:] indices = indices_
+        int nTriangles = len(indices_) // 3
+        long long[:] offsets = offsets_
+        # Triangles around each vertex
+        long long[:] triangles = np.argsort(indices_, kind='stable') // 3
+        int[:] live = counts
+        long long[:] stamp = np.zeros(nVertices, dtype=np.int64)
+        unsigned char[:] emitted = np.zeros(nTriangles, dtype=np.uint8)
+        ID[:] deadEnd = np.zeros(len(indices_), dtype=GLuint)
+        ID[:] candidates = np.zeros(3 * counts.max() if nVertices else 0, dtype=GLuint)
+        ID[:] newIndices
+        long long time = cacheSize + 1, k, t
+        long long priority, bestPriority
+        int nDeadEnd = 0, nCandidates, nOut = 0, cursor = 0, fan = -1, best, j, v
+    newIndices_ = np.zeros(len(indices_), dtype=GLuint)
+    newIndices = newIndices_
+    starts = []
+    while cursor < nVertices and live[cursor] == 0:
+        cursor += 1
+    if cursor < nVertices:
+        fan = cursor
+        starts.append(0)
+    while fan >= 0:
+        nCandidates = 0
+        for k in range(offsets[fan], offsets[fan + 1]):
+            t = triangles[k]
+            if emitted[t]:
+                continue
+            emitted[t] = 1
+            for j in range(3):
+                v = indices[3 * t + j]
+                newIndices[nOut] = v
+                nOut += 1
+                deadEnd[nDeadEnd] = v
+                nDeadEnd += 1
+                candidates[nCandidates] = v
+                nCandidates += 1
+                live[v] -= 1
+                if time - stamp[v] > cacheSize:
+                    stamp[v] = time
+                    time += 1
+        # Prefer the oldest candidate whose fan still fits in the cache.
+        best = -1
+        bestPriority = -1
+        for j in range(nCandidates):
+            v = candidates[j]
+            if live[v] > 0:
+                priority = 0
+                if time - stamp[v] + 2 * live[v] <= cacheSize:
+                    priority = time - stamp[v]
+                if priority > bestPriority:
+                    bestPriority = priority
+                    best = v
+        if best < 0:
+            while nDeadEnd > 0:
+                nDeadEnd -= 1
+                if live[deadEnd[nDeadEnd]] > 0:
+                    best = deadEnd[nDeadEnd]
+                    break
+        if best < 0:
+            while cursor < nVertices and live[cursor] == 0:
+                cursor += 1
+            if cursor < nVertices:
+                best = cursor
+        if best >= 0 and time - stamp[best] > cacheSize:
+            starts.append(nOut // 3)
+        fan = best
+    return newIndices_, np.array(starts, dtype=np.int64)
+
+
+def vertex_cache_stats(indices_, int nVertices, int cacheSize):
+    """
+    Simulate a FIFO post-transform vertex cache of `cacheSize` entries.
+    Return (ACMR, ATVR): cache misses per triangle and per vertex used, 0.5
+    and 1 at best.
+    """
+    cdef:
+        ID[:] indices = np.ascontiguousarray(indices_, dtype=GLuint)
+        long long[:] stamp = np.full(nVertices, -cacheSize - 1, dtype=np.int64)
+        long long misses = 0
+        int i, v
+    for i in range(len(indices)):
+        v = indices[i]
+        if misses - stamp[v] > cacheSize:
+            stamp[v] = misses
+            misses += 1
+    if len(indices) == 0:
+        return 0., 0.
+    return misses / (len(indices) / 3.), misses / float(len(np.unique(indices_)))
+
+
+def first_use_order(indices):
+    """
+    Return (order, newIndices): the vertices `indices` refer to in order of
+    first use, and the indices renumbered so that order[i] becomes i.
+    """
+    indices = np.asarray(indices)
+    order = indices[np.sort(np.unique(indices, return_index=True)[1])]
+    rank = np.zeros(order.max() + 1 if len(order) else 0, dtype=GLuint)
+    rank[order] = np.arange(len(order), dtype=GLuint)
+    return order, rank[indices]
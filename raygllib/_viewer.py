@@ -2,9 +2,10 @@ from OpenGL.GL import *
 import pyglet
 
 from .render import (
-    Renderer, SilhouetteRenderer, WireframeRenderer
+    Renderer, SilhouetteRenderer, WireframeRenderer, set_camera, set_lights,
 )
 from .camera import Camera
+from .gllib import glState
 from .panel import ControlPanel
 from .model import Scene
 # from .utils import debug
@@ -90,11 +91,11 @@ class Viewer:
 
         materials = []
         for model in self.scene.models:
-            material = model.geometry.material
-            if material in materials:
-                continue
-            self.panel.add_material(material)
-            materials.append(material)
+            for material in model.geometry.materials:
+                if material in materials:
+                    continue
+                self.panel.add_material(material)
+                materials.append(material)
 
         joints = []
         for model in self.scene.models:
@@ -129,12 +130,14 @@ class Viewer:
         # Rw = self.wireframeRenderer
         models = self.scene.models
         with ControlPanel.lock:
+            # The FPS display of the last frame is drawn by pyglet.
+            glState.invalidate()
             glClearColor(.9, .9, .9, 1.)
             # glClearColor(0, 0, 0, 1)
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-            glEnable(GL_DEPTH_TEST)
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-            # glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
+            glState.enable(GL_DEPTH_TEST)
+            glState.polygon_mode(GL_FILL)
+            # glState.polygon_mode(GL_LINE)
             glCullFace(GL_BACK)
 
             with R.batch_draw():
@@ -142,29 +145,24 @@ class Viewer:
                 #     glUniform1i(R.get_uniform_loc('targetJoint'), -1)
                 # else:
                 #     glUniform1i(R.get_uniform_loc('targetJoint'), self.selectedJoint.id)
-                R.set_matrix('viewMat', self.camera.viewMat)
-                R.set_matrix('projMat', self.camera.projMat)
-                R.set_lights(self.scene.lights)
+                set_camera(self.camera.viewMat, self.camera.projMat)
+                set_lights(self.scene.lights)
                 for model in models:
                     R.draw_model(model)
 
             # if self.silhouetteEnable:
             #     with Rs.batch_draw():
-            #         Rs.set_matrix('viewMat', self.camera.viewMat)
-            #         Rs.set_matrix('projMat', self.camera.projMat)
             #         glUniform1f(Rs.get_uniform_loc('edgeWidth'), self.silhouetteWidth)
             #         for model in models:
             #             Rs.draw_model(model)
 
             # if self.wireframeEnable:
             #     with Rw.batch_draw():
-            #         Rw.set_matrix('viewMat', self.camera.viewMat)
-            #         Rw.set_matrix('projMat', self.camera.projMat)
             #         for model in models:
             #             Rw.draw_model(model)
 
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-            glDisable(GL_DEPTH_TEST)
+            glState.polygon_mode(GL_FILL)
+            glState.disable(GL_DEPTH_TEST)
             self.fpsDisplay.draw()
 
     def show(self):
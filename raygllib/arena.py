@@ -0,0 +1,255 @@
+"""
+A pool of large GL buffers which vertex stores and index buffers are
+suballocated from.
+
+A scene of many small geometries would otherwise make a buffer object for
+each of its vertex stores and index buffers. Here they are slices (page,
+offset, length) of a few pages of `config.bufferArenaPageSize` bytes, placed
+first fit in a free list of each page whose neighbouring free blocks are
+merged. A page holds vertices and indices alike, so the geometries of a page
+share their VAOs and are drawn with base vertex and index offsets, which
+leaves the bindings alone from one geometry to the next. Once a scene is
+freed, `compact` moves the slices left in half empty pages together.
+"""
+import bisect
+from OpenGL.GL import *
+from . import config
+from .gllib import GLResource, VertexArray, glState
+from .utils import debug
+
+
+class FreeList:
+    """
+    First fit allocator of the bytes [0, capacity), which only does the
+    bookkeeping. `blocks` are the free (offset, size) blocks, by offset.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.blocks = [(0, capacity)] if capacity else []
+        # Size of each allocation, by offset
+        self.sizes = {}
+
+    def alloc(self, size, alignment=1):
+        """
+        Return the offset of `size` free bytes starting at a multiple of
+        `alignment`, or None if they don't fit.
+        """
+        size = max(size, 1)
+        for i, (start, blockSize) in enumerate(self.blocks):
+            offset = -(-start // alignment) * alignment
+            end = start + blockSize
+            if offset + size > end:
+                continue
+            rest = []
+            if offset > start:
+                rest.append((start, offset - start))
+            if offset + size < end:
+                rest.append((offset + size, end - offset - size))
+            self.blocks[i:i + 1] = rest
+            self.sizes[offset] = size
+            return offset
+        return None
+
+    def release(self, offset):
+        """
+        Free the allocation at `offset`, merging it with free neighbours.
+        """
+        size = self.sizes.pop(offset)
+        i = bisect.bisect(self.blocks, (offset, size))
+        if i < len(self.blocks) and self.blocks[i][0] == offset + size:
+            size += self.blocks.pop(i)[1]
+        if i > 0 and sum(self.blocks[i - 1]) == offset:
+            i -= 1
+            offset, size = self.blocks[i][0], self.blocks[i][1] + size
+            del self.blocks[i]
+        self.blocks.insert(i, (offset, size))
+
+    @property
+    def used(self):
+        return sum(self.sizes.values())
+
+    @property
+    def largestFree(self):
+        return max((size for _, size in self.blocks), default=0)
+
+
+class ArenaPage(GLResource):
+    """
+    One buffer object of an arena, with the free list of its bytes.
+    """
+    def __init__(self, size, usage_hint=GL_STATIC_DRAW):
+        GLResource.__init__(self)
+        self.size = size
+        self.usageHint = usage_hint
+        self.freeList = FreeList(size)
+        self.slices = set()
+
+    def allocate(self):
+        id = glGenBuffers(1)
+        glState.bind_buffer(GL_COPY_WRITE_BUFFER, id)
+        glBufferData(GL_COPY_WRITE_BUFFER, self.size, None, self.usageHint)
+        return id
+
+    def dealloc(self):
+        glDeleteBuffers(1, [self.glId])
+        glState.forget_buffer(self.glId)
+
+
+class BufferSlice:
+    """
+    `nbytes` bytes at `offset` of an ArenaPage.
+    """
+    def __init__(self, page, offset, nbytes, alignment):
+        self.page = page
+        self.offset = offset
+        self.nbytes = nbytes
+        self.alignment = alignment
+
+    @property
+    def glId(self):
+        return self.page.glId
+
+
+def plan_pages(sizes, page_size):
+    """
+    Return the page each allocation of `sizes`, a list of (size, alignment),
+    goes to when they are placed in order in pages of `page_size` bytes, or
+    of their own size for larger ones, and the free lists of the pages.
+    """
+    freeLists, placement = [], []
+    for size, alignment in sizes:
+        for i, freeList in enumerate(freeLists):
+            offset = freeList.alloc(size, alignment)
+            if offset is not None:
+                break
+        else:
+            freeLists.append(FreeList(max(page_size, size)))
+            i, offset = len(freeLists) - 1, freeLists[-1].alloc(size, alignment)
+        placement.append((i, offset))
+    return placement, freeLists
+
+
+class BufferArena:
+    """
+    Pages of static vertex and index data, see the module docs.
+    """
+    _default = None
+
+    def __init__(self, page_size=None, usage_hint=GL_STATIC_DRAW):
+        self.pageSize = page_size or config.bufferArenaPageSize
+        self.usageHint = usage_hint
+        self.pages = []
+        # VAOs by (program, vertex format spec, vertex page, index page)
+        self._vaos = {}
+
+    @classmethod
+    def get_default(cls):
+        """
+        Return the arena the static geometries are put in.
+        """
+        if cls._default is None:
+            cls._default = BufferArena()
+        return cls._default
+
+    def alloc(self, data, alignment=1):
+        """
+        Copy the numpy array `data` into a new slice starting at a multiple
+        of `alignment` bytes. Return the BufferSlice.
+        """
+        for page in self.pages:
+            offset = page.freeList.alloc(data.nbytes, alignment)
+            if offset is not None:
+                break
+        else:
+            page = ArenaPage(max(self.pageSize, data.nbytes), self.usageHint)
+            self.pages.append(page)
+            offset = page.freeList.alloc(data.nbytes, alignment)
+        slice = BufferSlice(page, offset, data.nbytes, alignment)
+        page.slices.add(slice)
+        if data.nbytes:
+            glState.bind_buffer(GL_COPY_WRITE_BUFFER, page.glId)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, offset, data.nbytes, data)
+        return slice
+
+    def release(self, slice):
+        slice.page.freeList.release(slice.offset)
+        slice.page.slices.remove(slice)
+
+    def get_vao(self, program, format, vertices, indices):
+        """
+        Return the VAO of `program` for the page of the slices of VertexBuffer
+        `vertices` and IndexBuffer `indices`, shared by the geometries with
+        the same pages and vertex format.
+        """
+        vertexPage, indexPage = vertices.slice.page, indices.slice.page
+        key = (program, format.spec, vertexPage, indexPage)
+        if key not in self._vaos:
+            self._vaos[key] = VertexArray(program, [(vertexPage, format)], indexPage)
+        return self._vaos[key]
+
+    def compact(self):
+        """
+        Free the empty pages, and move all the slices to new pages if they
+        then fit in fewer of them. The VAOs of the arena are remade, those
+        made elsewhere for its buffers must be too.
+        """
+        for page in self.pages:
+            if not page.slices:
+                page.free()
+        self.pages = [page for page in self.pages if page.slices]
+        slices = sorted(
+            (slice for page in self.pages for slice in page.slices),
+            key=lambda slice: (self.pages.index(slice.page), slice.offset))
+        placement, freeLists = plan_pages(
+            [(slice.nbytes, slice.alignment) for slice in slices], self.pageSize)
+        self.free_vaos()
+        if len(freeLists) >= len(self.pages):
+            return
+        pages = []
+        for freeList in freeLists:
+            page = ArenaPage(freeList.capacity, self.usageHint)
+            page.freeList = freeList
+            pages.append(page)
+        for slice, (i, offset) in zip(slices, placement):
+            glState.bind_buffer(GL_COPY_READ_BUFFER, slice.glId)
+            glState.bind_buffer(GL_COPY_WRITE_BUFFER, pages[i].glId)
+            if slice.nbytes:
+                glCopyBufferSubData(
+                    GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, slice.offset, offset, slice.nbytes)
+            slice.page, slice.offset = pages[i], offset
+            pages[i].slices.add(slice)
+        for page in self.pages:
+            page.free()
+        debug('buffer arena: compacted {} pages into {}'.format(len(self.pages), len(pages)))
+        self.pages = pages
+
+    def stats(self):
+        """
+        Return a dict of the number of pages and slices, the bytes of the
+        pages, used and free, the largest free block and the fragmentation,
+        the share of the free bytes outside of it.
+        """
+        capacity = sum(page.size for page in self.pages)
+        used = sum(page.freeList.used for page in self.pages)
+        largestFree = max((page.freeList.largestFree for page in self.pages), default=0)
+        free = capacity - used
+        return {
+            'nPages': len(self.pages),
+            'nSlices': sum(len(page.slices) for page in self.pages),
+            'capacity': capacity,
+            'used': used,
+            'free': free,
+            'largestFree': largestFree,
+            'fragmentation': 1 - largestFree / free if free else 0.,
+        }
+
+    def free_vaos(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
+
+    def free(self):
+        self.free_vaos()
+        for page in self.pages:
+            page.free()
+        self.pages = []
@@ -0,0 +1,218 @@
+"""
+Static batching: the static models sharing a material are transformed by
+their model matrices and merged into one vertex store and index buffer,
+drawn with one multi-draw call per pass. A table of the sub-ranges of each
+model keeps them apart, so that they can still be hidden, picked or taken
+out of their batch.
+"""
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from .gllib import VertexBuffer, IndexBuffer, VertexArray
+from .model import ArmaturedModel, Geometry, quantize_snorm16
+
+
+def transform_store(arrays, matrix):
+    """
+    Return the store arrays of a geometry with positions and normals
+    transformed by `matrix`, in the same encoding.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    arrays = dict(arrays)
+    vertices = np.asarray(arrays['vertices'], dtype=np.float64)
+    w = vertices.dot(matrix[3, :3]) + matrix[3, 3]
+    arrays['vertices'] = (
+        (vertices.dot(matrix[:3, :3].T) + matrix[:3, 3]) / w[:, None]).astype(np.float32)
+    normals = arrays['normals']
+    compact = normals.dtype == np.int16
+    normals = np.asarray(normals, dtype=np.float64) / (32767. if compact else 1.)
+    # Like the shaders, which transform normals by the model matrix.
+    normals = normals.dot(matrix[:3, :3].T)
+    if compact:
+        # They are normalized per fragment, so one scale for all of them
+        # keeps the shading and fits them in [-1, 1].
+        scale = np.linalg.norm(normals, axis=1).max() if len(normals) else 0
+        normals = quantize_snorm16(normals / (scale if scale > 0 else 1))
+    arrays['normals'] = normals.astype(arrays['normals'].dtype)
+    return arrays
+
+
+class StaticBatch:
+    """
+    The models of one material merged into one vertex store, pre-transformed
+    so that they are drawn with an identity model matrix. All the levels of
+    detail of each model are kept, `ranges[i, level]` gives the (offset,
+    count) of level `level` of model i in the index buffer.
+    """
+    def __init__(self, material, models):
+        self.material = material
+        self.models = list(models)
+        self.format = self.models[0].geometry.format
+        self.matrices = np.array([model.matrix for model in self.models], dtype=np.float32)
+        items, indices, ranges, vertexStarts = [], [], [], [0]
+        nLevels = max(len(model.geometry.lodRanges) for model in self.models)
+        nIndices = 0
+        for model in self.models:
+            geometry = model.geometry
+            arrays = transform_store(geometry.arrays, model.matrix)
+            items.append(self.format.pack({
+                name: array for name, array, _ in Geometry.vertex_attributes(arrays)}))
+            geometryIndices = [arrays['indices']]
+            if arrays.get('lodIndices') is not None:
+                geometryIndices.append(arrays['lodIndices'])
+            indices.append(np.concatenate(geometryIndices).astype(np.uint32) + vertexStarts[-1])
+            # Models with fewer levels draw their coarsest one instead.
+            levels = geometry.lodRanges
+            levels = levels + levels[-1:] * (nLevels - len(levels))
+            ranges.append([(nIndices + offset, length) for offset, length in levels])
+            nIndices += len(indices[-1])
+            vertexStarts.append(vertexStarts[-1] + len(arrays['vertices']))
+        # First store vertex of each model, and the total
+        self.vertexStarts = np.array(vertexStarts, dtype=np.int64)
+        self.ranges = np.array(ranges, dtype=np.int64).reshape((len(self.models), nLevels, 2))
+        indices = np.concatenate(indices)
+        if self.vertexStarts[-1] <= 1 << 16:
+            indices = indices.astype(np.uint16)
+        self.indexDtype = indices.dtype
+        self.vertices = VertexBuffer(np.concatenate(items), GL_STATIC_DRAW)
+        self.indices = IndexBuffer(indices)
+        self._adjIndices = None
+        self._adjRanges = None
+        self._vaos = {}
+
+    @property
+    def ready(self):
+        """
+        Whether its buffers can be drawn from, not waiting in an
+        uploads.UploadQueue.
+        """
+        return self.vertices.ready and self.indices.ready
+
+    def model_at(self, vertex):
+        """
+        Return the model store vertex `vertex` belongs to, e.g. for picking.
+        """
+        return self.models[np.searchsorted(self.vertexStarts, vertex, 'right') - 1]
+
+    def visible_ranges(self, ranges, levels=None):
+        """
+        Return (offsets, counts) of the visible models for glMultiDrawElements.
+        """
+        visible = np.fromiter((model.visible for model in self.models), bool, len(self.models))
+        if levels is not None:
+            ranges = ranges[np.arange(len(self.models)), np.minimum(levels, ranges.shape[1] - 1)]
+        ranges = ranges[visible]
+        offsets = (ranges[:, 0] * self.indices.itemSize).astype(np.uintp)
+        return offsets, ranges[:, 1].astype(np.int32)
+
+    def get_vao(self, program, adjacency=False):
+        key = (program, adjacency)
+        if key not in self._vaos:
+            indices = self.adjIndices if adjacency else self.indices
+            self._vaos[key] = VertexArray(program, [(self.vertices, self.format)], indices)
+        return self._vaos[key]
+
+    @property
+    def adjIndices(self):
+        """
+        The adjacency indices of the models, made on first use.
+        """
+        if self._adjIndices is None:
+            indices = [
+                model.geometry.make_adj_indices().astype(np.uint32) + start
+                for model, start in zip(self.models, self.vertexStarts)]
+            counts = np.array([len(i) for i in indices], dtype=np.int64)
+            self._adjRanges = np.stack([np.cumsum(counts) - counts, counts], axis=1)
+            self._adjIndices = IndexBuffer(np.concatenate(indices).astype(self.indexDtype))
+        return self._adjIndices
+
+    def draw(self, program):
+        levels = np.fromiter((model.lod for model in self.models), np.int64, len(self.models))
+        self._multi_draw(GL_TRIANGLES, self.get_vao(program), self.indices,
+                         *self.visible_ranges(self.ranges, levels))
+
+    def draw_adjacency(self, program):
+        vao = self.get_vao(program, True)
+        self._multi_draw(GL_TRIANGLES_ADJACENCY, vao, self.adjIndices,
+                         *self.visible_ranges(self._adjRanges))
+
+    def _multi_draw(self, mode, vao, indices, offsets, counts):
+        if len(counts) == 0:
+            return
+        vao.bind()
+        glMultiDrawElements(
+            mode, counts, indices.glType,
+            (ctypes.c_void_p * len(offsets))(*offsets.tolist()), len(counts))
+
+    def free(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
+        self.vertices.free()
+        self.indices.free()
+        if self._adjIndices is not None:
+            self._adjIndices.free()
+
+
+class StaticBatching:
+    """
+    Split models into StaticBatches, one per material, and the models drawn
+    on their own: armatured models, those of several materials, those taken
+    out with `unbatch` and those whose matrix changed since they were
+    batched.
+    """
+    def __init__(self):
+        self.batches = []
+        self.others = []
+        self._unbatched = set()
+        self._key = None
+
+    def update(self, models):
+        """
+        Return (batches, others) for `models`, remaking the batches when the
+        models changed.
+        """
+        models = list(models)
+        key = [(id(model), id(model.geometry)) for model in models]
+        if key == self._key:
+            for batch in self.batches:
+                matrices = np.array([m.matrix for m in batch.models], dtype=np.float32)
+                moved = (matrices != batch.matrices).any(axis=(1, 2))
+                if moved.any():
+                    self._unbatched.update(
+                        id(m) for m, flag in zip(batch.models, moved) if flag)
+                    self._key = None
+        if key != self._key:
+            self.regroup(models)
+            self._key = key
+        return self.batches, self.others
+
+    def unbatch(self, model):
+        """
+        Draw `model` on its own from the next update on.
+        """
+        self._unbatched.add(id(model))
+        self._key = None
+
+    def regroup(self, models):
+        self.free()
+        byMaterial = {}
+        for model in models:
+            geometry = model.geometry
+            # Geometries of several materials are drawn on their own.
+            if (not isinstance(model, ArmaturedModel) and id(model) not in self._unbatched
+                    and len(geometry.materials) == 1):
+                key = (id(geometry.material), geometry.format.spec)
+                byMaterial.setdefault(key, []).append(model)
+        batched = set()
+        for group in byMaterial.values():
+            self.batches.append(StaticBatch(group[0].geometry.material, group))
+            batched.update(map(id, group))
+        self.others = [model for model in models if id(model) not in batched]
+
+    def free(self):
+        for batch in self.batches:
+            batch.free()
+        self.batches = []
+        self.others = []
+        self._key = None
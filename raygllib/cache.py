@@ -0,0 +1,187 @@
+"""
+On-disk cache of processed data.
+
+An entry holds nested dicts, lists, numbers, strings and numpy arrays. It is
+stored as a directory with a manifest.json describing the structure and one
+.npy file per large array, so the arrays can be memory-mapped when the entry
+is read back. Entries are evicted in least-recently-used order once the total
+size exceeds the limit.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from .utils import debug
+
+MANIFEST_FILE = 'manifest.json'
+# Maps source files to their hash, see ArrayCache.file_key.
+INDEX_FILE = '.index.json'
+# Arrays smaller than this are kept in the manifest instead of their own file.
+INLINE_BYTES = 1024
+
+
+def hash_file(path, version=''):
+    """
+    Return a hex digest of the content of file `path` and `version`.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha1.update(block)
+    sha1.update(str(version).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def encode(data, arrays):
+    """
+    Turn `data` into something json can dump. Large arrays are appended to
+    `arrays` and replaced by a reference.
+    """
+    if isinstance(data, np.ndarray):
+        if data.nbytes <= INLINE_BYTES and data.dtype.fields is None:
+            return {'__array__': data.ravel().tolist(), 'dtype': data.dtype.str,
+                'shape': data.shape}
+        arrays.append(data)
+        return {'__array__': len(arrays) - 1}
+    elif isinstance(data, dict):
+        return {k: encode(v, arrays) for k, v in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return [encode(x, arrays) for x in data]
+    elif isinstance(data, np.generic):
+        return data.item()
+    return data
+
+
+def decode(data, path, mmap_mode='r'):
+    if isinstance(data, dict):
+        if '__array__' in data:
+            value = data['__array__']
+            if isinstance(value, int):
+                return np.load(os.path.join(path, '{}.npy'.format(value)), mmap_mode=mmap_mode)
+            return np.array(value, dtype=data['dtype']).reshape(data['shape'])
+        return {k: decode(v, path, mmap_mode) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [decode(x, path, mmap_mode) for x in data]
+    return data
+
+
+class ArrayCache:
+    def __init__(self, path, max_bytes):
+        """
+        :param str path: Directory of the cache.
+        :param int max_bytes: Total size of the entries to keep.
+        """
+        self.path = os.path.expanduser(path)
+        self.maxBytes = max_bytes
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def file_key(self, path, version=''):
+        """
+        Return a key for the content of file `path` and `version`. The hash
+        of the content is only computed again when the mtime or the size of
+        the file changed since it was last computed.
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        indexPath = os.path.join(self.path, INDEX_FILE)
+        try:
+            with open(indexPath, 'r') as infile:
+                index = json.load(infile)
+        except (OSError, ValueError):
+            index = {}
+        fileStat = [stat.st_mtime_ns, stat.st_size]
+        item = index.get(path)
+        if item is not None and item[:2] == fileStat:
+            digest = item[2]
+        else:
+            digest = hash_file(path)
+            index[path] = fileStat + [digest]
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                # Written aside and renamed, so other processes read either
+                # the old or the new index. A lost update only costs a rehash.
+                fd, tmpPath = tempfile.mkstemp(prefix='.tmp-', dir=self.path)
+                with os.fdopen(fd, 'w') as outfile:
+                    json.dump(index, outfile)
+                os.replace(tmpPath, indexPath)
+            except OSError as e:
+                debug('fail to write cache index', e)
+        return hashlib.sha1('{}:{}'.format(digest, version).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return the data stored under `key`, or None if there isn't any.
+        """
+        entryPath = self._entry_path(key)
+        try:
+            with open(os.path.join(entryPath, MANIFEST_FILE), 'r') as infile:
+                manifest = json.load(infile)
+            # The mtime of an entry is its last use time.
+            os.utime(entryPath)
+            return decode(manifest['data'], entryPath)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, data):
+        os.makedirs(self.path, exist_ok=True)
+        tmpPath = tempfile.mkdtemp(prefix='.tmp-', dir=self.path)
+        try:
+            arrays = []
+            manifest = {'data': encode(data, arrays)}
+            size = 0
+            for i, array in enumerate(arrays):
+                arrayPath = os.path.join(tmpPath, '{}.npy'.format(i))
+                np.save(arrayPath, np.ascontiguousarray(array))
+                size += os.path.getsize(arrayPath)
+            manifest['size'] = size
+            with open(os.path.join(tmpPath, MANIFEST_FILE), 'w') as outfile:
+                json.dump(manifest, outfile)
+            self.invalidate(key)
+            # Rename is atomic, so readers never see a half written entry.
+            os.rename(tmpPath, self._entry_path(key))
+        except OSError as e:
+            debug('fail to write cache entry', key, e)
+            shutil.rmtree(tmpPath, ignore_errors=True)
+            return
+        self.evict()
+
+    def invalidate(self, key):
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def entries(self):
+        """
+        Return a list of (key, size, lastUseTime), most recently used first.
+        """
+        result = []
+        try:
+            keys = os.listdir(self.path)
+        except OSError:
+            return result
+        for key in keys:
+            if key.startswith('.'):
+                continue
+            entryPath = self._entry_path(key)
+            try:
+                with open(os.path.join(entryPath, MANIFEST_FILE), 'r') as infile:
+                    size = json.load(infile)['size']
+                result.append((key, size, os.path.getmtime(entryPath)))
+            except (OSError, ValueError, KeyError):
+                continue
+        result.sort(key=lambda x: x[2], reverse=True)
+        return result
+
+    def evict(self):
+        total = 0
+        for i, (key, size, _) in enumerate(self.entries()):
+            total += size
+            # Always keep the most recently used entry.
+            if total > self.maxBytes and i > 0:
+                debug('evict cache entry', key)
+                self.invalidate(key)
@@ -3,6 +3,69 @@ defaultLightPower = 1.
 toonRenderEnable = True
 toonRenderEdges = [0.16585, 0.38049, 0.72195, 1.0]
 silhouetteEnable = False
+# Build the adjacency used by silhouettes in the background after loading,
+# instead of on the first silhouette draw.
+adjacencyPrecompute = False
 wireframeEnable = False
 drawJointAxis = False
 maxToonEdges = 10
+sceneCacheEnable = True
+cacheDir = '~/.cache/raygllib'
+sceneCacheMaxBytes = 2 << 30
+modelCacheMaxBytes = 1 << 30
+# Number of processes geometries are processed in when a scene is loaded.
+# 1 processes them serially, None uses one process per CPU.
+loadWorkers = 1
+# Number of joint influences kept per vertex, 4 or 8.
+maxJointsPerVertex = 4
+# Store normals as int16, uvs as half floats, joint weights and ids as bytes
+# and indices as uint16 when possible, see Geometry.compact_arrays.
+compactVertices = False
+# Entries of the post-transform vertex cache triangles are reordered for
+# when geometries are processed, 0 to keep the order of the file.
+vertexCacheSize = 16
+# Also sort clusters of triangles to reduce overdraw, see model.sort_clusters.
+overdrawOptimize = False
+# Levels of detail made for each geometry when it is processed, each with
+# about lodRatio of the vertices of the previous one, see lod.py. Off (0) by
+# default as they add to the load time and the memory of every geometry.
+lodLevels = 0
+lodRatio = 0.25
+# A level is drawn when it has at most this many triangles per pixel of the
+# projected bounding sphere of the model, see lod.LodSelector.
+lodTrianglesPerPixel = 1.
+lodHysteresis = 0.25
+# Draw the models sharing a geometry with one instanced draw call when there
+# are at least instancingMinCount of them, see instancing.py.
+instancingEnable = True
+instancingMinCount = 2
+# Merge static models sharing a material into one pre-transformed buffer
+# drawn with one call per pass, see batching.py. Set it before loading.
+staticBatching = False
+# Put the vertex stores and index buffers of geometries in slices of a few
+# large buffers of bufferArenaPageSize bytes, see arena.py.
+bufferArenaEnable = True
+bufferArenaPageSize = 32 << 20
+# Submit the static models with glMultiDrawElementsIndirect, which needs
+# OpenGL 4.3 and bufferArenaEnable, see indirect.py. It replaces instancing.
+indirectDraw = False
+# Threads decoding the images of materials, None for the default of
+# ThreadPoolExecutor, and the cache of the decoded images, see textures.py.
+textureWorkers = None
+textureCacheEnable = True
+textureCacheMaxBytes = 2 << 30
+# Upload the buffers and textures of a new scene over several frames, at most
+# uploadBudgetMs milliseconds or uploadBudgetBytes bytes of them a frame, see
+# uploads.py. Models are drawn once their buffers are uploaded.
+uploadQueueEnable = True
+uploadBudgetMs = 4.
+uploadBudgetBytes = 8 << 20
+# Check the shadow of the GL state against glGet* before relying on it, see
+# gllib.GLState. It is slow, for debugging only.
+glStateVerify = False
+# Draw the models left by batching, instancing and indirect draws in the
+# order of their material, geometry and depth, see renderqueue.py.
+renderQueueEnable = True
+# Lights the shaders are given, the length of the arrays of the light uniform
+# block, see render.LIGHT_BLOCK.
+maxLights = 16
@@ -0,0 +1,461 @@
+"""
+A streaming COLLADA reader for the subset raygllib uses.
+
+pycollada builds a Python object for every element and spends most of its time
+turning large <float_array> and <p> texts into arrays. This reader walks the
+document with ElementTree.iterparse instead: numeric texts are parsed with
+numpy a chunk at a time as soon as their element ends, and each library
+element is reduced to the few arrays and strings needed, then cleared. The
+result is the same plain data `model.read_scene` returns.
+
+Supported: geometries (all triangles/polylist primitives), skin controllers,
+joint hierarchies, point lights, phong/blinn/lambert materials with a color or
+texture diffuse and the visual scene referenced by <scene>.
+"""
+import os
+import re
+from xml.etree import ElementTree
+import numpy as np
+from collada.scene import makeRotationMatrix
+
+from . import config
+from .utils import debug
+from .model import (
+    Material, add_geometry, read_skin, process_scene_geometries,
+)
+
+# Numeric texts longer than this are parsed in pieces of about this size.
+CHUNK_SIZE = 1 << 22
+_SPACE = re.compile(r'\s')
+
+
+def local_name(elem):
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def url_id(url):
+    return url[1:] if url and url.startswith('#') else url
+
+
+def parse_array(text, dtype, count=None):
+    """
+    Parse whitespace separated numbers. Long texts are parsed in chunks that
+    are split on whitespace; `count`, the number of values if known, lets
+    the result be allocated once instead of concatenating the chunks.
+    """
+    if text is None or text.isspace():
+        return np.zeros(0, dtype=dtype)
+    if len(text) <= CHUNK_SIZE:
+        return np.fromstring(text, dtype=dtype, sep=' ')
+    chunks = []
+    start = 0
+    while start < len(text):
+        match = _SPACE.search(text, start + CHUNK_SIZE)
+        end = match.start() if match else len(text)
+        chunks.append(np.fromstring(text[start:end], dtype=dtype, sep=' '))
+        start = end
+    total = sum(len(chunk) for chunk in chunks)
+    if count is None or count != total:
+        return np.concatenate(chunks)
+    result = np.empty(count, dtype=dtype)
+    offset = 0
+    for chunk in chunks:
+        result[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return result
+
+
+def parse_color(text):
+    color = [float(x) for x in text.split()]
+    # Same as pycollada: pad to rgba with an opaque alpha.
+    if len(color) < 4:
+        color = (color + [0.] * 3)[:3] + [1.]
+    return tuple(color)
+
+
+class DaeReader:
+    """
+    Reduces library elements to plain data as iterparse emits them. Large
+    arrays are parsed as soon as their element ends and kept in `arrays`,
+    keyed by element, until the library element that owns them is read.
+    """
+    ARRAY_TYPES = {
+        'float_array': np.float32, 'int_array': np.int32,
+        'p': np.int32, 'v': np.int32, 'vcount': np.int32,
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {}
+        self.geometries = {}
+        self.controllers = {}
+        self.lights = {}
+        self.images = {}
+        self.effects = {}
+        self.materials = {}
+        self.visualScenes = {}
+        self.sceneUrl = None
+
+    def parse(self):
+        handlers = {
+            'geometry': self.read_geometry,
+            'controller': self.read_controller,
+            'light': self.read_light,
+            'image': self.read_image,
+            'effect': self.read_effect,
+            'material': self.read_material,
+            'visual_scene': self.read_visual_scene,
+            'instance_visual_scene': self.read_instance_visual_scene,
+        }
+        for event, elem in ElementTree.iterparse(self.path, events=('end',)):
+            name = local_name(elem)
+            if name in self.ARRAY_TYPES:
+                count = elem.get('count')
+                self.arrays[elem] = parse_array(
+                    elem.text, self.ARRAY_TYPES[name],
+                    int(count) if count is not None else None)
+                elem.text = None
+            elif name in handlers:
+                handlers[name](elem)
+                for child in elem.iter():
+                    self.arrays.pop(child, None)
+                elem.clear()
+
+    def children(self, elem, name):
+        return [child for child in elem if local_name(child) == name]
+
+    def child(self, elem, name):
+        for child in elem:
+            if local_name(child) == name:
+                return child
+        return None
+
+    def array_of(self, elem, name):
+        child = self.child(elem, name)
+        if child is None:
+            return np.zeros(0, dtype=self.ARRAY_TYPES[name])
+        return self.arrays[child]
+
+    def read_sources(self, elem):
+        """
+        Return {id: data} of the <source>s of elem. Float sources are shaped
+        (-1, nParams) like pycollada's, names are lists of str.
+        """
+        sources = {}
+        for source in self.children(elem, 'source'):
+            accessor = source.find('.//{*}accessor')
+            nParams = len(accessor.findall('{*}param')) if accessor is not None else 1
+            names = self.child(source, 'Name_array')
+            if names is None:
+                names = self.child(source, 'IDREF_array')
+            if names is not None:
+                sources[source.get('id')] = (names.text or '').split()
+                continue
+            data = self.array_of(source, 'float_array')
+            data[np.isnan(data)] = 0
+            if nParams == 3 and accessor is not None and \
+                    [p.get('name') for p in accessor.findall('{*}param')] == ['S', 'T', 'P']:
+                # Same as pycollada: 3D texture coordinates lose P.
+                data = data.reshape((-1, 3))[:, :2]
+            else:
+                data = data.reshape((-1, max(nParams, 1)))
+            sources[source.get('id')] = data
+        return sources
+
+    def read_geometry(self, elem):
+        mesh = self.child(elem, 'mesh')
+        if mesh is None:
+            return
+        sources = self.read_sources(mesh)
+        vertexInputs = {}
+        vertices = self.child(mesh, 'vertices')
+        if vertices is not None:
+            vertexInputs = [
+                (i.get('semantic'), url_id(i.get('source')))
+                for i in self.children(vertices, 'input')]
+        primitives = []
+        for poly in mesh:
+            if local_name(poly) not in ('triangles', 'polylist'):
+                continue
+            inputs = {}
+            for input in self.children(poly, 'input'):
+                semantic = input.get('semantic')
+                source = url_id(input.get('source'))
+                if semantic == 'VERTEX':
+                    for semantic, source in vertexInputs:
+                        semantic = 'VERTEX' if semantic == 'POSITION' else semantic
+                        inputs.setdefault(semantic, []).append(sources[source])
+                else:
+                    inputs.setdefault(semantic, []).append(sources[source])
+            primitives.append({
+                'material': poly.get('material'),
+                'vertex': inputs['VERTEX'][0],
+                'normal': inputs['NORMAL'][0] if 'NORMAL' in inputs else None,
+                'texcoordset': tuple(inputs.get('TEXCOORD', ())),
+                'index': self.array_of(poly, 'p'),
+            })
+        if not primitives:
+            debug('unsupported geometry', elem.get('id'))
+            return
+        self.geometries[elem.get('id')] = {
+            'name': elem.get('name'),
+            'primitives': primitives,
+        }
+
+    def read_controller(self, elem):
+        skin = self.child(elem, 'skin')
+        if skin is None:
+            return
+        sources = self.read_sources(skin)
+        joints = {
+            i.get('semantic'): sources[url_id(i.get('source'))]
+            for i in self.children(self.child(skin, 'joints'), 'input')}
+        vertexWeights = self.child(skin, 'vertex_weights')
+        offsets = {}
+        weightSource = None
+        for input in self.children(vertexWeights, 'input'):
+            offsets[input.get('semantic')] = int(input.get('offset'))
+            if input.get('semantic') == 'WEIGHT':
+                weightSource = sources[url_id(input.get('source'))]
+        nIndices = max(offsets.values()) + 1
+        influences = self.array_of(vertexWeights, 'v').reshape((-1, nIndices))
+        bindShapeMatrix = self.child(skin, 'bind_shape_matrix')
+        jointNames = joints['JOINT']
+        jointMatrices = joints['INV_BIND_MATRIX'].reshape((-1, 4, 4))
+        self.controllers[elem.get('id')] = {
+            'name': elem.get('name'),
+            'geometry': url_id(skin.get('source')),
+            'bindShapeMatrix': (
+                np.fromstring(bindShapeMatrix.text, dtype=np.float32, sep=' ')
+                .reshape((4, 4))
+                if bindShapeMatrix is not None
+                else np.identity(4, dtype=np.float32)),
+            'weights': weightSource.flatten(),
+            'vcounts': self.array_of(vertexWeights, 'vcount'),
+            'weightIndex': influences[:, offsets['WEIGHT']],
+            'jointIndex': influences[:, offsets['JOINT']],
+            'jointNames': jointNames,
+            'jointMatrices': dict(zip(jointNames, jointMatrices)),
+        }
+
+    def read_light(self, elem):
+        color = elem.find('{*}technique_common/*/{*}color')
+        self.lights[elem.get('id')] = {
+            'color': (tuple(float(x) for x in color.text.split())
+                if color is not None else (1., 1., 1.)),
+        }
+
+    def read_image(self, elem):
+        initFrom = self.child(elem, 'init_from')
+        path = initFrom.text.strip() if initFrom is not None and initFrom.text else None
+        if path is not None and not os.path.isabs(path):
+            path = os.path.normpath(os.path.join(os.path.dirname(self.path), path))
+        self.images[elem.get('id')] = path
+
+    def read_effect(self, elem):
+        params = {}
+        for param in elem.iterfind('.//{*}newparam'):
+            surface = param.find('{*}surface/{*}init_from')
+            sampler = param.find('{*}sampler2D/{*}source')
+            if surface is not None:
+                params[param.get('sid')] = ('surface', surface.text.strip())
+            elif sampler is not None:
+                params[param.get('sid')] = ('sampler', sampler.text.strip())
+        shading = elem.find('{*}profile_COMMON/{*}technique/*')
+        props = {}
+        for prop in (shading if shading is not None else ()):
+            name = local_name(prop)
+            value = prop[0] if len(prop) else None
+            if value is None:
+                continue
+            valueType = local_name(value)
+            if valueType == 'color':
+                props[name] = parse_color(value.text)
+            elif valueType == 'float':
+                props[name] = float(value.text)
+            elif valueType == 'texture':
+                props[name] = self.resolve_texture(value.get('texture'), params)
+        self.effects[elem.get('id')] = props
+
+    def resolve_texture(self, texture, params):
+        """Return the image id a <texture> refers to, through its sampler."""
+        if params.get(texture, (None,))[0] == 'sampler':
+            surface = params.get(params[texture][1])
+            if surface is not None and surface[0] == 'surface':
+                return {'image': surface[1]}
+        return {'image': texture}
+
+    def read_material(self, elem):
+        effect = self.child(elem, 'instance_effect')
+        self.materials[elem.get('id')] = {
+            'name': elem.get('name'),
+            'effect': url_id(effect.get('url')) if effect is not None else None,
+        }
+
+    def read_visual_scene(self, elem):
+        self.visualScenes[elem.get('id')] = [
+            self.read_node(node) for node in self.children(elem, 'node')]
+
+    def read_instance_visual_scene(self, elem):
+        self.sceneUrl = url_id(elem.get('url'))
+
+    def read_node(self, elem):
+        """Reduce a <node> to a dict, children and transforms in document order."""
+        matrices = []
+        children = []
+        for child in elem:
+            name = local_name(child)
+            if name == 'node':
+                children.append(self.read_node(child))
+            elif name.startswith('instance_'):
+                children.append({'kind': name[len('instance_'):], 'url': url_id(child.get('url'))})
+            elif name == 'extra':
+                children.append({'kind': 'extra'})
+            elif name in ('matrix', 'translate', 'rotate', 'scale'):
+                matrices.append(self.read_transform(name, child.text))
+        if not matrices:
+            matrix = np.identity(4, dtype=np.float32)
+        elif len(matrices) == 1:
+            matrix = matrices[0].copy()
+        else:
+            # Same order of products as pycollada.
+            matrix = np.identity(4, dtype=np.float32)
+            for m in matrices:
+                matrix = np.dot(matrix, m)
+        return {
+            'kind': 'node', 'name': elem.get('name'), 'sid': elem.get('sid'),
+            'type': elem.get('type', '') or elem.get('TYPE', ''),
+            'matrix': matrix, 'children': children,
+        }
+
+    @staticmethod
+    def read_transform(name, text):
+        values = np.fromstring(text, dtype=np.float32, sep=' ')
+        if name == 'matrix':
+            return values.reshape((4, 4))
+        matrix = np.identity(4, dtype=np.float32)
+        if name == 'translate':
+            matrix[:3, 3] = values
+        elif name == 'scale':
+            matrix[0, 0], matrix[1, 1], matrix[2, 2] = values
+        else:
+            x, y, z, angle = values
+            matrix = makeRotationMatrix(x, y, z, angle * np.pi / 180.)
+        return matrix
+
+    def scene_nodes(self):
+        if self.sceneUrl in self.visualScenes:
+            return self.visualScenes[self.sceneUrl]
+        return next(iter(self.visualScenes.values()), [])
+
+
+def read_joint_hierachy(node, matrix, parent, joints):
+    jointId = len(joints['names'])
+    joints['names'].append(node['sid'])
+    joints['parents'].append(parent)
+    joints['matrices'].append(matrix.dot(node['matrix']))
+    for subNode in node['children']:
+        if subNode['kind'] == 'node':
+            read_joint_hierachy(subNode, np.eye(4, dtype=np.float32), jointId, joints)
+
+
+def read_material(data, reader, materialId, materialIds):
+    """
+    Return the id of the material in data['materials'], adding it if needed.
+    """
+    if materialId in materialIds:
+        return materialIds[materialId]
+    daeMat = reader.materials[materialId]
+    effect = reader.effects.get(daeMat['effect'], {})
+    diffuse = effect.get('diffuse', (0., 0., 0., 1.))
+    if isinstance(diffuse, dict):
+        with open(reader.images[diffuse['image']], 'rb') as infile:
+            # Keep the encoded image; it is decoded when the material is built.
+            diffuse = np.frombuffer(infile.read(), dtype=np.uint8)
+        diffuseType = Material.DIFFUSE_TEXTURE
+    else:
+        diffuse = diffuse[:3]
+        diffuseType = Material.DIFFUSE_COLOR
+    ambient = effect.get('ambient', (0., 0., 0., 1.))
+    data['materials'].append({
+        'name': daeMat['name'],
+        'diffuseType': diffuseType,
+        'diffuse': diffuse,
+        'Ka': ambient[:3] if not isinstance(ambient, dict) else (0., 0., 0.),
+        'Ks': effect.get('specular', (0., 0., 0., 1.))[:3],
+        'shininess': effect.get('shininess'),
+    })
+    materialIds[materialId] = len(data['materials']) - 1
+    return materialIds[materialId]
+
+
+def read_geometry(data, reader, geometryId, materialIds):
+    geom = reader.geometries[geometryId]
+    return add_geometry(data, geom['name'], [
+        (read_material(data, reader, poly['material'], materialIds),
+         poly['vertex'], poly['normal'], poly['texcoordset'], poly['index'])
+        for poly in geom['primitives']])
+
+
+def read_scene_fast(path, workers=None):
+    """
+    Same as `model.read_scene`, with the file parsed by DaeReader instead of
+    pycollada.
+    """
+    reader = DaeReader(path)
+    reader.parse()
+    data = {
+        'materials': [],
+        'geometries': [],
+        'models': [],
+        'armatures': {},
+        'lights': [],
+        'emptyNodes': {},
+    }
+    materialIds = {}
+    # Geometry ids by url, see model.read_scene
+    geometryIds = {}
+    for node in reader.scene_nodes():
+        matrix = node['matrix']
+        nodeName = node['name']
+        if not node['children']:
+            if nodeName is not None:
+                # An empty node
+                data['emptyNodes'][nodeName] = matrix
+            continue
+        child = node['children'][0]
+        if child['kind'] == 'geometry':
+            if child['url'] not in geometryIds:
+                geometryIds[child['url']] = read_geometry(
+                    data, reader, child['url'], materialIds)
+            geometryId = geometryIds[child['url']]
+            data['models'].append({
+                'name': nodeName, 'geometry': geometryId, 'matrix': matrix,
+            })
+        elif child['kind'] == 'controller':
+            controller = reader.controllers[child['url']]
+            geometryId = read_geometry(
+                data, reader, controller['geometry'], materialIds)
+            model = {
+                'name': nodeName, 'geometry': geometryId,
+                'matrix': controller['bindShapeMatrix'],
+            }
+            model.update(read_skin(
+                data, controller['weights'], controller['vcounts'],
+                controller['weightIndex'], controller['jointIndex'],
+                controller['name'].replace('.', '_'),
+                controller['jointNames'], controller['jointMatrices'],
+            ))
+            data['models'].append(model)
+        elif child['kind'] == 'light':
+            data['lights'].append({
+                'pos': matrix[0:3, 3], 'color': reader.lights[child['url']]['color'],
+                'power': config.defaultLightPower,
+            })
+        elif child['kind'] == 'node' and child['type'].lower() == 'joint':
+            joints = {'names': [], 'parents': [], 'matrices': []}
+            read_joint_hierachy(child, matrix, -1, joints)
+            joints['matrices'] = np.array(joints['matrices'])
+            data['armatures'][nodeName] = joints
+    process_scene_geometries(data, workers)
+    return data
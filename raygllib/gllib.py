@@ -1,13 +1,20 @@
+import re
+import ctypes
+from concurrent.futures import Future
 from contextlib import contextmanager
 from OpenGL.GL import *
+import numpy as np
+from . import config
 from .utils import debug
-# import numpy as np
 # from . import utils
 
 __all__ = [
     'compile_shader', 'report_limits', 'AttributeNotFoundError',
-    'UniformNotFoundError', 'VertexBuffer', 'IndexBuffer', 'Program',
-    'Texture2D', 'TextureUnit', 'VertexBufferSlot'
+    'UniformNotFoundError', 'GLStateError', 'GLState', 'glState',
+    'VertexBuffer', 'IndexBuffer', 'IndirectBuffer',
+    'PixelUnpackBuffer', 'Program', 'Texture2D', 'TextureUnit', 'Uniform',
+    'UniformBlock', 'UniformBuffer', 'expand_uniform_blocks', 'VertexBufferSlot',
+    'VertexFormat', 'VertexArray',
 ]
 
 
@@ -36,7 +43,234 @@ class AttributeNotFoundError(Exception):
 class UniformNotFoundError(Exception):
     pass
 
+class GLStateError(Exception):
+    pass
+
+
+def _get_int(pname):
+    return int(np.asarray(glGetIntegerv(pname)).flat[0])
+
+
+class GLState:
+    """
+    A shadow of the GL state set while drawing: the program in use, the
+    bound VAO, textures and buffers, the enabled capabilities and attribute
+    arrays of each VAO, the polygon mode, the blend function and the depth
+    mask. Calls setting a state to the value it has are dropped. State set
+    by other code, pyglet for one, isn't seen, so the shadow is forgotten
+    with `invalidate` once it may have been. If config.glStateVerify is set,
+    the shadow of each state is checked with glGet* before it is relied on,
+    raising GLStateError if they differ.
+    """
+    # The glGet* names of the bindings of each texture and buffer target
+    TEXTURE_BINDINGS = {
+        GL_TEXTURE_2D: GL_TEXTURE_BINDING_2D,
+        GL_TEXTURE_CUBE_MAP: GL_TEXTURE_BINDING_CUBE_MAP,
+    }
+    BUFFER_BINDINGS = {
+        GL_ARRAY_BUFFER: GL_ARRAY_BUFFER_BINDING,
+        GL_ELEMENT_ARRAY_BUFFER: GL_ELEMENT_ARRAY_BUFFER_BINDING,
+        GL_DRAW_INDIRECT_BUFFER: GL_DRAW_INDIRECT_BUFFER_BINDING,
+        GL_PIXEL_UNPACK_BUFFER: GL_PIXEL_UNPACK_BUFFER_BINDING,
+        GL_COPY_READ_BUFFER: GL_COPY_READ_BUFFER_BINDING,
+        GL_COPY_WRITE_BUFFER: GL_COPY_WRITE_BUFFER_BINDING,
+        GL_UNIFORM_BUFFER: GL_UNIFORM_BUFFER_BINDING,
+    }
+
+    def __init__(self):
+        # The shadow state by key, see query
+        self._state = {}
+        # Calls made and dropped
+        self.nCalls = self.nSkipped = 0
+
+    def invalidate(self):
+        """
+        Forget the shadow state, so that the next call setting each state
+        is made.
+        """
+        self._state.clear()
+
+    def stats(self):
+        return {'calls': self.nCalls, 'skipped': self.nSkipped}
+
+    def reset_stats(self):
+        self.nCalls = self.nSkipped = 0
+
+    def query(self, key):
+        """
+        Return the actual value of the state of shadow key `key`.
+        """
+        kind = key[0]
+        if kind == 'program':
+            return _get_int(GL_CURRENT_PROGRAM)
+        if kind == 'vertexArray':
+            return _get_int(GL_VERTEX_ARRAY_BINDING)
+        if kind == 'activeTexture':
+            return _get_int(GL_ACTIVE_TEXTURE)
+        if kind == 'texture':
+            # Of the active unit, which is key[1].
+            return _get_int(self.TEXTURE_BINDINGS[key[2]])
+        if kind == 'buffer':
+            return _get_int(self.BUFFER_BINDINGS[key[-1]])
+        if kind == 'cap':
+            return bool(glIsEnabled(key[1]))
+        if kind == 'attrib':
+            return bool(glGetVertexAttribiv(key[2], GL_VERTEX_ATTRIB_ARRAY_ENABLED)[0])
+        if kind == 'polygonMode':
+            return _get_int(GL_POLYGON_MODE)
+        if kind == 'blendFunc':
+            return (_get_int(GL_BLEND_SRC_RGB), _get_int(GL_BLEND_DST_RGB))
+        if kind == 'depthMask':
+            return bool(np.asarray(glGetBooleanv(GL_DEPTH_WRITEMASK)).flat[0])
+        raise KeyError(key)
+
+    def verify(self, key):
+        shadow = self._state.get(key)
+        if shadow is None:
+            return
+        actual = self.query(key)
+        if actual != shadow:
+            raise GLStateError('{}: shadow {}, actual {}'.format(key, shadow, actual))
+
+    def check(self):
+        """
+        Verify the whole shadow state, but the textures of inactive units
+        and the state of unbound VAOs, which glGet* doesn't tell.
+        """
+        unit = self._state.get(('activeTexture',))
+        vertexArray = self._state.get(('vertexArray',))
+        for key in list(self._state):
+            if key[0] == 'texture' and key[1] != unit:
+                continue
+            if len(key) == 3 and key[0] in ('buffer', 'attrib') and key[1] != vertexArray:
+                continue
+            self.verify(key)
+
+    def _set(self, key, value, func, *args):
+        """
+        Call `func` with `args` unless the shadow of `key` is `value`
+        already, and make it so.
+        """
+        if config.glStateVerify:
+            self.verify(key)
+        if key is not None and self._state.get(key) == value:
+            self.nSkipped += 1
+            return
+        func(*args)
+        self.nCalls += 1
+        if key is not None:
+            self._state[key] = value
+
+    def _vertex_array_key(self, *key):
+        """
+        Return `key` of the state of the bound VAO, None if it is unknown.
+        """
+        vertexArray = self._state.get(('vertexArray',))
+        return None if vertexArray is None else key[:1] + (vertexArray,) + key[1:]
+
+    def use_program(self, id):
+        self._set(('program',), id, glUseProgram, id)
+
+    def bind_vertex_array(self, id):
+        self._set(('vertexArray',), id, glBindVertexArray, id)
+
+    def active_texture(self, unit):
+        """
+        :param int unit: GL_TEXTURE0 + i
+        """
+        self._set(('activeTexture',), unit, glActiveTexture, unit)
+
+    def bind_texture(self, target, id):
+        """
+        Bind texture `id` to `target` of the active unit.
+        """
+        unit = self._state.get(('activeTexture',))
+        if unit is None:
+            unit = self._state[('activeTexture',)] = _get_int(GL_ACTIVE_TEXTURE)
+        self._set(('texture', unit, target), id, glBindTexture, target, id)
+
+    def bind_buffer(self, target, id):
+        if target == GL_ELEMENT_ARRAY_BUFFER:
+            # Part of the state of the bound VAO
+            key = self._vertex_array_key('buffer', target)
+        else:
+            key = ('buffer', target)
+        self._set(key, id, glBindBuffer, target, id)
+
+    def enable(self, cap):
+        self._set(('cap', cap), True, glEnable, cap)
+
+    def disable(self, cap):
+        self._set(('cap', cap), False, glDisable, cap)
+
+    def enable_attrib_array(self, location):
+        """
+        Enable the attribute array at `location` of the bound VAO.
+        """
+        self._set(
+            self._vertex_array_key('attrib', location), True,
+            glEnableVertexAttribArray, location)
+
+    def disable_attrib_array(self, location):
+        self._set(
+            self._vertex_array_key('attrib', location), False,
+            glDisableVertexAttribArray, location)
+
+    def set_attrib_arrays(self, locations):
+        """
+        Enable the attribute arrays at `locations` of the bound VAO, and
+        disable the others it was told to enable.
+        """
+        for key, enabled in list(self._state.items()):
+            if (enabled and key[0] == 'attrib' and key[2] not in locations
+                    and key == self._vertex_array_key('attrib', key[2])):
+                self.disable_attrib_array(key[2])
+        for location in locations:
+            self.enable_attrib_array(location)
+
+    def polygon_mode(self, mode):
+        """
+        Set the polygon mode of front and back faces.
+        """
+        self._set(('polygonMode',), mode, glPolygonMode, GL_FRONT_AND_BACK, mode)
+
+    def blend_func(self, src, dst):
+        self._set(('blendFunc',), (src, dst), glBlendFunc, src, dst)
+
+    def depth_mask(self, flag):
+        self._set(('depthMask',), bool(flag), glDepthMask, GL_TRUE if flag else GL_FALSE)
+
+    def forget_texture(self, id):
+        """
+        Unbind the texture `id` once deleted, as GL did.
+        """
+        self._forget(id, ('texture',))
+
+    def forget_buffer(self, id):
+        self._forget(id, ('buffer',))
+
+    def forget_vertex_array(self, id):
+        self._forget(id, ('vertexArray',))
+        for key in list(self._state):
+            if key[0] in ('buffer', 'attrib') and len(key) == 3 and key[1] == id:
+                del self._state[key]
+
+    def _forget(self, id, kinds):
+        for key, value in self._state.items():
+            if key[0] in kinds and value == id:
+                self._state[key] = 0
+
+
+# The GL state of the context the renderers draw in
+glState = GLState()
+
+
 class GLResource:
+    # Set while the resource waits in an uploads.UploadQueue
+    pending = False
+    # Bytes the allocation uploads, for the budget of an UploadQueue
+    nbytes = 0
+
     def __init__(self):
         self._id = None
 
@@ -53,6 +287,27 @@ class GLResource:
     def dealloc(self):
         raise NotImplementedError()
 
+    @property
+    def ready(self):
+        """
+        Whether it can be drawn with now, not waiting in an upload queue.
+        """
+        return not self.pending
+
+    @property
+    def loaded(self):
+        """
+        Whether its data is there, so that allocating it doesn't wait.
+        """
+        return True
+
+    def upload(self, unpack_buffer=None):
+        """
+        Allocate the resource if it isn't yet, see uploads.UploadQueue.
+        Textures stream their data through PixelUnpackBuffer `unpack_buffer`.
+        """
+        self.glId
+
     def free(self):
         if self._id is None:
             return
@@ -71,26 +326,122 @@ class Texture2D(GLResource):
     WRAP_S = GL_REPEAT
     WRAP_T = GL_REPEAT
 
+    _placeholder = None
+    # The grey image of the placeholder, drawn too for images which failed
+    # to load
+    PLACEHOLDER_IMAGE = [np.full((1, 1, 4), 192, dtype=np.uint8)]
+
     def __init__(self, image):
+        """
+        :param image: A PIL image, its mip levels as (height, width, 4) uint8
+            arrays, largest first, or a concurrent.futures.Future of them,
+            see textures.load_texture.
+        """
         GLResource.__init__(self)
         self.image = image
 
-    def allocate(self):
-        textureId = self.make_texture(self.image)
+    @classmethod
+    def get_placeholder(cls):
+        """
+        Return a grey texture to draw with until a texture is ready.
+        """
+        if cls._placeholder is None:
+            cls._placeholder = Texture2D(cls.PLACEHOLDER_IMAGE)
+        return cls._placeholder
+
+    @property
+    def loaded(self):
+        return self._id is not None or not isinstance(self.image, Future) or self.image.done()
+
+    @property
+    def ready(self):
+        """
+        Whether the image is there and not waiting in an upload queue, so
+        that glId doesn't wait for it.
+        """
+        return not self.pending and self.loaded
+
+    @property
+    def nbytes(self):
+        if self._id is not None or not self.loaded:
+            return 0
+        image = self.get_image()
+        if isinstance(image, list):
+            return sum(level.nbytes for level in image)
+        return image.size[0] * image.size[1] * 4
+
+    def get_image(self):
+        """
+        Return the image, waiting for it if it is a future. One which failed
+        to load is logged and replaced with that of the placeholder.
+        """
+        if isinstance(self.image, Future):
+            try:
+                self.image = self.image.result()
+            except Exception as e:
+                debug('failed to load texture:', repr(e))
+                self.image = self.PLACEHOLDER_IMAGE
+        return self.image
+
+    def upload(self, unpack_buffer=None):
+        if self._id is None:
+            self._id = self.allocate(unpack_buffer)
+
+    def allocate(self, unpack_buffer=None):
+        image = self.get_image()
         del self.image
-        glBindTexture(GL_TEXTURE_2D, textureId)
-        self.configure()
+        if isinstance(image, list):
+            textureId = self.make_texture_levels(image, unpack_buffer)
+            self.configure(len(image) - 1)
+        elif unpack_buffer is not None:
+            textureId = self.make_texture_levels(
+                [np.asarray(image.convert('RGBA'))], unpack_buffer)
+            self.configure()
+        else:
+            textureId = self.make_texture(image)
+            self.configure()
         return textureId
 
-    def configure(self):
+    def configure(self, max_level=None):
+        """
+        Set the parameters of the bound texture. Its mipmaps are generated
+        unless its levels up to `max_level` were given.
+        """
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, self.WRAP_S)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, self.WRAP_T)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, self.MAG_FILTER)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, self.MIN_FILTER)
-        glGenerateMipmap(GL_TEXTURE_2D)
+        if max_level is None:
+            glGenerateMipmap(GL_TEXTURE_2D)
+        else:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, max_level)
 
     def dealloc(self):
         glDeleteTextures([self.glId])
+        glState.forget_texture(self.glId)
+
+    @staticmethod
+    def make_texture_levels(levels, unpack_buffer=None):
+        """
+        Make a texture of mip levels `levels`, read from PixelUnpackBuffer
+        `unpack_buffer` once staged there if given.
+        """
+        if unpack_buffer is not None:
+            sources = [ctypes.c_void_p(offset) for offset in unpack_buffer.stage(levels)]
+        else:
+            sources = [np.ascontiguousarray(level) for level in levels]
+        textureId = glGenTextures(1)
+        glState.bind_texture(GL_TEXTURE_2D, textureId)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for i, (level, source) in enumerate(zip(levels, sources)):
+            height, width = level.shape[:2]
+            glTexImage2D(
+                GL_TEXTURE_2D, i, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                source)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        if unpack_buffer is not None:
+            glState.bind_buffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        return textureId
 
     @staticmethod
     def make_texture(image):
@@ -98,7 +449,7 @@ class Texture2D(GLResource):
         width, height = image.size
         glEnable(GL_TEXTURE_2D)
         textureId = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, textureId)
+        glState.bind_texture(GL_TEXTURE_2D, textureId)
         assert textureId > 0, 'Fail to get new texture id.'
         glTexImage2D(
             GL_TEXTURE_2D,
@@ -113,6 +464,164 @@ class Texture2D(GLResource):
         return textureId
 
 
+class PixelUnpackBuffer(GLResource):
+    """
+    A stream buffer the data of textures is staged in, so that glTexImage2D
+    copies it from buffer memory rather than from the client's.
+    """
+    def allocate(self):
+        return glGenBuffers(1)
+
+    def dealloc(self):
+        glDeleteBuffers(1, [self.glId])
+        glState.forget_buffer(self.glId)
+
+    def stage(self, arrays):
+        """
+        Copy numpy arrays `arrays` one after the other into the buffer, in
+        place of the previous data, and leave it bound. Return their offsets.
+        """
+        offsets = [0]
+        for array in arrays:
+            offsets.append(offsets[-1] + array.nbytes)
+        glState.bind_buffer(GL_PIXEL_UNPACK_BUFFER, self.glId)
+        # New storage, the previous data may still be read by the driver.
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, offsets[-1], None, GL_STREAM_DRAW)
+        for offset, array in zip(offsets, arrays):
+            if array.nbytes:
+                glBufferSubData(
+                    GL_PIXEL_UNPACK_BUFFER, offset, array.nbytes, np.ascontiguousarray(array))
+        return offsets[:-1]
+
+
+class UniformBlock:
+    """
+    The std140 layout of a uniform block shared by the programs, at a fixed
+    binding point. The shaders declare it with a line
+    `#pragma uniform_block <name>`, which Program replaces with the
+    declaration, see glsl, so that its members are defined in one place.
+
+    Its dtype is that of a numpy structured array of the block's memory. A
+    member is a field of the shape of its type, (4, 4) for a mat4, and an
+    array of `count` items one of shape (count, 4), std140 padding each
+    item to 16 bytes, or (count, 4, 4) for matrices. Matrices are row major,
+    as numpy's.
+    """
+    # Base alignment, size, numpy type and shape of each member type
+    TYPES = {
+        'float': (4, 4, np.float32, ()),
+        'int': (4, 4, np.int32, ()),
+        'bool': (4, 4, np.int32, ()),
+        'vec2': (8, 8, np.float32, (2,)),
+        'vec3': (16, 12, np.float32, (3,)),
+        'vec4': (16, 16, np.float32, (4,)),
+        'mat4': (16, 64, np.float32, (4, 4)),
+    }
+    # The blocks by name, bound by each program which has them when linked
+    blocks = {}
+
+    def __init__(self, name, binding, members):
+        """
+        :param members: A list of (name, type) tuples, or (name, type,
+            count) for arrays, type a key of TYPES.
+        """
+        for other in self.blocks.values():
+            if other.binding == binding and other.name != name:
+                raise ValueError('Binding {} is taken by {}'.format(binding, other.name))
+        self.name = name
+        self.binding = binding
+        self.members = members
+        names, formats, offsets = [], [], []
+        offset = 0
+        for member in members:
+            memberName, type, count = (member + (None,))[:3]
+            align, size, dtype, shape = self.TYPES[type]
+            if count is not None:
+                # Items of arrays are aligned and padded to a vec4.
+                align = 16
+                shape = (count,) + (shape if len(shape) == 2 else (4,))
+                size = count * ((size + 15) // 16 * 16)
+            offset = (offset + align - 1) // align * align
+            names.append(memberName)
+            formats.append((dtype, shape))
+            offsets.append(offset)
+            offset += size
+        self.dtype = np.dtype({
+            'names': names, 'formats': formats, 'offsets': offsets,
+            'itemsize': (offset + 15) // 16 * 16,
+        })
+        self.blocks[name] = self
+
+    def glsl(self):
+        """
+        Return the GLSL declaration of the block.
+        """
+        lines = ['layout(std140, row_major) uniform {} {{'.format(self.name)]
+        for member in self.members:
+            memberName, type, count = (member + (None,))[:3]
+            if count is not None:
+                memberName += '[{}]'.format(count)
+            lines.append('    {} {};'.format(type, memberName))
+        lines.append('};')
+        return '\n'.join(lines)
+
+
+def expand_uniform_blocks(source):
+    """
+    Return shader `source` with its `#pragma uniform_block <name>` lines
+    replaced by the declarations of the UniformBlocks.
+    """
+    def replace(match):
+        try:
+            return UniformBlock.blocks[match.group(1)].glsl()
+        except KeyError:
+            raise KeyError('Unknown uniform block ' + match.group(1)) from None
+    return re.sub(r'^[ \t]*#[ \t]*pragma[ \t]+uniform_block[ \t]+(\w+)[ \t]*$',
+                  replace, source, flags=re.MULTILINE)
+
+
+class UniformBuffer(GLResource):
+    """
+    The buffer of a UniformBlock, bound to its binding point. Its data, a
+    0-d numpy array of the block's dtype, is written in place and sent by
+    update, which skips the upload if it didn't change. It counts the
+    uploads skipped (nHits) and made (nMisses).
+    """
+    def __init__(self, block):
+        super().__init__()
+        self.block = block
+        self._array = np.zeros(1, dtype=block.dtype)
+        self.data = self._array.reshape(())
+        self.nbytes = block.dtype.itemsize
+        self._sent = None
+        self.nHits = self.nMisses = 0
+
+    def allocate(self):
+        id = glGenBuffers(1)
+        glState.bind_buffer(GL_UNIFORM_BUFFER, id)
+        glBufferData(GL_UNIFORM_BUFFER, self.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.block.binding, id)
+        return id
+
+    def dealloc(self):
+        glDeleteBuffers(1, [self.glId])
+        glState.forget_buffer(self.glId)
+        self._sent = None
+
+    def update(self):
+        """
+        Upload the data, if it isn't the one uploaded last.
+        """
+        data = self._array.view(np.uint8)
+        if self._sent is not None and (self._sent == data).all():
+            self.nHits += 1
+            return
+        self.nMisses += 1
+        glState.bind_buffer(GL_UNIFORM_BUFFER, self.glId)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.nbytes, data)
+        self._sent = data.copy()
+
+
 class DynamicVertexBuffer(GLResource):
     def __init__(self, usageHint=GL_DYNAMIC_DRAW):
         super().__init__()
@@ -125,10 +634,11 @@ class DynamicVertexBuffer(GLResource):
 
     def dealloc(self):
         glDeleteBuffers(1, [self.glId])
+        glState.forget_buffer(self.glId)
 
     def set_data(self, data):
         self._len = len(data)
-        glBindBuffer(GL_ARRAY_BUFFER, self.glId)
+        glState.bind_buffer(GL_ARRAY_BUFFER, self.glId)
         glBufferData(GL_ARRAY_BUFFER, data, self.usageHint)
 
     def __len__(self):
@@ -138,26 +648,69 @@ class DynamicVertexBuffer(GLResource):
 class VertexBuffer(GLResource):
     target = GL_ARRAY_BUFFER
 
-    def __init__(self, data, usage_hint=GL_STATIC_DRAW):
+    def __init__(self, data, usage_hint=GL_STATIC_DRAW, arena=None):
         """
         :param numpy.ndarray data: Data that to be put into buffer
         :param GLenum usage_hint: The last parameter of glBufferData
+        :param arena.BufferArena arena: If given, the data is put in a slice
+            of a page of the arena instead of a buffer of its own. glId is
+            then the id of the page and `offset` where the data starts.
         """
         self.usageHint = usage_hint
         self._length = len(data)
+        self.nbytes = data.nbytes
         self.data = data
+        self.arena = arena
         GLResource.__init__(self)
 
     def allocate(self):
-        id = glGenBuffers(1)
         data = self.data
         del self.data
-        glBindBuffer(self.target, id)
+        if self.arena is not None:
+            # Items start at a multiple of their size, so that the offset of
+            # a vertex store is a whole base vertex.
+            return self.arena.alloc(data, data.nbytes // len(data) if len(data) else 1)
+        id = glGenBuffers(1)
+        glState.bind_buffer(self.target, id)
         glBufferData(self.target, data, self.usageHint)
         return id
 
     def dealloc(self):
-        glDeleteBuffers(1, [self.glId])
+        if self.arena is not None:
+            self.arena.release(self._id)
+        else:
+            glDeleteBuffers(1, [self.glId])
+            glState.forget_buffer(self.glId)
+
+    @property
+    def glId(self):
+        id = GLResource.glId.fget(self)
+        return id if self.arena is None else id.glId
+
+    @property
+    def slice(self):
+        """
+        The arena.BufferSlice of the data, in an arena.
+        """
+        return GLResource.glId.fget(self)
+
+    @property
+    def offset(self):
+        """
+        Where the data starts in buffer glId, in bytes.
+        """
+        return 0 if self.arena is None else self.slice.offset
+
+    def update(self, data, start=0):
+        """
+        Overwrite the items of the buffer from item `start` with `data`, of
+        the same type as the data the buffer was made with.
+        """
+        if len(data) == 0:
+            return
+        glState.bind_buffer(self.target, self.glId)
+        glBufferSubData(
+            self.target, self.offset + start * (data.nbytes // len(data)), data.nbytes, data)
 
     def __len__(self):
         return self._length
@@ -165,6 +718,23 @@ class VertexBuffer(GLResource):
 
 class IndexBuffer(VertexBuffer):
     target = GL_ELEMENT_ARRAY_BUFFER
+    GL_TYPES = {1: GL_UNSIGNED_BYTE, 2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT}
+
+    def __init__(self, data, usage_hint=GL_STATIC_DRAW, arena=None):
+        """
+        :param numpy.ndarray data: uint8, uint16 or uint32 indices. glType is
+            the type to pass to glDrawElements, itemSize its size in bytes.
+        """
+        super().__init__(data, usage_hint, arena)
+        self.itemSize = data.dtype.itemsize
+        self.glType = self.GL_TYPES[data.dtype.itemsize]
+
+
+class IndirectBuffer(VertexBuffer):
+    """
+    Draw commands read by glMultiDrawElementsIndirect, see indirect.py.
+    """
+    target = GL_DRAW_INDIRECT_BUFFER
 
 
 class VertexBufferSlot:
@@ -174,20 +744,206 @@ class VertexBufferSlot:
         self.dataType = data_type
 
     def set_buffer(self, buffer):
-        glBindBuffer(GL_ARRAY_BUFFER, buffer.glId)
+        glState.bind_buffer(GL_ARRAY_BUFFER, buffer.glId)
         glVertexAttribPointer(
             self.location, self.itemSize, self.dataType, GL_FALSE, 0, None)
 
 
+class VertexFormat:
+    """
+    Layout of interleaved vertex attributes, declared as a string like
+    'vertexPos:3f, vertexNormal:3f, vertexUV:2f'. A field is the name of the
+    shader attribute, its number of components and a type: f (float), h
+    (half float), b, ub, s, us, i or ui (signed and unsigned 8, 16, 32 bit
+    integers), followed by n if the integer is normalized to [-1, 1] or
+    [0, 1]. Fields are aligned to 4 bytes.
+    """
+    TYPES = {
+        'f': (np.float32, GL_FLOAT), 'h': (np.float16, GL_HALF_FLOAT),
+        'b': (np.int8, GL_BYTE), 'ub': (np.uint8, GL_UNSIGNED_BYTE),
+        's': (np.int16, GL_SHORT), 'us': (np.uint16, GL_UNSIGNED_SHORT),
+        'i': (np.int32, GL_INT), 'ui': (np.uint32, GL_UNSIGNED_INT),
+    }
+    _FIELD = re.compile(r'^\s*(\w+)\s*:\s*([1-4])(f|h|ub|us|ui|b|s|i)(n?)\s*$')
+
+    def __init__(self, spec):
+        self.spec = spec
+        # A list of (name, size, dtype, glType, normalized, offset)
+        self.fields = []
+        offset = 0
+        for field in spec.split(','):
+            match = self._FIELD.match(field)
+            if match is None:
+                raise ValueError('bad vertex format field: {!r}'.format(field))
+            name, size, type, normalized = match.groups()
+            dtype, glType = self.TYPES[type]
+            self.fields.append((name, int(size), dtype, glType, bool(normalized), offset))
+            offset += -(-int(size) * np.dtype(dtype).itemsize // 4) * 4
+        self.stride = offset
+        self.dtype = np.dtype({
+            'names': [f[0] for f in self.fields],
+            'formats': [(f[2], (f[1],)) for f in self.fields],
+            'offsets': [f[5] for f in self.fields],
+            'itemsize': self.stride,
+        })
+
+    @classmethod
+    def field(cls, name, array, normalized=False):
+        """
+        Return the field spec of attribute `name` for the rows of `array`,
+        taking the type from its dtype.
+        """
+        dtype = np.asarray(array).dtype
+        for code, (fieldDtype, _) in cls.TYPES.items():
+            if fieldDtype == dtype:
+                break
+        else:
+            raise ValueError('no vertex attribute type for {}'.format(dtype))
+        size = array.shape[1] if array.ndim > 1 else 1
+        normalized = normalized and dtype.kind in 'iu'
+        return '{}:{}{}{}'.format(name, size, code, 'n' if normalized else '')
+
+    def pack(self, arrays):
+        """
+        Interleave `arrays`, a dict from field name to an (n, size) array.
+        """
+        n = len(arrays[self.fields[0][0]])
+        result = np.zeros(n, dtype=self.dtype)
+        for name, size, dtype, _, _, _ in self.fields:
+            result[name] = np.asarray(arrays[name]).reshape((n, size))
+        return result
+
+    def __repr__(self):
+        return 'VertexFormat({!r})'.format(self.spec)
+
+
+class VertexArray(GLResource):
+    def __init__(self, program, bindings, indices=None):
+        """
+        Record the attribute bindings of `program` in a VAO, so a draw only
+        binds the VAO.
+
+        :param Program program: Attributes the program doesn't use are skipped.
+        :param bindings: A list of (VertexBuffer, VertexFormat) or
+            (VertexBuffer, VertexFormat, divisor). Attributes with a divisor
+            advance once per `divisor` instances instead of once per vertex.
+        :param IndexBuffer indices: The element buffer, also recorded.
+        """
+        GLResource.__init__(self)
+        self.program = program
+        self.bindings = bindings
+        self.indices = indices
+
+    def allocate(self):
+        id = glGenVertexArrays(1)
+        glState.bind_vertex_array(id)
+        for binding in self.bindings:
+            buffer, format = binding[:2]
+            divisor = binding[2] if len(binding) > 2 else 0
+            glState.bind_buffer(GL_ARRAY_BUFFER, buffer.glId)
+            for name, size, _, glType, normalized, offset in format.fields:
+                try:
+                    loc = self.program.get_attrib_loc(name)
+                except AttributeNotFoundError:
+                    continue
+                glState.enable_attrib_array(loc)
+                glVertexAttribPointer(
+                    loc, size, glType, GL_TRUE if normalized else GL_FALSE,
+                    format.stride, ctypes.c_void_p(offset))
+                if divisor:
+                    glVertexAttribDivisor(loc, divisor)
+        if self.indices is not None:
+            glState.bind_buffer(GL_ELEMENT_ARRAY_BUFFER, self.indices.glId)
+        glState.bind_vertex_array(0)
+        return id
+
+    def dealloc(self):
+        glDeleteVertexArrays(1, [self.glId])
+        glState.forget_vertex_array(self.glId)
+
+    def bind(self):
+        glState.bind_vertex_array(self.glId)
+
+
+class Uniform:
+    """
+    An active uniform of a linked Program. It keeps the value it was last
+    set to, so that setting the same value again is skipped, and counts the
+    calls it skipped (nHits) and made (nMisses).
+    """
+    # glUniform*v function, number of components and type of the values of
+    # each uniform type. Samplers and the types not listed are set as ints.
+    SETTERS = {
+        GL_FLOAT: (glUniform1fv, 1, np.float32),
+        GL_FLOAT_VEC2: (glUniform2fv, 2, np.float32),
+        GL_FLOAT_VEC3: (glUniform3fv, 3, np.float32),
+        GL_FLOAT_VEC4: (glUniform4fv, 4, np.float32),
+        GL_INT_VEC2: (glUniform2iv, 2, np.int32),
+        GL_INT_VEC3: (glUniform3iv, 3, np.int32),
+        GL_INT_VEC4: (glUniform4iv, 4, np.int32),
+        GL_BOOL_VEC2: (glUniform2iv, 2, np.int32),
+        GL_BOOL_VEC3: (glUniform3iv, 3, np.int32),
+        GL_BOOL_VEC4: (glUniform4iv, 4, np.int32),
+        GL_UNSIGNED_INT: (glUniform1uiv, 1, np.uint32),
+        GL_FLOAT_MAT2: (glUniformMatrix2fv, 4, np.float32),
+        GL_FLOAT_MAT3: (glUniformMatrix3fv, 9, np.float32),
+        GL_FLOAT_MAT4: (glUniformMatrix4fv, 16, np.float32),
+    }
+    MATRIX_TYPES = {GL_FLOAT_MAT2, GL_FLOAT_MAT3, GL_FLOAT_MAT4}
+
+    def __init__(self, name, location, type, size):
+        """
+        :param int type: The type given by glGetActiveUniform.
+        :param int size: The length of an array uniform, 1 otherwise.
+        """
+        self.name = name
+        self.location = location
+        self.type = type
+        self.size = size
+        self.func, self.components, self.dtype = self.SETTERS.get(
+            type, (glUniform1iv, 1, np.int32))
+        self.isMatrix = type in self.MATRIX_TYPES
+        self.value = None
+        self.transpose = False
+        self.nHits = self.nMisses = 0
+
+    def set(self, value, transpose=False):
+        """
+        Set the uniform to `value`, a number or an array of any shape, which
+        fills as many items of an array uniform as it has. Matrices are read
+        in column major order unless `transpose`.
+        """
+        value = np.asarray(value, dtype=self.dtype)
+        last = self.value
+        if (last is not None and transpose == self.transpose
+                and last.shape == value.shape and (last == value).all()):
+            self.nHits += 1
+            return
+        self.nMisses += 1
+        # A copy, the caller may change its array in place.
+        self.value = value.copy()
+        self.transpose = transpose
+        count = value.size // self.components
+        if not count:
+            return
+        if self.isMatrix:
+            self.func(self.location, count, transpose, value)
+        else:
+            self.func(self.location, count, value)
+
+
 class Program(GLResource):
-    def __init__(self, shaderDatas, bufs):
+    def __init__(self, shaderDatas, bufs=()):
         """
         shaderDatas: A list of (filename, shaderType) tuples.
-        bufs: A list of (attributeName, size, typeEnum) tuples.
+        bufs: A list of (attributeName, size, typeEnum) tuples, for the
+            attributes set by set_buffer. Attributes read from a VertexArray
+            need not be listed.
         """
         GLResource.__init__(self)
         self._alocs = {}  # Attribute locations buffer
-        self._ulocs = {}  # Uniform locations buffer
+        # The active uniforms by name, introspected when linked
+        self._uniforms = {}
         self.bufs = bufs
         self.shaderDatas = shaderDatas
 
@@ -197,7 +953,7 @@ class Program(GLResource):
         try:
             for name, type in self.shaderDatas:
                 with open(name, 'r') as infile:
-                    source = infile.read()
+                    source = expand_uniform_blocks(infile.read())
                 shader = compile_shader(source, type)
                 glAttachShader(id, shader)
                 shaders.append(shader)
@@ -209,6 +965,21 @@ class Program(GLResource):
         assert self.check_linked()
         assert self.check_valid()
 
+        self._uniforms = {}
+        for i in range(glGetProgramiv(id, GL_ACTIVE_UNIFORMS)):
+            name, size, type = glGetActiveUniform(id, i)
+            name = name.decode('ascii')
+            if name.endswith('[0]'):
+                name = name[:-3]
+            # Members of uniform blocks have no location.
+            location = glGetUniformLocation(id, name.encode('ascii'))
+            if location >= 0:
+                self._uniforms[name] = Uniform(name, location, int(type), int(size))
+        for name, block in UniformBlock.blocks.items():
+            index = glGetUniformBlockIndex(id, name.encode('ascii'))
+            if index != GL_INVALID_INDEX:
+                glUniformBlockBinding(id, index, block.binding)
+
         # Make VAO
         self._buffers = {}
         self.vao = glGenVertexArrays(1)
@@ -221,7 +992,7 @@ class Program(GLResource):
                 raise AttributeNotFoundError(name)
             self._buffers[name] = VertexBufferSlot(loc, size, type)
 
-        glUseProgram(0)
+        glState.use_program(0)
         del self.bufs, self.shaderDatas
         return self.id
 
@@ -236,12 +1007,14 @@ class Program(GLResource):
     @contextmanager
     def batch_draw(self):
         self.use()
-        # glBindVertexArray(self.vao)
+        # The attributes of set_buffer are those of the default VAO. They
+        # stay enabled after the pass, see enable_attribs.
+        glState.bind_vertex_array(0)
         self.enable_attribs()
         self.prepare_draw()
         yield
         self.post_draw()
-        self.disable_attribs()
+        glState.bind_vertex_array(0)
         self.unuse()
 
     def prepare_draw(self):
@@ -251,25 +1024,54 @@ class Program(GLResource):
         pass
 
     def enable_attribs(self):
-        for buf in self._buffers.values():
-            glEnableVertexAttribArray(buf.location)
+        """
+        Enable the attribute arrays of set_buffer and disable the others
+        of the bound VAO, if the program has any.
+        """
+        if self._buffers:
+            glState.set_attrib_arrays([buf.location for buf in self._buffers.values()])
 
     def disable_attribs(self):
         for buf in self._buffers.values():
-            glDisableVertexAttribArray(buf.location)
+            glState.disable_attrib_array(buf.location)
 
     def draw(self, primitive_type, count):
         glDrawArrays(primitive_type, 0, count)
 
+    def get_uniform(self, name):
+        """
+        Return the Uniform `name`, linking the program if it isn't.
+        """
+        self.glId
+        try:
+            return self._uniforms[name]
+        except KeyError:
+            raise UniformNotFoundError(name) from None
+
     def get_uniform_loc(self, name):
-        if name not in self._ulocs:
-            loc = glGetUniformLocation(self.glId, name.encode('ascii'))
-            if loc < 0:
-                raise UniformNotFoundError(name)
-            self._ulocs[name] = loc
-        else:
-            loc = self._ulocs[name]
-        return loc
+        return self.get_uniform(name).location
+
+    def set_uniform(self, name, value, transpose=False):
+        """
+        Set uniform `name` of the program in use, unless it has that value
+        already, see Uniform.set.
+        """
+        self.get_uniform(name).set(value, transpose)
+
+    def uniform_stats(self):
+        """
+        Return a dict of the number of uniform uploads skipped (hits) and
+        made (misses) since the last reset_uniform_stats.
+        """
+        uniforms = self._uniforms.values()
+        return {
+            'hits': sum(uniform.nHits for uniform in uniforms),
+            'misses': sum(uniform.nMisses for uniform in uniforms),
+        }
+
+    def reset_uniform_stats(self):
+        for uniform in self._uniforms.values():
+            uniform.nHits = uniform.nMisses = 0
 
     def get_attrib_loc(self, name):
         if name not in self._alocs:
@@ -302,13 +1104,13 @@ class Program(GLResource):
         return True
 
     def use(self):
-        glUseProgram(self.glId)
+        glState.use_program(self.glId)
 
     def unuse(self):
-        glUseProgram(0)
+        glState.use_program(0)
 
     def set_matrix(self, name, mat):
-        glUniformMatrix4fv(self.get_uniform_loc(name), 1, GL_TRUE, mat)
+        self.set_uniform(name, mat, transpose=True)
 
 
 class TextureUnit:
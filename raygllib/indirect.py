@@ -0,0 +1,174 @@
+"""
+Multi-draw indirect submission of the static models of a scene.
+
+The draw commands of all the models are kept in one indirect buffer and
+submitted by a glMultiDrawElementsIndirect call for each run of commands
+sharing a VAO, the pages of the buffer arena their geometries are in, and a
+material. The per-draw data, the model matrix, is an instance attribute
+read at the baseInstance of the command, so models sharing a geometry and
+level of detail are one command of several instances. Commands are only
+rebuilt when the models, their levels or their visibility change; moved
+models just have their matrix uploaded. The silhouette pass draws the
+adjacency commands of the same buffer, the wireframe pass the triangle ones.
+
+Armatured models, whose joint palette is a uniform array, and geometries
+outside an arena are left to the other draw paths.
+"""
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from .gllib import VertexBuffer, IndirectBuffer, VertexArray, glState
+from .instancing import INSTANCE_FORMAT, pack_matrices, upload_matrices
+from .model import ArmaturedModel
+
+# The DrawElementsIndirectCommand struct
+COMMAND_DTYPE = np.dtype([
+    ('count', np.uint32), ('instanceCount', np.uint32), ('firstIndex', np.uint32),
+    ('baseVertex', np.int32), ('baseInstance', np.uint32),
+])
+
+
+def make_runs(draws):
+    """
+    Order `draws`, a list of (key, material, command) where command is a
+    tuple of the fields of COMMAND_DTYPE, by key and material, keeping their
+    order otherwise. Return the command array and the (key, material,
+    first, count) of each run of commands sharing a key and material.
+    """
+    byRun = {}
+    for key, material, command in draws:
+        byRun.setdefault((key, id(material)), (key, material, []))[2].append(command)
+    commands = np.zeros(len(draws), dtype=COMMAND_DTYPE)
+    runs = []
+    first = 0
+    for key, material, items in byRun.values():
+        commands[first:first + len(items)] = items
+        runs.append((key, material, first, len(items)))
+        first += len(items)
+    return commands, runs
+
+
+class IndirectDraws:
+    """
+    The draw commands and per-draw data of the models of a scene, see the
+    module docs.
+    """
+    def __init__(self):
+        self.models = []
+        self.matrices = np.zeros((0, 4, 4), dtype=np.float32)
+        # Runs of triangle and adjacency commands, see make_runs
+        self.runs = []
+        self.adjRuns = []
+        # Number of matrices uploaded by the last update
+        self.nUpdated = 0
+        self._formats = {}
+        self._records = None
+        self._commands = None
+        self._vaos = {}
+        self._key = None
+
+    def update(self, models, adjacency=False):
+        """
+        Return the models of `models` not drawn by this, after making the
+        commands of the others if they changed, with adjacency commands if
+        `adjacency` is true.
+        """
+        others, drawn = [], []
+        for model in models:
+            if isinstance(model, ArmaturedModel) or model.geometry.vertices.arena is None:
+                others.append(model)
+            elif model.visible:
+                drawn.append(model)
+        key = ([(id(model), id(model.geometry), model.lod) for model in drawn], adjacency)
+        if key != self._key:
+            self.build(drawn, adjacency)
+            self._key = key
+        else:
+            self.nUpdated = upload_matrices(self._records, self.matrices, self.models)
+        return others
+
+    def build(self, models, adjacency):
+        self.free()
+        byGeometry = {}
+        for model in models:
+            byGeometry.setdefault((model.geometry, model.lod), []).append(model)
+        draws, adjDraws = [], []
+        self.models = []
+        for (geometry, level), group in byGeometry.items():
+            baseInstance = len(self.models)
+            self.models.extend(group)
+            vertices, indices = geometry.vertices, geometry.indices
+            self._formats[geometry.format.spec] = geometry.format
+            key = (vertices.slice.page, indices.slice.page, geometry.format.spec, indices.glType)
+            start = indices.offset // indices.itemSize
+            subRanges = geometry.subRanges[min(level, len(geometry.subRanges) - 1)]
+            for material, (offset, length) in zip(geometry.materials, subRanges):
+                if length:
+                    draws.append((key, material, (
+                        length, len(group), start + offset, geometry.baseVertex, baseInstance)))
+            if adjacency:
+                indices = geometry.adjVertices.indices
+                key = (vertices.slice.page, indices.slice.page, geometry.format.spec,
+                       indices.glType)
+                adjDraws.append((key, None, (
+                    len(indices), len(group), indices.offset // indices.itemSize,
+                    geometry.baseVertex, baseInstance)))
+        commands, self.runs = make_runs(draws)
+        adjCommands, adjRuns = make_runs(adjDraws)
+        # Both kinds of commands are in one buffer, the adjacency ones last.
+        self.adjRuns = [
+            (key, material, first + len(commands), count)
+            for key, material, first, count in adjRuns]
+        self.matrices = np.array(
+            [model.matrix for model in self.models], dtype=np.float32).reshape((-1, 4, 4))
+        self.nUpdated = len(self.models)
+        if self.models:
+            self._records = VertexBuffer(pack_matrices(self.matrices), GL_DYNAMIC_DRAW)
+            self._commands = IndirectBuffer(np.concatenate([commands, adjCommands]))
+
+    def get_vao(self, program, key):
+        """
+        Return the VAO of `program` for the runs of `key`, binding the pages
+        of the arena and the per-draw data.
+        """
+        if (program, key) not in self._vaos:
+            vertexPage, indexPage, spec, _ = key
+            self._vaos[program, key] = VertexArray(program, [
+                (vertexPage, self._formats[spec]),
+                (self._records, INSTANCE_FORMAT, 1),
+            ], indexPage)
+        return self._vaos[program, key]
+
+    def draw(self, program, set_material=None):
+        """
+        Draw the triangles of the models, setting the material of each run
+        with `set_material` if given.
+        """
+        self._draw(program, GL_TRIANGLES, self.runs, set_material)
+
+    def draw_adjacency(self, program):
+        self._draw(program, GL_TRIANGLES_ADJACENCY, self.adjRuns)
+
+    def _draw(self, program, mode, runs, set_material=None):
+        if not runs:
+            return
+        glState.bind_buffer(GL_DRAW_INDIRECT_BUFFER, self._commands.glId)
+        for key, material, first, count in runs:
+            if set_material is not None:
+                set_material(material)
+            self.get_vao(program, key).bind()
+            glMultiDrawElementsIndirect(
+                mode, key[3], ctypes.c_void_p(first * COMMAND_DTYPE.itemsize), count, 0)
+        glState.bind_buffer(GL_DRAW_INDIRECT_BUFFER, 0)
+
+    def free(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
+        for buffer in (self._records, self._commands):
+            if buffer is not None:
+                buffer.free()
+        self._records = self._commands = None
+        self.runs = self.adjRuns = []
+        self.models = []
+        self._key = None
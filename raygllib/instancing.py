@@ -0,0 +1,163 @@
+"""
+Instanced drawing of models which share a geometry, and so a material.
+"""
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from .gllib import VertexBuffer, VertexFormat, VertexArray
+from .model import ArmaturedModel
+
+# Model matrices by columns, read by the instanceMat attributes of the shaders.
+INSTANCE_FORMAT = VertexFormat(
+    'instanceMat0:4f, instanceMat1:4f, instanceMat2:4f, instanceMat3:4f')
+
+
+def pack_matrices(matrices):
+    """
+    Return the items of an instance buffer for an (n, 4, 4) array of model
+    matrices.
+    """
+    columns = np.asarray(matrices, dtype=np.float32).transpose((0, 2, 1))
+    return INSTANCE_FORMAT.pack({
+        'instanceMat{}'.format(j): columns[:, j] for j in range(4)})
+
+
+def upload_matrices(buffer, matrices, models):
+    """
+    Upload into instance `buffer` the matrices of `models` which differ from
+    `matrices`, the (n, 4, 4) array of those uploaded so far, a run of
+    consecutive instances at a time. Update `matrices` and return the number
+    of instances uploaded.
+    """
+    new = np.array([model.matrix for model in models], dtype=np.float32).reshape((-1, 4, 4))
+    changed = np.flatnonzero((new != matrices).any(axis=(1, 2)))
+    if len(changed) == 0:
+        return 0
+    matrices[changed] = new[changed]
+    for run in np.split(changed, np.flatnonzero(np.diff(changed) > 1) + 1):
+        buffer.update(pack_matrices(new[run]), run[0])
+    return len(changed)
+
+
+class InstanceGroup:
+    """
+    Models sharing a geometry, drawn by one instanced draw call. Their model
+    matrices are kept in an instance buffer, where `update` only rewrites
+    those which changed.
+    """
+    def __init__(self, geometry, models):
+        self.geometry = geometry
+        self.models = list(models)
+        self.matrices = np.array([model.matrix for model in self.models], dtype=np.float32)
+        self.buffer = VertexBuffer(pack_matrices(self.matrices), GL_DYNAMIC_DRAW)
+        # Number of instances uploaded by the last update
+        self.nUpdated = 0
+        self._vaos = {}
+
+    def update(self):
+        """
+        Upload the matrices of the models which changed since the last
+        update.
+        """
+        self.nUpdated = upload_matrices(self.buffer, self.matrices, self.models)
+
+    @property
+    def level(self):
+        """
+        The level of detail drawn, the finest one any of the models needs.
+        """
+        return min(model.lod for model in self.models)
+
+    def get_vao(self, program, adjacency=False):
+        geometry = self.geometry
+        indices = geometry.adjVertices.indices if adjacency else geometry.indices
+        # The buffers are pages of an arena which may be compacted.
+        key = (program, adjacency, geometry.vertices.glId, indices.glId)
+        if key not in self._vaos:
+            self._vaos[key] = VertexArray(program, [
+                (geometry.vertices, geometry.format),
+                (self.buffer, INSTANCE_FORMAT, 1),
+            ], indices)
+        return self._vaos[key]
+
+    def draw(self, program, set_material=None):
+        """
+        Draw the models, one sub-range at a time with its material if the
+        geometry has several and `set_material` is given, see Geometry.draw.
+        """
+        geometry = self.geometry
+        self.get_vao(program).bind()
+        if set_material is None or len(geometry.materials) == 1:
+            ranges = [(None, *geometry.lod_range(self.level))]
+        else:
+            ranges = geometry.material_ranges(self.level)
+        for material, offset, length in ranges:
+            if material is not None:
+                set_material(material)
+            glDrawElementsInstancedBaseVertex(
+                GL_TRIANGLES, length, geometry.indices.glType, offset, len(self.models),
+                geometry.baseVertex)
+
+    def draw_adjacency(self, program):
+        geometry = self.geometry
+        indices = geometry.adjVertices.indices
+        self.get_vao(program, True).bind()
+        glDrawElementsInstancedBaseVertex(
+            GL_TRIANGLES_ADJACENCY, len(indices), indices.glType,
+            ctypes.c_void_p(indices.offset), len(self.models), geometry.baseVertex)
+
+    def free(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
+        self.buffer.free()
+
+
+class Instancing:
+    """
+    Split the models of a scene into InstanceGroups, for geometries used by
+    at least `min_instances` models, and models drawn one by one. Armatured
+    models are never instanced, their joints differ.
+    """
+    def __init__(self, min_instances=2):
+        self.minInstances = min_instances
+        self.groups = []
+        self.singles = []
+        self._key = None
+
+    def update(self, models):
+        """
+        Return (groups, singles) for `models`. The groups are remade when
+        the models or their geometries changed, otherwise their matrices are
+        updated.
+        """
+        models = list(models)
+        key = [(id(model), id(model.geometry)) for model in models]
+        if key != self._key:
+            self.regroup(models)
+            self._key = key
+        else:
+            for group in self.groups:
+                group.update()
+        return self.groups, self.singles
+
+    def regroup(self, models):
+        self.free()
+        byGeometry = {}
+        for model in models:
+            if not isinstance(model, ArmaturedModel):
+                byGeometry.setdefault(model.geometry, []).append(model)
+        instanced = set()
+        for geometry, group in byGeometry.items():
+            if len(group) >= self.minInstances:
+                self.groups.append(InstanceGroup(geometry, group))
+                instanced.update(map(id, group))
+        # The other models keep the order of the scene.
+        self.singles = [model for model in models if id(model) not in instanced]
+
+    def free(self):
+        for group in self.groups:
+            group.free()
+        self.groups = []
+        self.singles = []
+        self._key = None
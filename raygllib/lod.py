@@ -0,0 +1,219 @@
+"""
+Levels of detail of indexed geometries and their selection when drawing.
+
+A level is a set of triangle indices into the vertex store of the geometry,
+so levels cost an index buffer each and no vertices. They are made by
+vertex clustering with quadric error metrics (Lindstrom, "Out-of-Core
+Simplification of Large Polygonal Models", 2000): store vertices are grouped
+by grid cell, each group collapses onto the vertex of the group whose
+quadric error is the least, and triangles which become degenerate are
+dropped. Vertices are only merged with vertices bound mostly to the same
+joint, so skinned geometries keep deforming with their joints.
+"""
+import pyximport
+pyximport.install()
+
+import numpy as np
+from . import _model
+from .utils import debug
+
+# Levels stop once they are smaller than this.
+MIN_TRIANGLES = 64
+
+
+def triangle_quadrics(vertices, indices):
+    """
+    Return the area weighted plane quadrics of the triangles, as the 10
+    distinct terms of the symmetric 4x4 matrices, see quadric_error.
+    """
+    triangles = vertices[indices.reshape((-1, 3))].astype(np.float64)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    areas = np.linalg.norm(normals, axis=1) / 2
+    normals /= np.maximum(areas, 1e-30)[:, None] * 2
+    a, b, c = normals.T
+    d = -(normals * triangles[:, 0]).sum(axis=1)
+    return areas[:, None] * np.stack([
+        a * a, a * b, a * c, a * d, b * b, b * c, b * d, c * c, c * d, d * d], axis=1)
+
+
+def vertex_quadrics(vertices, indices):
+    """
+    Return the sum of the quadrics of the triangles around each vertex.
+    """
+    quadrics = triangle_quadrics(vertices, indices)
+    corners = indices.reshape((-1, 3))
+    result = np.zeros((len(vertices), 10))
+    for k in range(10):
+        for j in range(3):
+            result[:, k] += np.bincount(
+                corners[:, j], weights=quadrics[:, k], minlength=len(vertices))
+    return result
+
+
+def quadric_error(quadrics, points):
+    """
+    Return p^T Q p for each quadric Q and point p = (x, y, z, 1).
+    """
+    x, y, z = np.asarray(points, dtype=np.float64).T
+    q = quadrics.T
+    return (q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x
+            + q[4] * y * y + 2 * q[5] * y * z + 2 * q[6] * y
+            + q[7] * z * z + 2 * q[8] * z + q[9])
+
+
+def cluster_vertices(vertices, cell_size, joints=None):
+    """
+    Return (nClusters, cluster) grouping vertices by grid cell of
+    `cell_size` and, if `joints` is given, by joint.
+    """
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    if joints is not None:
+        cells = np.concatenate([cells, np.asarray(joints, dtype=np.int64)[:, None]], axis=1)
+    first, cluster = _model.unique_rows(cells)
+    return len(first), cluster
+
+
+def collapse(vertices, indices, quadrics, cluster, n_clusters):
+    """
+    Return the indices of the triangles left when the vertices of each
+    cluster collapse onto the one of least quadric error for the cluster.
+    """
+    clusterQuadrics = np.stack([
+        np.bincount(cluster, weights=quadrics[:, k], minlength=n_clusters)
+        for k in range(10)], axis=1)
+    errors = quadric_error(clusterQuadrics[cluster], vertices)
+    order = np.lexsort((errors, cluster))
+    _, first = np.unique(cluster[order], return_index=True)
+    representative = order[first][cluster]
+    triangles = representative[indices.reshape((-1, 3))]
+    triangles = triangles[
+        (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2])
+        & (triangles[:, 2] != triangles[:, 0])]
+    # Drop triangles made twice, with the same winding.
+    start = np.argmin(triangles, axis=1)
+    rotated = np.take_along_axis(
+        triangles, (start[:, None] + np.arange(3)) % 3, axis=1)
+    first, _ = _model.unique_rows(rotated)
+    return triangles[np.sort(first)].ravel().astype(indices.dtype)
+
+
+def make_lods(vertices, indices, levels, ratio, joints=None):
+    """
+    Make up to `levels` levels of detail of a geometry with store `vertices`
+    and triangle `indices`, each with about `ratio` of the vertices of the
+    previous one. `joints` gives the joint each store vertex is mostly bound
+    to, if skinned. Return the list of their triangle indices, finest first.
+    """
+    lods = []
+    if levels <= 0 or len(indices) == 0:
+        return lods
+    vertices = np.asarray(vertices, dtype=np.float64)
+    quadrics = vertex_quadrics(vertices, indices)
+    used = np.unique(indices)
+    extent = vertices[used].max(axis=0) - vertices[used].min(axis=0)
+    diagonal = max(np.linalg.norm(extent), 1e-30)
+    nTarget = len(used)
+    nTriangles = len(indices) // 3
+    usedVertices = vertices[used]
+    usedJoints = None if joints is None else np.asarray(joints)[used]
+    for level in range(levels):
+        nTarget *= ratio
+        # Search the cell size giving about nTarget clusters; the count
+        # shrinks as cells grow.
+        low, high = diagonal * 1e-4, diagonal
+        for i in range(16):
+            cellSize = np.sqrt(low * high)
+            n, _ = cluster_vertices(usedVertices, cellSize, usedJoints)
+            if n > nTarget:
+                low = cellSize
+            else:
+                high = cellSize
+        n, cluster = cluster_vertices(usedVertices, high, usedJoints)
+        fullCluster = np.zeros(len(vertices), dtype=np.int64)
+        fullCluster[used] = cluster
+        lod = collapse(vertices, indices, quadrics, fullCluster, n)
+        if len(lod) // 3 < MIN_TRIANGLES or len(lod) // 3 >= nTriangles:
+            break
+        debug('lod {}: nTriangles={}, nClusters={}'.format(level + 1, len(lod) // 3, n))
+        lods.append(lod)
+        nTriangles = len(lod) // 3
+    return lods
+
+
+def bounding_sphere(vertices):
+    """
+    Return (center, radius) of a sphere around `vertices`.
+    """
+    if len(vertices) == 0:
+        return np.zeros(3, dtype=np.float32), 0.
+    vertices = np.asarray(vertices, dtype=np.float64)
+    center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+    radius = np.sqrt(((vertices - center) ** 2).sum(axis=1).max())
+    return center.astype(np.float32), float(radius)
+
+
+def projected_radius(center, radius, matrix, view_mat, proj_mat, width, height):
+    """
+    Return the radius in pixels of the sphere (`center`, `radius`) of a
+    model with `matrix`, seen through `view_mat` and `proj_mat` in a
+    viewport of `width` x `height`.
+    """
+    modelView = np.dot(view_mat, matrix)
+    radius *= np.linalg.norm(modelView[:3, :3], axis=0).max()
+    w = abs(np.dot(proj_mat, np.dot(modelView, np.append(center, 1.)))[3])
+    scale = max(abs(proj_mat[0, 0]) * width, abs(proj_mat[1, 1]) * height) / 2
+    return radius * scale / max(w, 1e-6)
+
+
+class LodSelector:
+    """
+    Choose the level of detail of models from their size on screen. A level
+    is good enough when it has at most `triangles_per_pixel` triangles per
+    pixel of the projected bounding sphere. The level only changes once the
+    size moved `hysteresis` past that, so that models don't flicker between
+    levels near a threshold.
+    """
+    def __init__(self, triangles_per_pixel=1., hysteresis=.25):
+        self.trianglesPerPixel = triangles_per_pixel
+        self.hysteresis = hysteresis
+        # (model name, level, number of triangles, radius in pixels) of the
+        # models of the last frame.
+        self.stats = []
+
+    def select_level(self, counts, budget, level):
+        """
+        Return the level to use instead of `level` given the triangle
+        `counts` of the levels and a `budget` of triangles.
+        """
+        level = min(level, len(counts) - 1)
+        k = 1 + self.hysteresis
+        while level > 0 and counts[level - 1] * k <= budget:
+            level -= 1
+        while level < len(counts) - 1 and counts[level] > budget * k:
+            level += 1
+        return level
+
+    def select(self, models, view_mat, proj_mat, width, height):
+        """
+        Set the `lod` of each model and record the stats of the frame.
+        """
+        stats = []
+        for model in models:
+            geometry = model.geometry
+            counts = geometry.lodTriangles
+            radius = projected_radius(
+                geometry.boundCenter, geometry.boundRadius, model.matrix,
+                view_mat, proj_mat, width, height)
+            budget = self.trianglesPerPixel * np.pi * radius * radius
+            model.lod = self.select_level(counts, budget, model.lod)
+            stats.append((model.name, model.lod, counts[model.lod], radius))
+        self.stats = stats
+
+    def summary(self):
+        """
+        Return the stats of the last frame as text.
+        """
+        total = sum(nTriangles for _, _, nTriangles, _ in self.stats)
+        lines = ['{}: lod {}, {} triangles, {:.1f}px'.format(*item) for item in self.stats]
+        lines.append('total: {} triangles'.format(total))
+        return '\n'.join(lines)
@@ -1,12 +1,23 @@
 import pyximport
 pyximport.install()
 
+import ctypes
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 import collada
 from OpenGL.GL import *
-from .gllib import VertexBuffer, Texture2D, IndexBuffer
+from .gllib import VertexBuffer, Texture2D, IndexBuffer, VertexFormat, VertexArray
+from .arena import BufferArena
+from .cache import ArrayCache, hash_file
 import numpy as np
 
 from . import _model
+from . import lod
+from . import textures
 from . import utils
 from . import matlib as M
 from . import config
@@ -28,55 +39,408 @@ def get_bound_box(vs):
 
 
 class AdjacencyVertexBuffer:
-    # @profile
-    def __init__(self, vertices, indices):
-        indices = indices.astype(GLuint)
-        adjIndices = _model.make_adj_indices(indices)
-        self.vertices = VertexBuffer(np.array(vertices, dtype=GLfloat), GL_STATIC_DRAW)
-        self.indices = IndexBuffer(np.array(adjIndices, dtype=GLuint), GL_STATIC_DRAW)
+    def __init__(self, vertices, format, adjIndices):
+        """
+        :param VertexBuffer vertices: The vertex store of the geometry, shared
+            with its triangle indices.
+        :param VertexFormat format: The layout of the store.
+        :param numpy.ndarray adjIndices: uint16 or uint32 indices.
+        """
+        self.vertices = vertices
+        self.format = format
+        self.indices = IndexBuffer(adjIndices, GL_STATIC_DRAW, vertices.arena)
+        self._vaos = {}
         utils.debug('nVertices', len(vertices), 'nAdjIndices', len(self.indices))
 
-    def bind(self):
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.indices.glId)
+    @staticmethod
+    def make_indices(indices):
+        return _model.make_adj_indices_1(indices.astype(GLuint))
 
-    def draw(self):
-        glDrawElements(GL_TRIANGLES_ADJACENCY, len(self.indices), GL_UNSIGNED_INT, None) 
+    @staticmethod
+    def make_store_indices(indices, vertexIds):
+        """
+        Make adjacency indices into a vertex store. `indices` are the triangle
+        indices into the store and store vertex i has position vertexIds[i].
+        Store vertices that share a position, e.g. along uv seams, are the
+        same vertex for adjacency, which refers to the first of them.
+        """
+        vertexIds = np.asarray(vertexIds)
+        adjIndices = AdjacencyVertexBuffer.make_indices(vertexIds[indices])
+        positions, first = np.unique(vertexIds, return_index=True)
+        representative = np.zeros(positions[-1] + 1 if len(positions) else 0, dtype=GLuint)
+        representative[positions] = first
+        return representative[adjIndices]
+
+    def get_vao(self, program):
+        if self.vertices.arena is not None:
+            return self.vertices.arena.get_vao(program, self.format, self.vertices, self.indices)
+        if program not in self._vaos:
+            self._vaos[program] = VertexArray(
+                program, [(self.vertices, self.format)], self.indices)
+        return self._vaos[program]
+
+    def draw(self, program):
+        self.get_vao(program).bind()
+        glDrawElementsBaseVertex(
+            GL_TRIANGLES_ADJACENCY, len(self.indices), self.indices.glType,
+            ctypes.c_void_p(self.indices.offset), self.vertices.offset // self.format.stride)
+
+    def free(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
+        self.indices.free()
 
 
 class Geometry:
+    """
+    An indexed vertex store of positions, normals, texcoords and, for skinned
+    geometries, joint weights and ids, interleaved in one buffer. The triangle
+    indices and, once the silhouette pass needs them, the adjacency indices
+    both index it, so the store is uploaded once. A VAO is recorded for each
+    program that draws the geometry.
+    """
+    # Items of the arrays of `process` that go into the vertex store: their
+    # shader attribute and whether integers are normalized. The type of the
+    # attribute is that of the array, see compact_arrays. Joint ids are
+    # read as floats either way, so the shaders take both encodings.
+    ATTRIBUTES = [
+        ('vertices', 'vertexPos', False),
+        ('normals', 'vertexNormal', True),
+        ('texcoords', 'vertexUV', True),
+        ('weights', 'vertexWeights', True),
+        ('jointIds', 'vertexJointIds', False),
+    ]
+
+    @classmethod
+    def vertex_attributes(cls, arrays):
+        """
+        Return the (attribute, array, normalized) of the vertex store of the
+        output of `process`. Weights and ids of more than 4 joints per vertex
+        are split into vec4 attributes: vertexWeights takes joints 1 to 4,
+        vertexWeights1 joints 5 to 8.
+        """
+        result = []
+        for key, name, normalized in cls.ATTRIBUTES:
+            array = arrays.get(key)
+            if array is None:
+                continue
+            if key in ('weights', 'jointIds'):
+                for i in range(0, array.shape[1], 4):
+                    result.append((name + str(i // 4 or ''), array[:, i:i + 4], normalized))
+            else:
+                result.append((name, array, normalized))
+        return result
+
     def __init__(self, name, vertices, normals, texcoords, indices, material):
         self.name = name
-        self.vertices = VertexBuffer(
-            np.array(vertices[indices[:, 0]], dtype=GLfloat), GL_STATIC_DRAW)
-        self.normals = VertexBuffer(
-            np.array(normals[indices[:, 1]], dtype=GLfloat), GL_STATIC_DRAW)
-        if texcoords is not None:
-            self.texcoords = VertexBuffer(
-                np.array(texcoords[indices[:, 2]], dtype=GLfloat), GL_STATIC_DRAW)
-        else:
-            self.texcoords = None
-        # with utils.timeit_context('Build AdjacencyVertexBuffer'):
-        self.adjVertices = AdjacencyVertexBuffer(vertices, indices[:, 0])
-        self.material = material
+        self.materials = material if isinstance(material, list) else [material]
+        self.setup(self.process(vertices, normals, texcoords, indices))
+
+    @classmethod
+    def from_arrays(cls, name, arrays, material):
+        """
+        Make a geometry from the output of `process`. `material` is a
+        Material, or a list with one per sub-range for a geometry made of
+        several primitives.
+        """
+        self = cls.__new__(cls)
+        self.name = name
+        self.materials = material if isinstance(material, list) else [material]
+        self.setup(arrays)
+        return self
+
+    @property
+    def material(self):
+        return self.materials[0]
+
+    @staticmethod
+    def process(vertices, normals, texcoords, indices, compact=False,
+                cache_size=0, overdraw=False, lod_levels=0, lod_ratio=.25, joints=None,
+                ranges=None):
+        """
+        Do the CPU side work of building a geometry. Return a dict of numpy
+        arrays, which `setup` turns into GL buffers. The arrays are then
+        optimized and encoded by `postprocess`, see there for the other
+        arguments.
+
+        A store vertex is made for each distinct tuple of indices, so
+        'vertexIds' gives the position index of each one, e.g. to look up
+        skin weights. `ranges` gives where the triangles of each primitive
+        start in `indices`, and where the last one ends; they are kept apart
+        as the sub-ranges of 'subRanges', drawn with a material each.
+        """
+        first, newIndex = _model.unique_rows(indices)
+        index = indices[first]
+        arrays = {
+            'vertices': np.array(vertices[index[:, 0]], dtype=GLfloat),
+            'normals': np.array(normals[index[:, 1]], dtype=GLfloat),
+            'texcoords': (np.array(texcoords[index[:, 2]], dtype=GLfloat)
+                if texcoords is not None else None),
+            'indices': newIndex,
+            'vertexIds': np.array(index[:, 0], dtype=GLuint),
+            'subRanges': np.array(
+                ranges if ranges is not None else [0, len(indices)], dtype=np.int64),
+        }
+        return Geometry.postprocess(
+            arrays, compact, cache_size, overdraw, lod_levels, lod_ratio, joints)
+
+    @staticmethod
+    def postprocess(arrays, compact=False, cache_size=0, overdraw=False,
+                    lod_levels=0, lod_ratio=.25, joints=None):
+        """
+        Finish the arrays of `process`. If `cache_size` is not 0 they are
+        reordered with optimize_arrays. Up to `lod_levels` levels of detail
+        are added as 'lodIndices', the indices of all levels one after the
+        other, and 'lodOffsets', where each level starts and the last one
+        ends, see lod.make_lods. Each sub-range gets its own levels, a
+        sub-range with fewer levels repeats its coarsest one, and
+        'lodSubRanges' gives where they start in each level. `joints` gives
+        the joint each position is mostly bound to, for skinned geometries.
+        If `compact` is true the arrays are encoded with compact_arrays.
+        """
+        if cache_size:
+            arrays = Geometry.optimize_arrays(arrays, cache_size, overdraw)
+        if lod_levels:
+            if joints is not None:
+                joints = np.asarray(joints)[arrays['vertexIds']]
+            indices = arrays['indices']
+            subRanges = arrays['subRanges']
+            with utils.timeit_context('Make levels of detail'):
+                subLods = [
+                    lod.make_lods(arrays['vertices'], indices[start:end],
+                                  lod_levels, lod_ratio, joints)
+                    for start, end in zip(subRanges[:-1], subRanges[1:])]
+            nLevels = max(map(len, subLods), default=0)
+            levels = []
+            for level in range(nLevels):
+                for lods, start, end in zip(subLods, subRanges[:-1], subRanges[1:]):
+                    levels.append(lods[min(level, len(lods) - 1)] if lods else indices[start:end])
+            if cache_size:
+                levels = [_model.tipsify(indices, len(arrays['vertices']), cache_size)[0]
+                          for indices in levels]
+            offsets = np.cumsum([0] + [len(indices) for indices in levels])
+            nSubRanges = len(subRanges) - 1
+            arrays = dict(arrays)
+            arrays['lodIndices'] = np.concatenate(
+                [np.zeros(0, dtype=arrays['indices'].dtype)] + levels).astype(
+                    arrays['indices'].dtype)
+            arrays['lodOffsets'] = offsets[::nSubRanges]
+            arrays['lodSubRanges'] = np.array([
+                offsets[level * nSubRanges:(level + 1) * nSubRanges + 1]
+                for level in range(nLevels)], dtype=np.int64).reshape((nLevels, nSubRanges + 1))
+        return Geometry.compact_arrays(arrays) if compact else arrays
+
+    @staticmethod
+    def optimize_arrays(arrays, cache_size, overdraw=False):
+        """
+        Reorder the triangles of the arrays of `process` for a post-transform
+        vertex cache of `cache_size` entries, then the store vertices by first
+        use so that they are fetched in order. If `overdraw` is true the
+        clusters of triangles are also sorted to draw the outer ones first,
+        see sort_clusters. Triangles stay in their sub-range.
+        """
+        indices = arrays['indices']
+        nVertices = len(arrays['vertices'])
+        if len(indices) == 0:
+            return arrays
+        acmr, atvr = _model.vertex_cache_stats(indices, nVertices, cache_size)
+        subRanges = arrays['subRanges']
+        parts = []
+        nClusters = 0
+        for start, end in zip(subRanges[:-1], subRanges[1:]):
+            if start == end:
+                continue
+            part, starts = _model.tipsify(indices[start:end], nVertices, cache_size)
+            if overdraw:
+                part = sort_clusters(arrays['vertices'], part, starts)
+            parts.append(part)
+            nClusters += len(starts)
+        order, newIndices = _model.first_use_order(np.concatenate(parts))
+        arrays = {
+            key: (value[order] if value is not None and key not in ('indices', 'subRanges')
+                  else value)
+            for key, value in arrays.items()}
+        arrays['indices'] = newIndices
+        newAcmr, newAtvr = _model.vertex_cache_stats(newIndices, nVertices, cache_size)
+        debug('vertex cache: ACMR {:.3f} -> {:.3f}, ATVR {:.3f} -> {:.3f}, {} clusters'.format(
+            acmr, newAcmr, atvr, newAtvr, nClusters))
+        return arrays
+
+    @staticmethod
+    def compact_arrays(arrays):
+        """
+        Encode the arrays of `process` to save memory: normals as normalized
+        int16, texcoords as half floats and indices as uint16 when there are
+        at most 65536 vertices. Positions stay float.
+        """
+        arrays = dict(arrays)
+        arrays['normals'] = quantize_snorm16(arrays['normals'])
+        if arrays['texcoords'] is not None:
+            arrays['texcoords'] = arrays['texcoords'].astype(np.float16)
+        if len(arrays['vertices']) <= 1 << 16:
+            arrays['indices'] = arrays['indices'].astype(np.uint16)
+            if arrays.get('lodIndices') is not None:
+                arrays['lodIndices'] = arrays['lodIndices'].astype(np.uint16)
+        return arrays
+
+    def setup(self, arrays):
+        """
+        Make GL buffers from the output of `process`, with 'weights' and
+        'jointIds' per store vertex added for a skinned geometry.
+        """
+        fields = []
+        attribs = {}
+        for name, array, normalized in self.vertex_attributes(arrays):
+            fields.append(VertexFormat.field(name, array, normalized))
+            attribs[name] = array
+        weights = arrays.get('weights')
+        self.jointsPerVertex = 0 if weights is None else weights.shape[1]
+        self.format = VertexFormat(', '.join(fields))
+        # Geometries are suballocated from one arena, see arena.py.
+        arena = BufferArena.get_default() if config.bufferArenaEnable else None
+        self.vertices = VertexBuffer(self.format.pack(attribs), GL_STATIC_DRAW, arena)
+        # The levels of detail follow the triangle indices in the index
+        # buffer, lodRanges gives the offset and length of each level and
+        # subRanges those of the sub-ranges of each level.
+        indices = arrays['indices']
+        self.lodRanges = [(0, len(indices))]
+        levelSubRanges = [arrays.get('subRanges', [0, len(indices)])]
+        lodIndices = arrays.get('lodIndices')
+        if lodIndices is not None and len(lodIndices):
+            offsets = arrays['lodOffsets']
+            self.lodRanges.extend(
+                (len(indices) + int(start), int(end - start))
+                for start, end in zip(offsets[:-1], offsets[1:]))
+            lodSubRanges = arrays.get('lodSubRanges')
+            if lodSubRanges is None:
+                lodSubRanges = np.stack([offsets[:-1], offsets[1:]], axis=1)
+            levelSubRanges.extend(
+                np.asarray(subRanges) + len(indices) for subRanges in lodSubRanges)
+            indices = np.concatenate([indices, lodIndices])
+        self.subRanges = [
+            [(int(start), int(end - start)) for start, end in zip(offsets[:-1], offsets[1:])]
+            for offsets in levelSubRanges]
+        self.lodTriangles = [length // 3 for _, length in self.lodRanges]
+        self.indices = IndexBuffer(indices, GL_STATIC_DRAW, arena)
+        self.boundCenter, self.boundRadius = lod.bounding_sphere(arrays['vertices'])
+        self._vaos = {}
+        # Static batches are made from the arrays, see batching.py.
+        self.arrays = arrays if config.staticBatching else None
+        # Adjacency is built from these when it is first needed.
+        self._indices = arrays['indices']
+        self.vertexIds = arrays['vertexIds']
+        self._adjIndices = None
+        self._adjVertices = None
+        self._adjLock = threading.Lock()
+
+    def make_adj_indices(self):
+        """
+        Return the adjacency indices, computing them if needed. It doesn't
+        touch GL, so it can run in a background thread.
+        """
+        with self._adjLock:
+            if self._adjIndices is None:
+                with utils.timeit_context('Build adjacency indices'):
+                    self._adjIndices = AdjacencyVertexBuffer.make_store_indices(
+                        self._indices, self.vertexIds).astype(self._indices.dtype)
+            return self._adjIndices
+
+    @property
+    def adjVertices(self):
+        """
+        The AdjacencyVertexBuffer, made on first use since only the
+        silhouette pass needs it.
+        """
+        if self._adjVertices is None:
+            self._adjVertices = AdjacencyVertexBuffer(
+                self.vertices, self.format, self.make_adj_indices())
+        return self._adjVertices
 
     def __repr__(self):
         return '{}(nVertices={})'.format(self.__class__.__name__, len(self.vertices))
 
+    def get_vao(self, program):
+        """
+        Return the VAO binding the vertex store and the triangle indices to
+        the attributes of `program`. It is recorded on the first draw, or
+        shared with the geometries of the same pages of an arena.
+        """
+        if self.vertices.arena is not None:
+            return self.vertices.arena.get_vao(program, self.format, self.vertices, self.indices)
+        if program not in self._vaos:
+            self._vaos[program] = VertexArray(
+                program, [(self.vertices, self.format)], self.indices)
+        return self._vaos[program]
+
     def free(self):
+        for vao in self._vaos.values():
+            vao.free()
+        self._vaos.clear()
         self.vertices.free()
-        self.normals.free()
-        self.adjVertices.vertices.free()
-        self.adjVertices.indices.free()
-        if self.texcoords is not None:
-            self.texcoords.free()
-        if self.material.diffuseType == Material.DIFFUSE_TEXTURE:
-            self.material.diffuse.free()
+        self.indices.free()
+        if self._adjVertices is not None:
+            self._adjVertices.free()
+        for material in self.materials:
+            if material.diffuseType == Material.DIFFUSE_TEXTURE:
+                material.diffuse.free()
+
+    @property
+    def ready(self):
+        """
+        Whether the buffers can be drawn from, not waiting in an
+        uploads.UploadQueue.
+        """
+        return self.vertices.ready and self.indices.ready
 
-    def draw(self):
-        glDrawArrays(GL_TRIANGLES, 0, len(self.vertices))
+    @property
+    def baseVertex(self):
+        """
+        The basevertex argument of glDrawElementsBaseVertex, where the store
+        starts in its buffer.
+        """
+        return self.vertices.offset // self.format.stride
+
+    def lod_range(self, level):
+        """
+        Return the (offset, count) arguments of glDrawElements for level of
+        detail `level`, the coarsest one if there are fewer levels.
+        """
+        offset, length = self.lodRanges[min(level, len(self.lodRanges) - 1)]
+        return ctypes.c_void_p(self.indices.offset + offset * self.indices.itemSize), length
+
+    def material_ranges(self, level):
+        """
+        Return (material, offset, count) of the non empty sub-ranges of
+        level of detail `level`, as for lod_range.
+        """
+        subRanges = self.subRanges[min(level, len(self.subRanges) - 1)]
+        return [
+            (material, ctypes.c_void_p(self.indices.offset + offset * self.indices.itemSize),
+             length)
+            for material, (offset, length) in zip(self.materials, subRanges) if length]
+
+    def draw(self, program, level=0, set_material=None):
+        """
+        Draw level of detail `level`. With several materials and a
+        `set_material` function, each sub-range is drawn with its material,
+        otherwise all of them with the current one.
+        """
+        self.get_vao(program).bind()
+        baseVertex = self.baseVertex
+        if set_material is None or len(self.materials) == 1:
+            offset, length = self.lod_range(level)
+            glDrawElementsBaseVertex(GL_TRIANGLES, length, self.indices.glType, offset, baseVertex)
+            return
+        for material, offset, length in self.material_ranges(level):
+            set_material(material)
+            glDrawElementsBaseVertex(GL_TRIANGLES, length, self.indices.glType, offset, baseVertex)
 
 
 class CompressedGeometry(Geometry):
+    """
+    A Geometry whose store vertices are shared by value, not by index.
+    """
     @staticmethod
     def make_single_index(bufs, index):
         h = {}
@@ -101,35 +465,36 @@ class CompressedGeometry(Geometry):
             n, newBufSize, newBufSize / n))
         return newBufs, newIndex
 
-    def __init__(self, name, vertices, normals, texcoords, indices, material):
-        self.name = name
-        self.material = material
-
-        self.adjVertices = AdjacencyVertexBuffer(vertices, indices[:, 0])
-
+    @staticmethod
+    def process(vertices, normals, texcoords, indices, compact=False,
+                cache_size=0, overdraw=False, lod_levels=0, lod_ratio=.25, joints=None,
+                ranges=None):
         bufs = [vertices, normals, texcoords]\
             if texcoords is not None else [vertices, normals]
         with utils.timeit_context('Compress'):
             # newBufs, newIndex = self.make_single_index(bufs, indices)
-            newBufs, newIndex = _model.make_single_index_1(bufs, indices)
-        self.vertices = VertexBuffer(newBufs[0])
-        self.normals = VertexBuffer(newBufs[1])
-        if texcoords is not None:
-            self.texcoords = VertexBuffer(newBufs[2])
-        else:
-            self.texcoords = None
-        self.indices = IndexBuffer(newIndex)
-
-    def free(self):
-        super().free()
-        self.indices.free()
-
-    def draw(self):
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.indices.glId)
-        glDrawElements(GL_TRIANGLES, len(self.indices), GL_UNSIGNED_INT, None)
+            newBufs, newIndex = _model.make_single_index_3(bufs, indices)
+        # newIndex numbers store vertices by first use.
+        _, first = np.unique(newIndex, return_index=True)
+        arrays = {
+            'vertices': newBufs[0],
+            'normals': newBufs[1],
+            'texcoords': newBufs[2] if texcoords is not None else None,
+            'indices': newIndex,
+            'vertexIds': np.array(indices[first, 0], dtype=GLuint),
+            'subRanges': np.array(
+                ranges if ranges is not None else [0, len(indices)], dtype=np.int64),
+        }
+        return Geometry.postprocess(
+            arrays, compact, cache_size, overdraw, lod_levels, lod_ratio, joints)
 
 
 class Model:
+    # Level of detail of the geometry to draw, see lod.LodSelector.
+    lod = 0
+    # Hidden models are skipped by static batches, see batching.py.
+    visible = True
+
     def __init__(self, name, geometry, matrix):
         self.name = name
         self.geometry = geometry
@@ -186,22 +551,17 @@ class Joint:
 
 
 class ArmaturedModel(Model):
-    def __init__(self, name, geometry, matrix, vertexWeights, vertexJointIds, joints):
+    def __init__(self, name, geometry, matrix, joints):
         """
-        joints must be sorted in topology order.
+        joints must be sorted in topology order. The joint weights and ids
+        are in the vertex store of the geometry.
         """
         super().__init__(name, geometry, matrix)
-        self.vertexWeights = VertexBuffer(vertexWeights)
-        self.vertexJointIds = VertexBuffer(vertexJointIds)
         self.joints = joints
         if config.drawJointAxis:
             self.axies = [Axis(0.1, joint.matrix) for joint in joints]
         self.update(0)
 
-    def free(self):
-        self.vertexWeights.free()
-        self.vertexJointIds.free()
-
     def get_joint_matrices(self):
         return self._matrices.flatten()
 
@@ -273,17 +633,42 @@ class Axis(Model):
         super().__init__('axis', self.get_geometry(), matrix)
 
 
+# Bump this when the output of read_scene changes, to invalidate the cache.
+LOADER_VERSION = 7
+
+
 def load_scene(path):
+    return build_scene(read_scene(path))
+
+
+def read_scene(path, workers=None):
+    """
+    Parse a COLLADA file into plain data, without touching GL. The result is
+    made of dicts, lists, numbers, strings and numpy arrays only, so it can be
+    stored in the scene cache. `build_scene` turns it into a Scene.
+
+    Geometries are processed by `workers` processes, see process_geometries.
+    """
     mesh = collada.Collada(path)
-    scene = Scene()
-    jointRoots = {}
+    data = {
+        'materials': [],
+        'geometries': [],
+        'models': [],
+        'armatures': {},
+        'lights': [],
+        'emptyNodes': {},
+    }
+    materialIds = {}
+    # Geometry ids by source geometry, so that the nodes placing the same
+    # mesh share a Geometry and can be instanced. Skinned ones aren't shared.
+    geometryIds = {}
     for node in mesh.scene.nodes:
         matrix = node.matrix
         nodeName = node.xmlnode.attrib.get('name', None)
         if not node.children:
             if nodeName is not None:
                 # An empty node
-                scene.add_empty_node(nodeName, matrix)
+                data['emptyNodes'][nodeName] = matrix
             continue
         node = node.children[0]
         # debug(type(node))
@@ -292,130 +677,558 @@ def load_scene(path):
             # scene.camera.append(camera)
             pass
         elif isinstance(node, collada.scene.GeometryNode):
-            geometry = build_geometry(scene, mesh, node.geometry)
-            scene.geometries.append(geometry)
-            model = Model(nodeName, geometry, matrix)
-            scene.add_model(model)
+            key = id(node.geometry)
+            if key not in geometryIds:
+                geometryIds[key] = read_geometry(data, mesh, node.geometry, materialIds)
+            geometryId = geometryIds[key]
+            data['models'].append({
+                'name': nodeName, 'geometry': geometryId, 'matrix': matrix,
+            })
         elif isinstance(node, collada.scene.ControllerNode):
             controller = node.controller
             geom = node.controller.geometry
-            geometry = build_geometry(scene, mesh, geom)
-            scene.geometries.append(geometry)
-
-            maxJointsPerVertex = 4
-            nVertices = len(controller.weight_index)
-            poly = geom.primitives[0]
-            vertexIds = poly.index[:, 0]
-            weightData = controller.weights.data.flatten()
-            weightIndex = controller.weight_index
-            weights = np.zeros((nVertices, maxJointsPerVertex), dtype=GLfloat)
-            jointIds = np.zeros((nVertices, maxJointsPerVertex), dtype=GLfloat)
-            jointIndex = controller.joint_index
-            nExceedVertex = 0
-            for i in range(nVertices):
-                wIndex = weightIndex[i]
-                jIndex = jointIndex[i]
-                nJoints = len(jIndex)
-                if nJoints > maxJointsPerVertex:
-                    nExceedVertex += 1
-                    data = list(zip(-weightData[wIndex], jIndex))
-                    data.sort()
-                    data = data[:maxJointsPerVertex]
-                    weights[i, :] = [-w for w, _ in data]
-                    weights[i] /= weights[i].sum()
-                    jointIds[i, :] = [j for _, j in data]
-                    # weights[i, :] = 0
-                else:
-                    weights[i, :nJoints] = weightData[wIndex]
-                    jointIds[i, :nJoints] = jIndex
-            debug('WARNNING: nExceedVertex', nExceedVertex)
-            weights = weights[vertexIds]
-            jointIds = jointIds[vertexIds]
-            # Make joints
-            # import pdb; pdb.set_trace()
-            joints = jointRoots[controller.xmlnode.attrib['name'].replace('.', '_')]
-            for joint in joints:
-                joint.invBindMatrix =\
-                    controller.joint_matrices[joint.name.encode('utf-8')]
-            debug('nJoinst:', len(joints))
-
+            geometryId = read_geometry(data, mesh, geom, materialIds)
+            influences = np.asarray(controller.vertex_weight_index).reshape(
+                (-1, controller.nindices))
             jointSouce = controller.sourcebyid[controller.joint_source]
-            nameToJoint = {joint.name: joint for joint in joints}
-            for i, name in enumerate(jointSouce):
-                joint = nameToJoint[name.decode('utf-8')]
-                joint.id = i
-            del nameToJoint, jointSouce
-
-            # list(map(debug, joints))
-
-            # Make armatured model
-            # debug('model matrix', matrix)
-            matrix = controller.bind_shape_matrix
-            # debug('bind_shape_matrix', matrix)
-            model = ArmaturedModel(nodeName, geometry, matrix, weights, jointIds, joints)
-
-            scene.add_model(model)
+            model = {
+                'name': nodeName, 'geometry': geometryId,
+                'matrix': controller.bind_shape_matrix,
+            }
+            model.update(read_skin(
+                data, controller.weights.data.flatten(),
+                controller.vcounts,
+                influences[:, controller.offsets[1]],
+                influences[:, controller.offsets[0]],
+                controller.xmlnode.attrib['name'].replace('.', '_'),
+                [to_str(name) for name in jointSouce],
+                {to_str(name): matrix
+                    for name, matrix in controller.joint_matrices.items()},
+            ))
+            data['models'].append(model)
         elif isinstance(node, collada.scene.LightNode):
             daeLight = node.light
-            light = Light(matrix[0:3, 3], daeLight.color, config.defaultLightPower)
-            scene.lights.append(light)
+            data['lights'].append({
+                'pos': matrix[0:3, 3], 'color': daeLight.color,
+                'power': config.defaultLightPower,
+            })
         else:
             attrib = node.xmlnode.attrib
             type = attrib.get('type', '') or attrib.get('TYPE')
             if type.lower() == 'joint':
-                joints = []
-                build_joint_hierachy(node, matrix, None, joints)
-                jointRoots[nodeName] = joints
-    return scene
+                joints = {'names': [], 'parents': [], 'matrices': []}
+                read_joint_hierachy(node, matrix, -1, joints)
+                joints['matrices'] = np.array(joints['matrices'])
+                data['armatures'][nodeName] = joints
+    process_scene_geometries(data, workers)
+    return data
+
 
+def process_scene_geometries(data, workers=None):
+    """
+    Run the tasks left in data['geometries'] by add_geometry and store their
+    results as the 'arrays' item. The geometries of skins get the joint each
+    position is mostly bound to, so that levels of detail keep them apart.
+    """
+    tasks = [g.pop('task') for g in data['geometries']]
+    for m in data['models']:
+        if 'armature' in m and len(m['weights']):
+            joints = np.take_along_axis(
+                m['jointIds'], np.argmax(m['weights'], axis=1)[:, None], axis=1)
+            task = tasks[m['geometry']]
+            tasks[m['geometry']] = task[:9] + (joints.ravel(),) + task[10:]
+    for g, arrays in zip(data['geometries'], process_geometries(tasks, workers)):
+        g['arrays'] = arrays
+
+
+def sort_clusters(vertices, indices, starts):
+    """
+    Sort the clusters of triangles of `indices`, which start at triangle
+    offsets `starts`, so that those facing away from the center of the mesh
+    come first. On a roughly convex mesh they occlude the others, which
+    reduces overdraw.
+    """
+    triangles = vertices[indices.reshape((-1, 3))].astype(np.float64)
+    centers = triangles.mean(axis=1)
+    # Area weighted normals
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    sizes = np.diff(np.append(starts, len(triangles)))
+    clusterCenters = np.add.reduceat(centers, starts) / sizes[:, None]
+    clusterNormals = np.add.reduceat(normals, starts)
+    lengths = np.linalg.norm(clusterNormals, axis=1)
+    lengths[lengths == 0] = 1
+    outward = ((clusterCenters - centers.mean(axis=0)) * clusterNormals).sum(axis=1) / lengths
+    rank = np.empty(len(starts), dtype=np.int64)
+    rank[np.argsort(-outward, kind='stable')] = np.arange(len(starts))
+    order = np.argsort(np.repeat(rank, sizes), kind='stable')
+    return indices.reshape((-1, 3))[order].ravel()
+
+
+def quantize_snorm16(values):
+    """Encode values in [-1, 1] as normalized int16."""
+    return np.round(np.clip(values, -1, 1) * 32767).astype(np.int16)
+
+
+def quantize_weights(weights):
+    """
+    Encode rows of weights as normalized uint8. The largest weight of each
+    row takes the rounding error, so rows keep their sum, 1 for most.
+    """
+    weights = np.clip(weights, 0, 1)
+    result = np.round(weights * 255).astype(np.int32)
+    target = np.round(weights.sum(axis=1) * 255).astype(np.int32)
+    rows = np.arange(len(result))
+    largest = np.argmax(result, axis=1)
+    result[rows, largest] += target - result.sum(axis=1)
+    return np.clip(result, 0, 255).astype(np.uint8)
+
+
+def pack_skin_weights(weightData, offsets, weightIndex, jointIndex, max_joints=4):
+    """
+    Pack the joint influences of each vertex into fixed size arrays.
 
-def build_joint_hierachy(node, matrix, parent, joints):
-    joint = Joint(node.xmlnode.attrib['sid'], parent, None, matrix.dot(node.matrix))
-    joints.append(joint)
+    The influences are given in CSR form: those of vertex i are
+    weightData[weightIndex[k]] and jointIndex[k] for k in
+    range(offsets[i], offsets[i + 1]). A vertex with more than `max_joints`
+    influences keeps the heaviest ones, renormalised to sum to 1.
+
+    Return (weights, jointIds, nTruncated, maxError): two float32 arrays of
+    shape (nVertices, max_joints), the number of truncated vertices, and the
+    largest change of a single weight caused by the truncation.
+    """
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(offsets)
+    nVertices = len(counts)
+    nInfluences = offsets[-1]
+    width = max(counts.max() if nVertices else 0, max_joints)
+    # Scatter the influences into dense (nVertices, width) arrays.
+    vertexOf = np.repeat(np.arange(nVertices), counts)
+    slot = np.arange(nInfluences) - offsets[vertexOf]
+    weightData = np.asarray(weightData)
+    allWeights = np.zeros((nVertices, width), dtype=weightData.dtype)
+    allJoints = np.zeros((nVertices, width), dtype=np.intp)
+    allWeights[vertexOf, slot] = weightData[np.asarray(weightIndex)[:nInfluences]]
+    allJoints[vertexOf, slot] = np.asarray(jointIndex)[:nInfluences]
+
+    weights = allWeights[:, :max_joints].astype(GLfloat)
+    jointIds = allJoints[:, :max_joints].astype(GLfloat)
+    truncated = np.nonzero(counts > max_joints)[0]
+    maxError = 0.
+    if len(truncated):
+        w = allWeights[truncated]
+        j = allJoints[truncated]
+        # Order the influences by (-weight, joint) with one integer key, so
+        # that argpartition picks the same ones as sorting the pairs would.
+        _, rank = np.unique(-w, return_inverse=True)
+        key = rank.reshape(w.shape).astype(np.int64) * (j.max() + 1) + j
+        key[np.arange(width) >= counts[truncated][:, None]] = np.iinfo(np.int64).max
+        top = np.argpartition(key, max_joints - 1, axis=1)[:, :max_joints]
+        top = np.take_along_axis(
+            top, np.argsort(np.take_along_axis(key, top, axis=1), axis=1), axis=1)
+        topW = np.take_along_axis(w, top, axis=1).astype(GLfloat)
+        newW = topW / topW.sum(axis=1, keepdims=True)
+        weights[truncated] = newW
+        jointIds[truncated] = np.take_along_axis(j, top, axis=1)
+        # Padding slots hold 0, so they don't count as dropped weights.
+        np.put_along_axis(w, top, 0, axis=1)
+        maxError = max(float(np.abs(newW - topW).max()), float(w.max()))
+    return weights, jointIds, len(truncated), maxError
+
+
+def read_joint_hierachy(node, matrix, parent, joints):
+    jointId = len(joints['names'])
+    joints['names'].append(node.xmlnode.attrib['sid'])
+    joints['parents'].append(parent)
+    joints['matrices'].append(matrix.dot(node.matrix))
     for subNode in node.children:
-        build_joint_hierachy(subNode, np.eye(4, dtype=np.float32), joint, joints)
+        read_joint_hierachy(subNode, np.eye(4, dtype=np.float32), jointId, joints)
 
 
-def build_geometry(scene, mesh, geometryCollada):
-    geom = geometryCollada
-    name = geom.name
-    poly = geom.primitives[0]
-    daeMat = mesh.materials[poly.material]
-    if hasattr(daeMat, '_gllibMaterail'):
-        material = daeMat._gllibMaterail
+def to_str(name):
+    """pycollada gives names as bytes or str depending on its version."""
+    return name.decode('utf-8') if isinstance(name, bytes) else str(name)
+
+
+def read_skin(data, weightData, vcounts, weightIndex, jointIndex,
+        armature, skinJoints, jointMatrices):
+    """
+    Return the skinning items of a model dict. Weights and joint ids are per
+    position; build_scene looks them up with the vertexIds of the geometry.
+    The influences of the skin are given in CSR form: vertex i uses the
+    `vcounts[i]` entries of `weightIndex` and `jointIndex` from the sum of
+    the previous counts. `skinJoints` are the joint names the influences
+    index into, `jointMatrices` maps a joint name to its inverse bind matrix.
+    """
+    if config.maxJointsPerVertex not in (4, 8):
+        raise ValueError('maxJointsPerVertex must be 4 or 8, not {}'.format(
+            config.maxJointsPerVertex))
+    vcounts = np.asarray(vcounts, dtype=np.intp)
+    weights, jointIds, nTruncated, maxError = pack_skin_weights(
+        weightData,
+        np.concatenate([[0], np.cumsum(vcounts)]),
+        weightIndex, jointIndex,
+        config.maxJointsPerVertex,
+    )
+    debug('skin: nTruncatedVertices={}, maxWeightError={}'.format(
+        nTruncated, maxError))
+    # Bind joints
+    jointNames = data['armatures'][armature]['names']
+    invBindMatrices = np.array([jointMatrices[name] for name in jointNames])
+    debug('nJoinst:', len(jointNames))
+    nameToId = {name: i for i, name in enumerate(skinJoints)}
+    jointOrder = [nameToId.get(name, -1) for name in jointNames]
+    if config.compactVertices:
+        weights = quantize_weights(weights)
+        if jointIds.size == 0 or jointIds.max() < 256:
+            jointIds = jointIds.astype(np.uint8)
+    return {
+        'weights': weights, 'jointIds': jointIds,
+        'armature': armature, 'jointOrder': jointOrder,
+        'invBindMatrices': invBindMatrices,
+    }
+
+
+def read_material(data, daeMat, materialIds):
+    """
+    Return the id of the material in data['materials'], adding it if needed.
+    """
+    if id(daeMat) in materialIds:
+        return materialIds[id(daeMat)]
+    if hasattr(daeMat.effect.diffuse, 'sampler'):
+        image = daeMat.effect.diffuse.sampler.surface.image
+        # Keep the encoded image; it is decoded when the material is built.
+        diffuse = np.frombuffer(image.getData(), dtype=np.uint8)
+        diffuseType = Material.DIFFUSE_TEXTURE
     else:
-        if hasattr(daeMat.effect.diffuse, 'sampler'):
-            diffuse = daeMat.effect.diffuse.sampler.surface.image.getImage()
-            diffuseType = Material.DIFFUSE_TEXTURE
+        diffuse = daeMat.effect.diffuse[:3]
+        diffuseType = Material.DIFFUSE_COLOR
+    data['materials'].append({
+        'name': daeMat.name,
+        'diffuseType': diffuseType,
+        'diffuse': diffuse,
+        'Ka': (daeMat.effect.ambient[:3]
+            if not isinstance(daeMat.effect.ambient, collada.material.Map)
+            else (0., 0., 0.)),
+        'Ks': daeMat.effect.specular[:3],
+        'shininess': daeMat.effect.shininess,
+    })
+    materialIds[id(daeMat)] = len(data['materials']) - 1
+    return materialIds[id(daeMat)]
+
+
+def read_geometry(data, mesh, geometryCollada, materialIds):
+    """
+    Add the geometry to data['geometries']. Return its id.
+    """
+    geom = geometryCollada
+    primitives = []
+    for poly in geom.primitives:
+        if not isinstance(poly, (collada.triangleset.TriangleSet, collada.polylist.Polylist)):
+            debug('unsupported primitive', type(poly).__name__, 'in', geom.name)
+            continue
+        materialId = read_material(data, mesh.materials[poly.material], materialIds)
+        primitives.append(
+            (materialId, poly.vertex, poly.normal, poly.texcoordset, poly.index))
+    return add_geometry(data, geom.name, primitives)
+
+
+def add_geometry(data, name, primitives):
+    """
+    Add a geometry read from its primitives, tuples of (materialId, vertex,
+    normal, texcoordset, index), to data['geometries']. Return its id.
+
+    The primitives are merged into one vertex store: their sources are
+    concatenated, with the indices moved accordingly, and 'ranges' gives
+    where the corners of each primitive start. A source shared by several
+    primitives is kept once, so that they share store vertices and skin
+    data still matches the positions. The arguments of Geometry.process are
+    left in the 'task' item.
+    """
+    textured = [
+        data['materials'][materialId]['diffuseType'] == Material.DIFFUSE_TEXTURE
+        for materialId, *_ in primitives]
+    # Sources of positions, normals and texcoords, and where each starts
+    sources = ([], [], [])
+    starts = ({}, {}, {})
+
+    def start_of(j, source):
+        if id(source) not in starts[j]:
+            starts[j][id(source)] = sum(map(len, sources[j]))
+            sources[j].append(source)
+        return starts[j][id(source)]
+
+    indices, ranges = [], [0]
+    for (materialId, vertex, normal, texcoordset, index), hasUV in zip(primitives, textured):
+        indexTupleSize = 3 if hasUV else 2
+        index = index.reshape((index.size // indexTupleSize, indexTupleSize))
+        columns = [index[:, 0] + start_of(0, vertex), index[:, 1] + start_of(1, normal)]
+        if hasUV:
+            columns.append(index[:, 2] + start_of(2, texcoordset[0]))
+        elif any(textured):
+            # Filled in with the zero texcoord added below.
+            columns.append(np.full(len(index), -1, dtype=index.dtype))
+        indices.append(np.stack(columns, axis=1))
+        ranges.append(ranges[-1] + len(index))
+    index = np.concatenate(indices)
+    if not all(textured) and any(textured):
+        index[index[:, 2] == -1, 2] = start_of(2, np.zeros((1, 2), dtype=sources[2][0].dtype))
+    vertex, normal, texcoord = [
+        (arrays[0] if len(arrays) == 1 else np.concatenate(arrays)) if arrays else None
+        for arrays in sources]
+    debug('load geometry: nVertices={}, nFaces={}, nIndices={}, nPrimitives={}'.format(
+        len(vertex), len(index) // 3, len(index), len(primitives)))
+    data['geometries'].append({
+        'name': name,
+        'materials': [materialId for materialId, *_ in primitives],
+        'task': (
+            vertex, normal, texcoord,
+            index, config.compactVertices,
+            config.vertexCacheSize, config.overdrawOptimize,
+            config.lodLevels, config.lodRatio, None,
+            np.array(ranges, dtype=np.int64),
+        ),
+    })
+    return len(data['geometries']) - 1
+
+
+def process_geometries(tasks, workers=None):
+    """
+    Run Geometry.process on each tuple of arguments in `tasks`. The work is
+    spread over a spawned pool of `workers` processes (config.loadWorkers by
+    default, None means one per CPU) which hand their results back through
+    shared memory. The results are the same as running the tasks serially.
+    """
+    if workers is None:
+        workers = config.loadWorkers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        return [Geometry.process(*task) for task in tasks]
+    # Workers must share our resource tracker, or it unlinks the blocks they
+    # create when they exit.
+    resource_tracker.ensure_running()
+    with utils.timeit_context('process geometries with {} workers'.format(workers)):
+        # Spawned: forking would copy the GL context and the threads of the
+        # viewer in their current state.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            futures = [executor.submit(_process_geometry_shared, task) for task in tasks]
+            results = []
+            try:
+                for future in futures:
+                    results.append({
+                        name: from_shared_memory(array)
+                        for name, array in future.result().items()})
+            except BaseException:
+                # The blocks of the results not read would stay until exit.
+                for future in futures[len(results):]:
+                    if not future.cancel() and future.exception() is None:
+                        for array in future.result().values():
+                            unlink_shared_memory(array)
+                raise
+            return results
+
+
+def _process_geometry_shared(task):
+    arrays = Geometry.process(*task)
+    return {name: to_shared_memory(array) for name, array in arrays.items()}
+
+
+def to_shared_memory(array):
+    """
+    Copy `array` into a new shared memory block and return a description of
+    it for `from_shared_memory`. The block is owned by the reader.
+    """
+    if array is None or array.nbytes == 0:
+        return array
+    shm = SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    shm.close()
+    return (shm.name, array.shape, array.dtype.str)
+
+
+def unlink_shared_memory(desc):
+    """
+    Free the block of `desc` from `to_shared_memory` without reading it.
+    """
+    if not isinstance(desc, tuple):
+        return
+    try:
+        shm = SharedMemory(name=desc[0])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def from_shared_memory(desc):
+    if not isinstance(desc, tuple):
+        return desc
+    name, shape, dtype = desc
+    shm = SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def build_scene(data):
+    """
+    Make a Scene from the output of `read_scene`.
+    """
+    scene = Scene()
+    materials = [build_material(m) for m in data['materials']]
+    skins = {m['geometry']: m for m in data['models'] if 'armature' in m}
+    geometries = []
+    for i, g in enumerate(data['geometries']):
+        arrays = g['arrays']
+        if i in skins:
+            # Skin data is per position, the store has a vertex per index tuple.
+            vertexIds = arrays['vertexIds']
+            arrays = dict(arrays,
+                weights=skins[i]['weights'][vertexIds],
+                jointIds=skins[i]['jointIds'][vertexIds])
+        geometries.append(
+            Geometry.from_arrays(
+                g['name'], arrays, [materials[i] for i in g['materials']]))
+    scene.geometries.extend(geometries)
+    if config.adjacencyPrecompute:
+        threading.Thread(
+            target=prepare_adjacency, args=(geometries,), daemon=True).start()
+    armatures = {
+        name: build_joints(joints) for name, joints in data['armatures'].items()}
+    for m in data['models']:
+        geometry = geometries[m['geometry']]
+        if 'armature' in m:
+            joints = armatures[m['armature']]
+            for joint, jointId, invBindMatrix in zip(
+                    joints, m['jointOrder'], m['invBindMatrices']):
+                joint.id = jointId
+                joint.invBindMatrix = invBindMatrix
+            # list(map(debug, joints))
+            model = ArmaturedModel(m['name'], geometry, m['matrix'], joints)
         else:
-            diffuse = daeMat.effect.diffuse[:3]
-            diffuseType = Material.DIFFUSE_COLOR
-        material = daeMat._gllibMaterail = Material(
-            daeMat.name, diffuseType, diffuse,
-            Ka=(daeMat.effect.ambient[:3]
-                if not isinstance(daeMat.effect.ambient, collada.material.Map)
-                else (0., 0., 0.)),
-            Ks=daeMat.effect.specular[:3],
-            shininess=daeMat.effect.shininess,
-        )
-    index = poly.index
-    indexTupleSize = 3 if material.diffuseType == Material.DIFFUSE_TEXTURE else 2
-    index = index.reshape((index.size // indexTupleSize, indexTupleSize))
-    debug('load geometry: nVertices={}, nFaces={}, nIndices={}'.format(
-        len(poly.vertex), len(index) // 3, len(index)))
-    # return CompressedGeometry(
-    return Geometry(
-        name, poly.vertex, poly.normal,
-        (poly.texcoordset[0] if indexTupleSize == 3 else None),
-        index, material,
+            model = Model(m['name'], geometry, m['matrix'])
+        scene.add_model(model)
+    for l in data['lights']:
+        scene.lights.append(Light(l['pos'], l['color'], l['power']))
+    for name, matrix in data['emptyNodes'].items():
+        scene.add_empty_node(name, matrix)
+    return scene
+
+
+def prepare_adjacency(geometries):
+    """
+    Compute the adjacency indices of geometries ahead of the silhouette pass.
+    """
+    for geometry in geometries:
+        geometry.make_adj_indices()
+
+
+def build_joints(data):
+    joints = []
+    for name, parent, matrix in zip(data['names'], data['parents'], data['matrices']):
+        joints.append(Joint(name, joints[parent] if parent >= 0 else None, None, matrix))
+    return joints
+
+
+def build_material(data):
+    diffuse = data['diffuse']
+    if data['diffuseType'] == Material.DIFFUSE_TEXTURE:
+        # Decoded in the background, see textures.py.
+        diffuse = textures.load_texture(diffuse)
+    return Material(
+        data['name'], data['diffuseType'], diffuse,
+        Ka=data['Ka'], Ks=data['Ks'], shininess=data['shininess'],
     )
 
 
+_sceneCache = None
+
+def get_scene_cache():
+    global _sceneCache
+    if _sceneCache is None:
+        _sceneCache = ArrayCache(
+            os.path.join(config.cacheDir, 'scenes'), config.sceneCacheMaxBytes)
+    return _sceneCache
+
+
+def scene_cache_key(path, compact=None):
+    """
+    Return the scene cache key of file `path`, whose arrays are compact if
+    `compact` is true (config.compactVertices by default) and processed with
+    the current vertex cache, level of detail and skinning settings.
+    """
+    if compact is None:
+        compact = config.compactVertices
+    settings = (
+        LOADER_VERSION, int(bool(compact)),
+        config.vertexCacheSize, int(bool(config.overdrawOptimize)),
+        config.lodLevels, config.lodRatio, config.maxJointsPerVertex,
+    )
+    return hash_file(path, '-'.join(map(str, settings)))
+
+
+def get_scene_reader(name):
+    """
+    Return the function reading a COLLADA file into plain data: 'pycollada'
+    for read_scene, 'fast' for the streaming reader of fastcollada.
+    """
+    if name == 'pycollada':
+        return read_scene
+    elif name == 'fast':
+        from .fastcollada import read_scene_fast
+        return read_scene_fast
+    raise ValueError('unknown scene reader: {}'.format(name))
+
+
+def read_scene_cached(path, force_reload=False, workers=None, reader='pycollada'):
+    """
+    Same as `read_scene`, but the result is kept in the scene cache, keyed by
+    the content of the file, LOADER_VERSION and the vertex settings. Both
+    readers give the same data, so they share the entries.
+    """
+    cache = get_scene_cache()
+    key = scene_cache_key(path)
+    data = None if force_reload else cache.get(key)
+    if data is None:
+        data = get_scene_reader(reader)(path, workers)
+        cache.put(key, data)
+    else:
+        debug('load scene from cache', key)
+    return data
+
+
+def invalidate_scene_cache(path=None):
+    """
+    Drop the cached scene of file `path`, or the whole cache if path is None.
+    """
+    cache = get_scene_cache()
+    if path is None:
+        cache.clear()
+    else:
+        for compact in (False, True):
+            cache.invalidate(scene_cache_key(path, compact))
+
+
 class Scene:
     @classmethod
-    def load(self, path):
+    def load(self, path, force_reload=False, workers=None, reader='pycollada'):
+        """
+        Load a scene from a COLLADA file. Processed data is read from the
+        scene cache if config.sceneCacheEnable is set; `force_reload` makes
+        the file be parsed again and the cache entry be replaced. `workers`
+        is the number of processes used to process geometries. `reader` is
+        'pycollada' or 'fast', see get_scene_reader.
+        """
         with utils.timeit_context('load model'):
-            scene = load_scene(path)
+            if config.sceneCacheEnable:
+                data = read_scene_cached(path, force_reload, workers, reader)
+            else:
+                data = get_scene_reader(reader)(path, workers)
+            scene = build_scene(data)
         return scene
 
     def __init__(self):
@@ -1,11 +1,12 @@
 import os
-import pickle
 from raygllib import Program, TextureUnit, VertexBuffer
+from raygllib.gllib import glState
+from raygllib import config
+from raygllib.cache import ArrayCache
+from raygllib.utils import debug
 from OpenGL.GL import *
-import Image
+from PIL import Image
 import numpy as np
-import hashlib
-import datetime
 
 curDir = os.path.split(__file__)[0]
 
@@ -34,34 +35,27 @@ class ModelRenderer(Program):
         self.lights = []
 
     def set_MVP(self, modelMat, viewMat, projMat):
-        glUniformMatrix4fv(self.get_uniform_loc('modelMat'), 1, GL_TRUE, modelMat)
-        glUniformMatrix4fv(self.get_uniform_loc('viewMat'), 1, GL_TRUE, viewMat)
-        glUniformMatrix4fv(self.get_uniform_loc('projMat'), 1, GL_TRUE, projMat)
-
-    def set_matrix(self, name, mat):
-        glUniformMatrix4fv(self.get_uniform_loc(name), mat)
+        self.set_matrix('modelMat', modelMat)
+        self.set_matrix('viewMat', viewMat)
+        self.set_matrix('projMat', projMat)
 
     def set_material(self, material):
-        glActiveTexture(self.textureUnit.glenum)
-        glBindTexture(GL_TEXTURE_2D, material.textureId)
-        glUniform1i(self.get_uniform_loc('textureSampler'), self.textureUnit.id)
-        glUniform1f(self.get_uniform_loc('shininess'), material.Ns)
-        glUniform3f(self.get_uniform_loc('Ka'), *material.Ka)
-        glUniform3f(self.get_uniform_loc('Kd'), *material.Kd)
-        glUniform3f(self.get_uniform_loc('Ks'), *material.Ks)
+        glState.active_texture(self.textureUnit.glenum)
+        glState.bind_texture(GL_TEXTURE_2D, material.textureId)
+        self.set_uniform('textureSampler', self.textureUnit.id)
+        self.set_uniform('shininess', material.Ns)
+        self.set_uniform('Ka', material.Ka)
+        self.set_uniform('Kd', material.Kd)
+        self.set_uniform('Ks', material.Ks)
 
     def add_light(self, light):
         self.lights.append(light)
 
     def prepare_draw(self):
-        n = len(self.lights)
-        glUniform1fv(self.get_uniform_loc('lightPower'), n,
-            [light.power for light in self.lights])
-        glUniform3fv(self.get_uniform_loc('lightColor'), n,
-            [light.color for light in self.lights])
-        glUniform3fv(self.get_uniform_loc('lightPosCamSpace'), n,
-            [light.pos for light in self.lights])
-        glUniform1i(self.get_uniform_loc('nLights'), n)
+        self.set_uniform('lightPower', [light.power for light in self.lights])
+        self.set_uniform('lightColor', [light.color for light in self.lights])
+        self.set_uniform('lightPosCamSpace', [light.pos for light in self.lights])
+        self.set_uniform('nLights', len(self.lights))
 
     def draw_model(self, model):
         for obj in model.objects:
@@ -79,14 +73,18 @@ class Material:
     def __init__(self, name):
         self.name = name
         self.imagePath = None
+        self._textureId = None
 
     def load_image(self, image_path):
         self.imagePath = image_path
-        self.textureId = make_texture(Image.open(image_path), GL_TEXTURE_2D)
+        self._textureId = None
 
-    def __setstate__(self, new_dict):
-        self.__dict__ = new_dict
-        self.load_image(new_dict['imagePath'])
+    @property
+    def textureId(self):
+        """The texture is made on first use, when there is a GL context."""
+        if self._textureId is None and self.imagePath is not None:
+            self._textureId = make_texture(Image.open(self.imagePath), GL_TEXTURE_2D)
+        return self._textureId
 
 
 class MaterialGroup:
@@ -151,94 +149,275 @@ class ModelObject:
             np.array(self.texcoords, dtype=GLfloat), GL_STATIC_DRAW)
 
 
-DUMP_FOLDER = '__modeldump__'
-META_FILE = 'meta'
-CACHE_SIZE = 32
+# Bump when the data returned by _read changes, to drop old cache entries.
+LOADER_VERSION = 1
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ArrayCache(
+            os.path.join(config.cacheDir, 'modellib'), config.modelCacheMaxBytes)
+    return _cache
+
 
 def load(filename, force_reload=False):
-    if not os.path.exists(DUMP_FOLDER):
-        os.mkdir(DUMP_FOLDER)
-    metaPath = os.path.join(DUMP_FOLDER, META_FILE)
-    try:
-        meta = pickle.load(open(metaPath, 'rb'))
-    except:
-        meta = {}
-    data = open(filename, 'rb').read()
-    md5hash = hashlib.md5()
-    md5hash.update(data)
-    md5 = md5hash.digest()
-    if not force_reload and md5 in meta:
-        modelPath = os.path.join(DUMP_FOLDER, meta[md5][1])
-        meta[md5] = datetime.datetime.now(), meta[md5][1]
-        result = pickle.load(open(modelPath, 'rb'))
+    """
+    Load a model. The data read from the file is kept in the model cache,
+    keyed by the content of the file; `force_reload` makes the file be read
+    again and the cache entry be replaced.
+    """
+    cache = get_cache()
+    key = cache.file_key(filename, LOADER_VERSION)
+    data = None if force_reload else cache.get(key)
+    if data is None:
+        data = _read(filename)
+        if data is None:
+            return None
+        cache.put(key, data)
     else:
-        result = _load(filename)
-        meta[md5] = datetime.datetime.now(), md5hash.hexdigest()
-        modelPath = os.path.join(DUMP_FOLDER, meta[md5][1])
-        with open(modelPath, 'wb') as outfile:
-            pickle.dump(result, outfile, -1)
-    meta = dict(list(sorted(meta.items(), key=lambda x: x[1][0]))[:CACHE_SIZE])
-    with open(metaPath, 'wb') as outfile:
-        pickle.dump(meta, outfile, -1)
-    return result
+        debug('load model from cache', key)
+    return build_model(data, os.path.split(filename)[0])
 
 
 def _load(filename):
+    data = _read(filename)
+    return build_model(data, os.path.split(filename)[0]) if data is not None else None
+
+
+def _read(filename):
+    """
+    Read a model file into plain data, without touching GL.
+    """
     name, ext = os.path.splitext(filename)
     ext = ext.lower()
     if ext == '.obj':
-        return _load_obj(filename)
+        return read_obj(filename)
     elif ext == '.dae':
-        return _load_collada(filename)
+        return _read_collada(filename)
 
 
-def _load_collada(filename):
+def _read_collada(filename):
     pass
 
 
-def _load_obj(filename):
-    dir, name = os.path.split(filename)
+def build_model(data, dir):
+    """
+    Make a Model from the data of _read. Paths in data are relative to `dir`.
+    """
+    model = Model()
+    if data['mtllib'] is not None:
+        model.mtllib = MaterialGroup(os.path.join(dir, data['mtllib']))
+    for objData in data['objects']:
+        obj = ModelObject(objData['name'])
+        obj.vertices = objData['vertices']
+        obj.normals = objData['normals']
+        obj.texcoords = objData['texcoords']
+        if objData['material'] is not None:
+            obj.material = model.mtllib.get(objData['material'])
+        model.objects.append(obj)
+    model.finish()
+    return model
+
+
+# Size in characters of the blocks an OBJ file is read by.
+BLOCK_SIZE = 1 << 24
+
+
+def read_obj(filename, block_size=BLOCK_SIZE):
+    """
+    Read an OBJ file into plain data: {'mtllib': name or None, 'objects':
+    [{'name', 'material', 'vertices', 'normals', 'texcoords'}]}, with one
+    row per triangle corner in the arrays.
+    """
+    reader = ObjReader()
     with open(filename, 'r') as infile:
-        tmpVs = tmpVs = []  # temperary vertices
-        tmpVns = tmpVns = []  # temperary normals
-        tmpVts = tmpVts = []  # temperary texcoords
-        lineId = 0
-        obj = None
-        model = Model()
-        for line in infile:
-            line = line.strip()
-            lineId += 1
-            if not line:
+        rest = ''
+        for block in iter(lambda: infile.read(block_size), ''):
+            block = rest + block
+            end = block.rfind('\n') + 1
+            if end == 0:
+                rest = block
                 continue
-            if line[0] == '#':
+            rest = block[end:]
+            reader.feed(block[:end].splitlines())
+        reader.feed(rest.splitlines())
+    return reader.finish()
+
+
+class ObjReader:
+    """
+    Reads OBJ lines a block at a time. Lines are only sorted by record type
+    in Python; runs of v/vt/vn records and of f records are each parsed with
+    a single numpy call, and faces are triangulated as a fan.
+    """
+    def __init__(self):
+        self.mtllib = None
+        # Parsed chunks and pending lines of v, vt, vn records.
+        self.chunks = {'v': [], 'vt': [], 'vn': []}
+        self.lines = {'v': [], 'vt': [], 'vn': []}
+        self.counts = {'v': 0, 'vt': 0, 'vn': 0}
+        self.faceLines = []
+        self.faceBase = None
+        self.objects = []
+
+    def feed(self, lines):
+        for line in lines:
+            # Records are separated from their values by any whitespace.
+            parts = line.strip().split(None, 1)
+            if not parts or parts[0][0] == '#':
                 continue
-            cmd, args = line.split(' ', 1)
-            if cmd == 'f':
-                # face = parse_face(args)
-                for triple in args.split(' '):
-                    idxV, idxT, idxN = triple.split('/')
-                    obj.vertices.append(tmpVs[int(idxV) - 1])
-                    obj.texcoords.append(tmpVts[int(idxT) - 1])
-                    obj.normals.append(tmpVns[int(idxN) - 1])
-            elif cmd == 'v':
-                tmpVs.append(parse_vec(args))
-            elif cmd == 'vn':
-                tmpVns.append(parse_vec(args))
-            elif cmd == 'vt':
-                tmpVts.append(parse_vec(args))
-            elif cmd == 'o':
-                obj = ModelObject(args)
-                model.objects.append(obj)
-            elif cmd == 'mtllib':
-                path = os.path.join(dir, args)
-                model.mtllib = MaterialGroup(path)
-            elif cmd == 'usemtl':
-                obj.material = model.mtllib.get(args)
-
-            if lineId % 100 == 0:
-                print('\r', lineId, end='')
-    model.finish()
-    return model
+            kind = parts[0]
+            body = parts[1] if len(parts) > 1 else ''
+            if kind in self.lines:
+                if self.faceLines:
+                    self.flush_faces()
+                self.lines[kind].append(body)
+                self.counts[kind] += 1
+            elif kind == 'f':
+                if not self.faceLines:
+                    # Relative indices count back from here.
+                    self.faceBase = dict(self.counts)
+                self.faceLines.append(body.strip())
+            elif kind in ('o', 'usemtl'):
+                self.flush_faces()
+                if kind == 'o':
+                    self.add_object(body.strip(), None)
+                else:
+                    self.use_material(body.strip())
+            elif kind == 'mtllib':
+                self.mtllib = body.strip()
+        self.flush_faces()
+        for kind, lines in self.lines.items():
+            if lines:
+                self.chunks[kind].append(parse_rows(lines, 2 if kind == 'vt' else 3))
+                lines.clear()
+
+    def add_object(self, name, material):
+        self.objects.append({'name': name, 'material': material, 'corners': []})
+
+    def use_material(self, material):
+        if not self.objects:
+            self.add_object('default', material)
+        obj = self.objects[-1]
+        if obj['corners'] and obj['material'] != material:
+            # A new material needs its own draw, so its own object.
+            self.add_object(obj['name'], material)
+        else:
+            obj['material'] = material
+
+    def flush_faces(self):
+        if not self.faceLines:
+            return
+        if not self.objects:
+            self.add_object('default', None)
+        corners = parse_faces(self.faceLines)
+        base = self.faceBase
+        for column, kind in enumerate(('v', 'vt', 'vn')):
+            raw = corners[:, column]
+            # 1-based, negative is relative to the current count, 0 is missing.
+            index = np.where(raw > 0, raw - 1, raw + base[kind])
+            index[raw == 0] = -1
+            corners[:, column] = index
+        self.objects[-1]['corners'].append(corners)
+        self.faceLines = []
+
+    def finish(self):
+        buffers = {
+            kind: (np.concatenate(chunks) if chunks
+                else np.zeros((0, 2 if kind == 'vt' else 3), dtype=GLfloat))
+            for kind, chunks in self.chunks.items()}
+        objects = []
+        for obj in self.objects:
+            corners = (np.concatenate(obj.pop('corners')) if obj['corners']
+                else np.zeros((0, 3), dtype=np.int32))
+            if len(corners) == 0:
+                continue
+            vertices = buffers['v'][corners[:, 0]]
+            obj['vertices'] = vertices
+            obj['texcoords'] = gather(buffers['vt'], corners[:, 1])
+            normals = gather(buffers['vn'], corners[:, 2])
+            missing = corners[:, 2] < 0
+            if missing.any():
+                normals[missing] = face_normals(vertices)[missing]
+            obj['normals'] = normals
+            objects.append(obj)
+        return {'mtllib': self.mtllib, 'objects': objects}
+
+
+def gather(buffer, index):
+    """Rows of buffer at index, zeros where the index is -1."""
+    result = np.zeros((len(index), buffer.shape[1]), dtype=GLfloat)
+    valid = index >= 0
+    result[valid] = buffer[index[valid]]
+    return result
+
+
+def face_normals(vertices):
+    """Flat normal of each triangle corner, for faces given without normals."""
+    a, b, c = vertices[0::3], vertices[1::3], vertices[2::3]
+    normals = np.cross(b - a, c - a)
+    lengths = np.sqrt((normals * normals).sum(axis=1, keepdims=True))
+    normals /= np.maximum(lengths, 1e-20)
+    return np.repeat(normals, 3, axis=0)
+
+
+def parse_rows(lines, ncols):
+    """
+    Parse lines of numbers into a (len(lines), ncols) array, dropping or
+    zero padding extra or missing trailing values.
+    """
+    nValues = len(lines[0].split())
+    values = np.fromstring(' '.join(lines), dtype=GLfloat, sep=' ')
+    if nValues and len(values) == nValues * len(lines):
+        values = values.reshape((len(lines), nValues))
+    else:
+        values = np.array([
+            (list(map(float, line.split())) + [0.] * ncols)[:nValues]
+            for line in lines], dtype=GLfloat)
+        nValues = values.shape[1]
+    if nValues >= ncols:
+        return np.ascontiguousarray(values[:, :ncols])
+    return np.hstack([values, np.zeros((len(lines), ncols - nValues), dtype=GLfloat)])
+
+
+def parse_faces(lines):
+    """
+    Parse the bodies of f records into triangle corners, an (n, 3) int array
+    of the raw position, texcoord and normal indices, 0 for missing ones.
+    Polygons are triangulated as a fan.
+    """
+    first = lines[0].split(None, 1)[0]
+    k = first.count('/') + 1
+    # A face of k zeros separates faces; real indices are never 0.
+    separator = ' {} '.format('/'.join(['0'] * k))
+    text = (separator.join(lines) + separator).replace('//', '/0/')
+    nCorners = text.count('/') // (k - 1) if k > 1 else None
+    values = np.fromstring(text.replace('/', ' '), dtype=np.int64, sep=' ')
+    if nCorners is None and '/' not in text:
+        nCorners = len(values)
+    if nCorners is None or len(values) != nCorners * k:
+        # Corners of mixed formats, normalize them one by one.
+        lines = [
+            ' '.join(
+                '/'.join((corner.split('/') + ['0', '0'])[:3]).replace('//', '/0/')
+                for corner in line.split())
+            for line in lines]
+        return parse_faces(lines)
+    values = values.reshape((-1, k))
+    if k < 3:
+        values = np.hstack([values, np.zeros((len(values), 3 - k), dtype=values.dtype)])
+    isSeparator = values[:, 0] == 0
+    ends = np.flatnonzero(isSeparator)
+    counts = np.diff(np.concatenate([[-1], ends])) - 1
+    starts = ends - counts - np.arange(len(ends))
+    corners = values[~isSeparator]
+    # Fan triangulation: triangle j of a face uses corners 0, j + 1, j + 2.
+    nTriangles = np.maximum(counts - 2, 0)
+    faceStarts = np.repeat(starts, nTriangles)
+    j = np.arange(nTriangles.sum()) - np.repeat(np.cumsum(nTriangles) - nTriangles, nTriangles)
+    triangles = np.stack([faceStarts, faceStarts + j + 1, faceStarts + j + 2], axis=1)
+    return corners[triangles.ravel()].astype(np.int32)
 
 
 def parse_vec(args):
@@ -258,7 +437,7 @@ def make_texture(image, target, mag_filter=GL_LINEAR, min_filter=GL_LINEAR):
     width, height = image.size
     glEnable(target)
     textureId = glGenTextures(1)
-    glBindTexture(target, textureId)
+    glState.bind_texture(target, textureId)
     assert textureId > 0, 'Fail to get new texture id.'
     glTexImage2D(
         target, 0,
@@ -1,27 +1,67 @@
 import os
 import numpy as np
 from OpenGL.GL import *
-from .gllib import Program, TextureUnit, UniformNotFoundError
+from .gllib import (
+    Program, Texture2D, TextureUnit, UniformBlock, UniformBuffer, glState,
+)
 from . import config
 from .model import ArmaturedModel
 # from .utils import debug
 
+# Model matrix of pre-transformed batches
+IDENTITY = np.eye(4, dtype=np.float32)
+
+# The camera and lights of a frame, shared by all programs. They are written
+# once a frame by set_camera and set_lights.
+FRAME_BLOCK = UniformBlock('FrameBlock', 0, [
+    ('viewMat', 'mat4'), ('projMat', 'mat4'), ('viewProjMat', 'mat4'),
+])
+LIGHT_BLOCK = UniformBlock('LightBlock', 1, [
+    ('lightPosModelSpace', 'vec3', config.maxLights),
+    ('lightColor', 'vec3', config.maxLights),
+    ('lightPower', 'float', config.maxLights),
+    ('lightEnabled', 'bool', config.maxLights),
+    ('nLights', 'int'),
+])
+frameUniforms = UniformBuffer(FRAME_BLOCK)
+lightUniforms = UniformBuffer(LIGHT_BLOCK)
+
 
 def get_shader_path(name):
     return os.path.join(os.path.dirname(__file__), 'shaders', name)
 
 
+def set_camera(view_mat, proj_mat):
+    """
+    Set the view and projection matrices of the programs.
+    """
+    data = frameUniforms.data
+    data['viewMat'] = view_mat
+    data['projMat'] = proj_mat
+    data['viewProjMat'] = np.dot(proj_mat, view_mat)
+    frameUniforms.update()
+
+
+def set_lights(lights):
+    """
+    Set the lights of the programs, the first config.maxLights of `lights`.
+    """
+    data = lightUniforms.data
+    lights = lights[:config.maxLights]
+    for i, light in enumerate(lights):
+        data['lightPosModelSpace'][i, :3] = light.pos
+        data['lightColor'][i, :3] = light.color
+        data['lightPower'][i, 0] = light.power
+        data['lightEnabled'][i, 0] = light.enabled
+    data['nLights'] = len(lights)
+    lightUniforms.update()
+
+
 class Renderer(Program):
     def __init__(self):
         super().__init__([
             (get_shader_path('model.v.glsl'), GL_VERTEX_SHADER),
             (get_shader_path('model.f.glsl'), GL_FRAGMENT_SHADER),
-        ], [
-            ('vertexPos', 3, GL_FLOAT),
-            ('vertexNormal', 3, GL_FLOAT),
-            ('vertexUV', 2, GL_FLOAT),
-            ('vertexWeights', 4, GL_FLOAT),
-            ('vertexJointIds', 4, GL_FLOAT),
         ])
         self.textureUnit = TextureUnit(0)
         self.toonRenderEdges = config.toonRenderEdges
@@ -33,69 +73,85 @@ class Renderer(Program):
             edges = self.toonRenderEdges
         else:
             edges = []
-        glUniform1i(self.get_uniform_loc('nEdges'), len(edges))
-        glUniform1fv(self.get_uniform_loc('edges'), len(edges), edges)
+        self.set_uniform('nEdges', len(edges))
+        self.set_uniform('edges', edges)
 
     def set_material(self, material):
         if material.diffuseType == material.DIFFUSE_TEXTURE:
-            glActiveTexture(self.textureUnit.glenum)
-            glBindTexture(GL_TEXTURE_2D, material.diffuse.glId)
-            glUniform1i(self.get_uniform_loc('hasSampler'), 1)
-            glUniform1i(self.get_uniform_loc('textureSampler'), self.textureUnit.id)
+            texture = material.diffuse
+            if not texture.ready:
+                texture = Texture2D.get_placeholder()
+            glState.active_texture(self.textureUnit.glenum)
+            glState.bind_texture(GL_TEXTURE_2D, texture.glId)
+            self.set_uniform('hasSampler', 1)
+            self.set_uniform('textureSampler', self.textureUnit.id)
         else:
-            glBindTexture(GL_TEXTURE_2D, 0)
-            glUniform1i(self.get_uniform_loc('hasSampler'), 0)
-            glUniform3f(self.get_uniform_loc('diffuse'), *material.diffuse)
+            glState.bind_texture(GL_TEXTURE_2D, 0)
+            self.set_uniform('hasSampler', 0)
+            self.set_uniform('diffuse', material.diffuse)
 
-        glUniform1f(self.get_uniform_loc('shininess'), material.shininess)
-        glUniform3f(self.get_uniform_loc('Ka'), *material.Ka)
-        glUniform3f(self.get_uniform_loc('Ks'), *material.Ks)
+        self.set_uniform('shininess', material.shininess)
+        self.set_uniform('Ka', material.Ka)
+        self.set_uniform('Ks', material.Ks)
 
     def set_lights(self, lights):
-        lights = [light for light in lights if light.enabled]
-        n = len(lights)
-        glUniform1fv(self.get_uniform_loc('lightPower'), n,
-            np.array([light.power for light in lights], 'f'))
-        glUniform3fv(self.get_uniform_loc('lightColor'), n,
-            np.array([light.color for light in lights], 'f'))
-        try:
-            glUniform3fv(self.get_uniform_loc('lightPosModelSpace'), n,
-                np.array([light.pos for light in lights], 'f'))
-        except UniformNotFoundError:
-            pass
-        glUniform1i(self.get_uniform_loc('nLights'), n)
-
-    def draw_model(self, model):
-        self.set_buffer('vertexPos', model.geometry.vertices)
-        self.set_buffer('vertexNormal', model.geometry.normals)
-        if model.geometry.texcoords:
-            glEnableVertexAttribArray(self._buffers['vertexUV'].location)
-            self.set_buffer('vertexUV', model.geometry.texcoords)
-        else:
-            glDisableVertexAttribArray(self._buffers['vertexUV'].location)
-        self.set_material(model.geometry.material)
+        set_lights(lights)
+
+    def draw_model(self, model, with_material=True):
+        """
+        Draw `model`, setting its material first unless `with_material` is
+        false. Return whether it left another material set, that of a
+        sub-range or of the joint axes.
+        """
+        # Attributes are bound by the VAO of the geometry, those it doesn't
+        # have (uv, weights) stay disabled.
+        if with_material:
+            self.set_material(model.geometry.material)
         self.set_matrix('modelMat', model.matrix)
         if isinstance(model, ArmaturedModel):
-            glUniform1i(self.get_uniform_loc('hasArmature'), 1)
-            self.set_buffer('vertexWeights', model.vertexWeights)
-            self.set_buffer('vertexJointIds', model.vertexJointIds)
-            glUniformMatrix4fv(self.get_uniform_loc('jointMats'),
-                len(model.joints), GL_FALSE, model.get_joint_matrices())
-            model.geometry.draw()
+            self.set_uniform('hasArmature', 1)
+            self.set_uniform('moreJoints', int(model.geometry.jointsPerVertex > 4))
+            self.set_uniform('jointMats', model.get_joint_matrices())
+            model.geometry.draw(self, model.lod, self.set_material)
             if config.drawJointAxis:
-                glDisable(GL_DEPTH_TEST)
+                glState.disable(GL_DEPTH_TEST)
                 for axis in model.axies:
                     self.draw_model(axis)
-                glEnable(GL_DEPTH_TEST)
+                glState.enable(GL_DEPTH_TEST)
+                return True
         else:
-            glUniform1i(self.get_uniform_loc('hasArmature'), 0)
-            # Disable unused attributes.
-            locs = list(map(self.get_attrib_loc, ('vertexWeights', 'vertexJointIds')))
-            for loc in locs:
-                glDisableVertexAttribArray(loc)
-            model.geometry.draw()
-            for loc in locs:
-                glEnableVertexAttribArray(loc)
+            self.set_uniform('hasArmature', 0)
+            model.geometry.draw(self, model.lod, self.set_material)
+        return len(model.geometry.materials) > 1
+
+    def draw_instances(self, group):
+        """
+        Draw the models of an instancing.InstanceGroup with one draw call.
+        """
+        self.set_material(group.geometry.material)
+        self.set_uniform('hasArmature', 0)
+        self.set_uniform('instanced', 1)
+        group.draw(self, self.set_material)
+        self.set_uniform('instanced', 0)
+
+    def draw_indirect(self, draws):
+        """
+        Draw the models of an indirect.IndirectDraws, a multi-draw call per
+        material.
+        """
+        self.set_uniform('hasArmature', 0)
+        self.set_uniform('instanced', 1)
+        draws.draw(self, self.set_material)
+        self.set_uniform('instanced', 0)
+
+    def draw_batch(self, batch):
+        """
+        Draw the visible models of a batching.StaticBatch with one draw call.
+        """
+        self.set_material(batch.material)
+        self.set_matrix('modelMat', IDENTITY)
+        self.set_uniform('hasArmature', 0)
+        batch.draw(self)
 
 
 class SilhouetteRenderer(Program):
@@ -104,15 +160,26 @@ class SilhouetteRenderer(Program):
             (get_shader_path('silhouette.v.glsl'), GL_VERTEX_SHADER),
             (get_shader_path('silhouette.f.glsl'), GL_FRAGMENT_SHADER),
             (get_shader_path('silhouette.g.glsl'), GL_GEOMETRY_SHADER),
-        ], [
-            ('vertexPos', 3, GL_FLOAT),
         ])
 
     def draw_model(self, model):
-        self.set_buffer('vertexPos', model.geometry.adjVertices.vertices)
-        model.geometry.adjVertices.bind()
         self.set_matrix('modelMat', model.matrix)
-        model.geometry.adjVertices.draw()
+        # Adjacency is built on the first draw that needs it.
+        model.geometry.adjVertices.draw(self)
+
+    def draw_instances(self, group):
+        self.set_uniform('instanced', 1)
+        group.draw_adjacency(self)
+        self.set_uniform('instanced', 0)
+
+    def draw_indirect(self, draws):
+        self.set_uniform('instanced', 1)
+        draws.draw_adjacency(self)
+        self.set_uniform('instanced', 0)
+
+    def draw_batch(self, batch):
+        self.set_matrix('modelMat', IDENTITY)
+        batch.draw_adjacency(self)
 
 
 class WireframeRenderer(Program):
@@ -120,15 +187,30 @@ class WireframeRenderer(Program):
         super().__init__([
             (get_shader_path('wireframe.v.glsl'), GL_VERTEX_SHADER),
             (get_shader_path('wireframe.f.glsl'), GL_FRAGMENT_SHADER),
-        ], [
-            ('vertexPos', 3, GL_FLOAT),
-            ('vertexNormal', 3, GL_FLOAT),
         ])
 
     def draw_model(self, model):
-        self.set_buffer('vertexPos', model.geometry.vertices)
-        self.set_buffer('vertexNormal', model.geometry.normals)
         self.set_matrix('modelMat', model.matrix)
-        glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-        model.geometry.draw()
-        glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
+        glState.polygon_mode(GL_LINE)
+        model.geometry.draw(self, model.lod)
+        glState.polygon_mode(GL_FILL)
+
+    def draw_instances(self, group):
+        self.set_uniform('instanced', 1)
+        glState.polygon_mode(GL_LINE)
+        group.draw(self)
+        glState.polygon_mode(GL_FILL)
+        self.set_uniform('instanced', 0)
+
+    def draw_indirect(self, draws):
+        self.set_uniform('instanced', 1)
+        glState.polygon_mode(GL_LINE)
+        draws.draw(self)
+        glState.polygon_mode(GL_FILL)
+        self.set_uniform('instanced', 0)
+
+    def draw_batch(self, batch):
+        self.set_matrix('modelMat', IDENTITY)
+        glState.polygon_mode(GL_LINE)
+        batch.draw(self)
+        glState.polygon_mode(GL_FILL)
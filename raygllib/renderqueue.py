@@ -0,0 +1,148 @@
+"""
+Ordering the draws of a frame by the state they need.
+
+The models drawn one by one, those left by batching, instancing and indirect
+draws, are submitted to a RenderQueue for each pass with a 64-bit sort key.
+From the high bits it holds the pass, the program, the material, the
+geometry and the depth of the model, the view space depth of its bounding
+sphere center. Materials sharing a texture get neighbouring numbers, so a
+pass draws all the models of a material, then of its geometries, front to
+back. The keys are sorted with radix_sort and each pass is drawn in that
+order, setting the material only when it changes.
+
+Programs, materials and geometries are numbered anew each frame and the
+numbers only order the draws; the state is compared by itself. A field
+which doesn't fit its bits is clipped, which makes a worse order, not a
+wrong one.
+"""
+import numpy as np
+from .model import Material
+
+# Bits of each field of a key, from the highest
+KEY_BITS = [('pass', 4), ('program', 4), ('material', 16), ('geometry', 16), ('depth', 24)]
+
+
+def make_keys(passes, programs, materials, geometries, depths):
+    """
+    Return the uint64 keys of the draws whose fields are given as arrays
+    of integers, but `depths` of floats in [0, 1].
+    """
+    depthMax = (1 << KEY_BITS[-1][1]) - 1
+    fields = [passes, programs, materials, geometries,
+              np.round(np.clip(depths, 0., 1.) * depthMax)]
+    keys = np.zeros(len(passes), dtype=np.uint64)
+    for field, (_, bits) in zip(fields, KEY_BITS):
+        field = np.clip(np.asarray(field, dtype=np.int64), 0, (1 << bits) - 1)
+        keys = (keys << np.uint64(bits)) | field.astype(np.uint64)
+    return keys
+
+
+def radix_sort(keys):
+    """
+    Return the indices which sort uint64 array `keys`, keeping the order of
+    equal ones. The keys are sorted by each of their bytes from the lowest,
+    those all keys share skipped, with numpy's stable sort, a counting sort
+    for bytes.
+    """
+    order = np.arange(len(keys))
+    for shift in range(0, 64, 8):
+        digits = ((keys[order] >> np.uint64(shift)) & np.uint64(0xff)).astype(np.uint8)
+        if len(digits) and (digits == digits[0]).all():
+            continue
+        order = order[np.argsort(digits, kind='stable')]
+    return order
+
+
+def view_depth(model, view_mat):
+    """
+    Return the distance along the view direction of the center of the
+    bounding sphere of `model`.
+    """
+    center = np.append(model.geometry.boundCenter, 1.)
+    return -np.dot(view_mat, np.dot(model.matrix, center))[2]
+
+
+class RenderQueue:
+    """
+    The draws of a frame, see the module docs. Its stats count, since the
+    last clear, the draws, the material and geometry changes between
+    consecutive draws, and the binds those which stayed saved.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._draws = []
+        self._passes = {}
+        self.stats = {'draws': 0, 'stateChanges': 0, 'bindsAvoided': 0}
+
+    def submit(self, pass_index, program, material, geometry, depth, model):
+        """
+        Add the draw of `model` in pass `pass_index` with `program`.
+        `material` is None for passes which don't set one.
+        """
+        self._draws.append((pass_index, program, material, geometry, depth, model))
+
+    def sort(self):
+        """
+        Order the submitted draws by their keys.
+        """
+        draws = self._draws
+        programs, geometries = {}, {}
+        for _, program, _, geometry, _, _ in draws:
+            programs.setdefault(program, len(programs))
+            geometries.setdefault(geometry, len(geometries))
+        materials = self._number_materials([draw[2] for draw in draws])
+        depths = np.array([draw[4] for draw in draws], dtype=np.float64)
+        if len(depths):
+            near, far = depths.min(), depths.max()
+            depths = (depths - near) / (far - near) if far > near else depths * 0.
+        keys = make_keys(
+            [draw[0] for draw in draws],
+            [programs[draw[1]] for draw in draws],
+            [materials[id(draw[2])] for draw in draws],
+            [geometries[draw[3]] for draw in draws],
+            depths)
+        self._passes = {}
+        for i in radix_sort(keys):
+            pass_index, _, material, geometry, _, model = draws[i]
+            self._passes.setdefault(pass_index, []).append((material, geometry, model))
+
+    @staticmethod
+    def _number_materials(materials):
+        """
+        Return the numbers of `materials` by id, in order of first use,
+        those with the same texture next to each other, and None first.
+        """
+        textures, byId = {}, {}
+        for material in materials:
+            if id(material) in byId:
+                continue
+            texture = None
+            if material is not None and material.diffuseType == Material.DIFFUSE_TEXTURE:
+                texture = material.diffuse
+            byId[id(material)] = (
+                material is not None, textures.setdefault(id(texture), len(textures)),
+                len(byId))
+        order = sorted(byId, key=byId.get)
+        return {key: i for i, key in enumerate(order)}
+
+    def execute(self, pass_index, draw, set_material=None):
+        """
+        Call `draw` with each model of pass `pass_index`, in order, and
+        `set_material` if given with the material of a draw when it isn't
+        the one of the previous draw. `draw` returns true when it left
+        another material set than the one it was given.
+        """
+        stats = self.stats
+        # Neither is set at the start of the pass.
+        lastMaterial = lastGeometry = unset = object()
+        for material, geometry, model in self._passes.get(pass_index, []):
+            for changed in (material is not lastMaterial, geometry is not lastGeometry):
+                stats['stateChanges' if changed else 'bindsAvoided'] += 1
+            if set_material is not None and material is not lastMaterial:
+                set_material(material)
+            lastMaterial, lastGeometry = material, geometry
+            if draw(model):
+                lastMaterial = unset
+            stats['draws'] += 1
@@ -1,10 +1,7 @@
 # version 330 core
 
-const int MaxLightCount = 4;
-uniform vec3 lightPosModelSpace[MaxLightCount];
-uniform vec3 lightColor[MaxLightCount];
-uniform float lightPower[MaxLightCount];
-uniform int nLights;
+#pragma uniform_block FrameBlock
+#pragma uniform_block LightBlock
 uniform vec3 diffuse;
 uniform vec3 Ka;
 uniform vec3 Ks;
@@ -12,7 +9,6 @@ uniform float shininess;
 
 uniform sampler2D textureSampler;
 uniform bool hasSampler;
-uniform mat4 viewMat, modelMat;
 uniform int nEdges;
 uniform float edges[10];
 
@@ -57,9 +53,9 @@ float salt_and_pepper(vec3 pos) {
         return 0.5;
     }
     if(k < Pa + Pb) {
-        return 2;
+        return 2.;
     }
-    return 1;
+    return 1.;
 }
 
 void main() {
@@ -74,6 +70,8 @@ void main() {
 
     fragColor = Ka * mtlDiffuseColor;
     for(int i = 0; i < nLights; i++) {
+        if(!lightEnabled[i])
+            continue;
         vec3 lightPosCamSpace = (viewMat * vec4(lightPosModelSpace[i], 1)).xyz;
         vec3 lightVectorCamSpace = lightPosCamSpace - posCamSpace;
         float dist = length(lightVectorCamSpace);
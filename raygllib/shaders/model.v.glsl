@@ -1,7 +1,13 @@
 # version 330 core
-uniform mat4 modelMat, viewMat, projMat;
+#pragma uniform_block FrameBlock
+uniform mat4 modelMat;
 
 uniform bool hasArmature;
+// Skinned by 8 joints per vertex, the last 4 in vertexWeights1 and
+// vertexJointIds1.
+uniform bool moreJoints;
+// Draw instances, whose model matrices are given by the instanceMat columns.
+uniform bool instanced;
 uniform int targetJoint;
 const int MaxJointCount = 40;
 uniform mat4 jointMats[MaxJointCount];
@@ -11,6 +17,9 @@ in vec3 vertexNormal;
 in vec2 vertexUV;
 in vec4 vertexWeights;
 in vec4 vertexJointIds;
+in vec4 vertexWeights1;
+in vec4 vertexJointIds1;
+in vec4 instanceMat0, instanceMat1, instanceMat2, instanceMat3;
 
 out vec2 uv;
 out vec3 normalCamSpace;
@@ -29,23 +38,37 @@ void show_weight() {
     for(int i = 0; i < 4; i++) {
         if(vertexJointIds[i] == targetJoint) {
             weight = vertexWeights[i];
-            break;
+            return;
+        }
+    }
+    for(int i = 0; moreJoints && i < 4; i++) {
+        if(vertexJointIds1[i] == targetJoint) {
+            weight = vertexWeights1[i];
+            return;
         }
     }
 }
 
+mat4 joint_mat(const in vec4 weights, const in vec4 jointIds) {
+    return weights.x * jointMats[int(.5 + jointIds.x)]
+        + weights.y * jointMats[int(.5 + jointIds.y)]
+        + weights.z * jointMats[int(.5 + jointIds.z)]
+        + weights.w * jointMats[int(.5 + jointIds.w)];
+}
+
 void main() {
     uv = vertexUV;
     mat4 mat;
     weight = 0;
     if(hasArmature) {
-        mat4 jointMat = 
-              vertexWeights.x * jointMats[int(.5 + vertexJointIds.x)]
-            + vertexWeights.y * jointMats[int(.5 + vertexJointIds.y)]
-            + vertexWeights.z * jointMats[int(.5 + vertexJointIds.z)]
-            + vertexWeights.w * jointMats[int(.5 + vertexJointIds.w)];
+        mat4 jointMat = joint_mat(vertexWeights, vertexJointIds);
+        if(moreJoints) {
+            jointMat += joint_mat(vertexWeights1, vertexJointIds1);
+        }
         mat = viewMat * jointMat * modelMat;
         /*show_weight();*/
+    } else if(instanced) {
+        mat = viewMat * mat4(instanceMat0, instanceMat1, instanceMat2, instanceMat3);
     } else {
         mat = viewMat * modelMat;
     }
@@ -1,5 +1,5 @@
 # version 330 core
-uniform mat4 viewMat, projMat;
+#pragma uniform_block FrameBlock
 uniform vec3 lightPosModelSpace;
 const float EXTRUDE = 10;
 
@@ -9,7 +9,7 @@ layout (triangle_strip, max_vertices=15) out;
 in vec3 vertexPosModelSpace[3];
 
 void main() {
-    mat4 M = projMat * viewMat;
+    mat4 M = viewProjMat;
     // front cap
     for(int i = 0; i < 3; i++) {
         gl_Position = M * vec4(vertexPosModelSpace[i], 1);
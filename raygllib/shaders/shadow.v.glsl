@@ -1,5 +1,5 @@
 # version 330 core
-uniform mat4 modelMat, viewMat, projMat;
+uniform mat4 modelMat;
 in vec3 vertexPos;
 out vec3 vertexPosModelSpace;
 
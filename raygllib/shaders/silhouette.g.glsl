@@ -1,6 +1,6 @@
 # version 330 core
 
-uniform mat4 projMat;
+#pragma uniform_block FrameBlock
 layout (triangles_adjacency) in;
 layout (triangle_strip, max_vertices=12) out;
 
@@ -1,11 +1,16 @@
 # version 330 core
 
-uniform mat4 viewMat, modelMat;
+#pragma uniform_block FrameBlock
+uniform mat4 modelMat;
+uniform bool instanced;
 
 in vec3 vertexPos;
+in vec4 instanceMat0, instanceMat1, instanceMat2, instanceMat3;
 out vec3 vertexPosCamSpace;
 
 void main() {
-    vec4 v = viewMat * modelMat * vec4(vertexPos, 1);
+    mat4 mat = instanced ?
+        mat4(instanceMat0, instanceMat1, instanceMat2, instanceMat3) : modelMat;
+    vec4 v = viewMat * mat * vec4(vertexPos, 1);
     vertexPosCamSpace = v.xyz / v.w;
 }
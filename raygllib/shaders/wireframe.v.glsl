@@ -1,12 +1,17 @@
 # version 330 core
 
-uniform mat4 viewMat, modelMat, projMat;
+#pragma uniform_block FrameBlock
+uniform mat4 modelMat;
+uniform bool instanced;
 
 in vec3 vertexPos;
 in vec3 vertexNormal;
+in vec4 instanceMat0, instanceMat1, instanceMat2, instanceMat3;
 
 const float Offset = 0.001;
 
 void main() {
-    gl_Position = projMat * viewMat * modelMat * vec4(vertexPos + vertexNormal * Offset, 1);
+    mat4 mat = instanced ?
+        mat4(instanceMat0, instanceMat1, instanceMat2, instanceMat3) : modelMat;
+    gl_Position = viewProjMat * mat * vec4(vertexPos + vertexNormal * Offset, 1);
 }
@@ -3,21 +3,19 @@ class ShadowRenderer(Renderer):
     Usage:
     >>>r1 = Renderer()
     >>>r2 = ShadowRenderer()
+    >>>set_camera(viewMat, projMat)
     >>>glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
     >>>with r1.batch_draw():
-    >>>    r1.set_matrix('viewMat', viewMat)
-    >>>    r1.set_lights(lights)
+    >>>    set_lights(lights)
     >>>    for model in models:
     >>>        r1.draw_model(model)
     >>>for light in lights:
     >>>    with r2.batch_draw():
-    >>>        r2.set_matrix('viewMat', viewMat)
     >>>        r2.set_light(light)
     >>>        for model in models:
     >>>            r2.draw_model(model)
     >>>    with r1.batch_draw():
-    >>>        r1.set_matrix('viewMat', viewMat)
-    >>>        r1.set_lights(lights)
+    >>>        set_lights([light])
     >>>        for model in models:
     >>>            r1.draw_model(model)
     """
@@ -32,7 +30,7 @@ class ShadowRenderer(Renderer):
 
     def prepare_draw(self):
         glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
-        glDepthMask(GL_FALSE)
+        glState.depth_mask(False)
         glStencilFunc(GL_ALWAYS, 0, 0x1)
         glStencilOp(GL_KEEP, GL_INVERT, GL_KEEP)
         glClear(GL_STENCIL_BUFFER_BIT)
@@ -41,10 +39,10 @@ class ShadowRenderer(Renderer):
         glStencilFunc(GL_EQUAL, 0, 0x1)
         glStencilOp(GL_REPLACE, GL_REPLACE, GL_REPLACE)
         glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
-        glDepthMask(GL_TRUE)
+        glState.depth_mask(True)
 
     def set_light(self, light):
-        glUniform3f(self.get_uniform_loc('lightPosModelSpace'), *light.pos)
+        self.set_uniform('lightPosModelSpace', light.pos)
 
     def draw_model(self, model):
         self.set_buffer('vertexPos', model.vertices)
@@ -60,39 +58,34 @@ class ShadowedViewer(Viewer):
         self.window.clear()
         glClearColor(.0, .0, .0, 1.)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_STENCIL_TEST)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_ONE, GL_ONE)
+        glState.enable(GL_DEPTH_TEST)
+        glState.enable(GL_STENCIL_TEST)
+        glState.enable(GL_BLEND)
+        glState.blend_func(GL_ONE, GL_ONE)
         glDepthFunc(GL_LEQUAL)
 
         r1 = self.renderer
         r2 = self.shadowRenderer
 
         glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
-        glDepthMask(GL_TRUE)
+        glState.depth_mask(True)
         with r1.batch_draw():
-            r1.set_matrix('viewMat', self.camera.viewMat)
-            r1.set_matrix('projMat', self.projMat)
-            r1.set_lights(self.scene.lights)
+            set_camera(self.camera.viewMat, self.projMat)
+            set_lights(self.scene.lights)
             for model in self.scene.models:
                 r1.draw_model(model)
         for light in self.scene.lights:
             with r2.batch_draw():
                 r2.set_light(light)
-                r2.set_matrix('viewMat', self.camera.viewMat)
-                r2.set_matrix('projMat', self.projMat)
                 for model in self.scene.models:
                     r2.draw_model(model)
             # glDisable(GL_STENCIL_TEST)
             glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
-            glDepthMask(GL_TRUE)
+            glState.depth_mask(True)
             with r1.batch_draw():
-                r1.set_matrix('viewMat', self.camera.viewMat)
-                r1.set_matrix('projMat', self.projMat)
-                r1.set_lights([light])
+                set_lights([light])
                 for model in self.scene.models:
                     r1.draw_model(model)
 
-        glDisable(GL_DEPTH_TEST)
+        glState.disable(GL_DEPTH_TEST)
         self.fpsDisplay.draw()
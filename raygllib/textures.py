@@ -0,0 +1,113 @@
+"""
+Decoding of texture images away from the GL thread.
+
+The images of materials stay encoded in the scene data. When a scene is
+built they are handed to a pool of `config.textureWorkers` threads, which
+decode them to RGBA and make their mip chains, so that a texture is ready
+to upload as is. Textures are drawn with a placeholder until then, see
+Texture2D.ready. Decoded images are kept in a cache of their own, keyed by
+the content of the encoded image, so a scene opened again skips decoding.
+"""
+import io
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from . import config
+from .cache import ArrayCache
+from .utils import debug
+
+# Bump this when the decoded levels change, to invalidate the cache.
+DECODER_VERSION = 2
+
+
+def halve(level, axis):
+    """
+    Return float array `level` with half as many items along `axis`, at
+    least one, each the mean of the items it covers. For an even size that
+    is the mean of each pair. For an odd size n, item i of the n // 2 covers
+    items 2i to 2i + 2, the first and last in part, and they are weighted by
+    how much of them it covers.
+    """
+    n = level.shape[axis]
+    if n == 1:
+        return level
+    m = n // 2
+    i = np.arange(m)
+    if n % 2 == 0:
+        return (level.take(2 * i, axis=axis) + level.take(2 * i + 1, axis=axis)) / 2
+    shape = [-1 if k == axis else 1 for k in range(level.ndim)]
+    first = (1 - i / m).reshape(shape)
+    last = ((i + 1) / m).reshape(shape)
+    return (level.take(2 * i, axis=axis) * first
+            + level.take(2 * i + 1, axis=axis)
+            + level.take(2 * i + 2, axis=axis) * last) * (m / n)
+
+
+def make_mips(rgba):
+    """
+    Return the mip chain of (height, width, 4) uint8 array `rgba`, down to
+    1x1, each level made from the previous one with `halve`.
+    """
+    levels = [rgba]
+    while max(levels[-1].shape[:2]) > 1:
+        level = halve(halve(levels[-1].astype(np.float32), 0), 1)
+        levels.append(np.floor(level + .5).astype(np.uint8))
+    return levels
+
+
+def decode_image(encoded):
+    """
+    Decode the bytes of an image file to a (height, width, 4) uint8 array.
+    """
+    image = Image.open(io.BytesIO(np.asarray(encoded).tobytes()))
+    return np.asarray(image.convert('RGBA'))
+
+
+_textureCache = None
+
+def get_texture_cache():
+    global _textureCache
+    if _textureCache is None:
+        _textureCache = ArrayCache(
+            os.path.join(config.cacheDir, 'textures'), config.textureCacheMaxBytes)
+    return _textureCache
+
+
+def load_mips(encoded, cache=None):
+    """
+    Return the mip chain of encoded image `encoded`, from `cache`, the
+    texture cache by default, if it is there, otherwise decoding it and
+    storing the result. No cache is used if config.textureCacheEnable is
+    false.
+    """
+    if cache is None and config.textureCacheEnable:
+        cache = get_texture_cache()
+    key = None
+    if cache is not None:
+        sha1 = hashlib.sha1(np.ascontiguousarray(encoded).data)
+        sha1.update(str(DECODER_VERSION).encode('utf-8'))
+        key = sha1.hexdigest()
+        data = cache.get(key)
+        if data is not None:
+            return data['levels']
+    levels = make_mips(decode_image(encoded))
+    debug('decode texture: {}x{}, {} levels'.format(
+        levels[0].shape[1], levels[0].shape[0], len(levels)))
+    if cache is not None:
+        cache.put(key, {'levels': levels})
+    return levels
+
+
+_executor = None
+
+def load_texture(encoded):
+    """
+    Start decoding encoded image `encoded` in the thread pool. Return the
+    future of its mip chain, which Texture2D takes.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(config.textureWorkers)
+    return _executor.submit(load_mips, encoded)
@@ -29,13 +29,13 @@ class Render(gl.Program):
         m[1, 3] = 1
 
     def prepare_draw(self):
-        gl.glDisable(gl.GL_DEPTH_TEST)
-        gl.glEnable(gl.GL_BLEND)
-        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
-        gl.glPolygonMode(gl.GL_FRONT_AND_BACK, gl.GL_FILL)
+        gl.glState.disable(gl.GL_DEPTH_TEST)
+        gl.glState.enable(gl.GL_BLEND)
+        gl.glState.blend_func(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glState.polygon_mode(gl.GL_FILL)
 
     def set_matrix_uniform(self):
-        gl.glUniformMatrix4fv(self.get_uniform_loc('matrix'), 1, gl.GL_TRUE, self.matrix)
+        self.set_matrix('matrix', self.matrix)
 
 
 class RectRender(Render):
@@ -114,9 +114,9 @@ class FontRender(Render):
         super().free()
 
     def set_texture(self, texture):
-        gl.glActiveTexture(self.textureUnit.glenum)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture.glId)
-        gl.glUniform1i(self.get_uniform_loc('fontSampler'), self.textureUnit.id)
+        gl.glState.active_texture(self.textureUnit.glenum)
+        gl.glState.bind_texture(gl.GL_TEXTURE_2D, texture.glId)
+        self.set_uniform('fontSampler', self.textureUnit.id)
 
     def draw_textboxs(self, textboxes):
         if not textboxes:
@@ -138,7 +138,7 @@ class FontRender(Render):
         self.set_texture(self.fontTexture)
         config = fontTexture.config
         for name in ('rowsize', 'gridwidth', 'gridheight', 'fontsize'):
-            gl.glUniform1i(self.get_uniform_loc(name), config[name])
+            self.set_uniform(name, config[name])
         self.set_matrix_uniform()
         # Start draw
         self.draw(gl.GL_POINTS, len(buffer))
@@ -228,7 +228,7 @@ class BackgroundRender(gl.Program):
         self.__buffer = gl.VertexBuffer(np.array(rect, dtype=gl.GLfloat))
 
     def set_color(self, color):
-        gl.glUniform4fv(self.get_uniform_loc('color'), 1, color)
+        self.set_uniform('color', color)
 
     def draw_background(self):
         self.set_buffer('vertexPos', self.__buffer)
@@ -257,6 +257,8 @@ class Window(pyglet.window.Window):
             self._focusRect.target = widget
 
     def on_draw(self):
+        # pyglet may have changed the state since the last frame.
+        gl.glState.invalidate()
         gl.glClearColor(*self.color)
         self.clear()
         root = self.root
@@ -0,0 +1,119 @@
+"""
+Spreading the uploads of a scene over frames.
+
+GL resources are otherwise allocated on the first draw that uses them, so
+the first frame of a new scene uploads all its buffers and textures at once.
+An UploadQueue is given them when the scene is set instead, and each frame
+allocates those at its head until it has spent its budget of milliseconds or
+bytes, at least one a frame. Textures still being decoded, see textures.py,
+are passed over until they are. Texture data is staged in a pixel unpack
+buffer which the texture is then made from. Until its buffers are uploaded a
+geometry isn't drawn, see Geometry.ready, and a texture is replaced by a
+placeholder, see Texture2D.ready.
+"""
+import time
+from collections import deque
+from .gllib import PixelUnpackBuffer
+from .model import Material
+from .utils import debug
+
+
+class UploadQueue:
+    def __init__(self, max_ms=4., max_bytes=8 << 20):
+        """
+        :param float max_ms: Milliseconds spent on uploads in a frame.
+        :param int max_bytes: Bytes uploaded in a frame.
+        """
+        self.maxMs = max_ms
+        self.maxBytes = max_bytes
+        self.pending = deque()
+        self.unpackBuffer = PixelUnpackBuffer()
+        self.clear()
+
+    def push(self, resource):
+        """
+        Queue GLResource `resource`, unless it is allocated or queued.
+        """
+        if resource._id is None and not resource.pending:
+            resource.pending = True
+            self.pending.append(resource)
+            self.nTotal += 1
+
+    def push_scene(self, scene):
+        """
+        Queue the buffers of the geometries of `scene` and the textures of
+        their materials, in order.
+        """
+        for geometry in scene.geometries:
+            self.push(geometry.vertices)
+            self.push(geometry.indices)
+            for material in geometry.materials:
+                if material.diffuseType == Material.DIFFUSE_TEXTURE:
+                    self.push(material.diffuse)
+
+    def run(self):
+        """
+        Upload the resources at the head of the queue, within the budget of
+        a frame. Return the number of bytes uploaded.
+        """
+        if not self.pending:
+            return 0
+        start = time.perf_counter()
+        nbytes = 0
+        nPassed = 0
+        while self.pending and nPassed < len(self.pending):
+            resource = self.pending[0]
+            if not resource.loaded:
+                self.pending.rotate(-1)
+                nPassed += 1
+                continue
+            size = resource.nbytes
+            if nbytes and (nbytes + size > self.maxBytes
+                           or (time.perf_counter() - start) * 1000 >= self.maxMs):
+                break
+            self.pending.popleft()
+            resource.upload(self.unpackBuffer)
+            resource.pending = False
+            nbytes += size
+            nPassed = 0
+            self.nDone += 1
+        self.nBytes += nbytes
+        self.nFrames += 1
+        if not self.pending:
+            debug('uploads: {} resources, {} bytes in {} frames'.format(
+                self.nDone, self.nBytes, self.nFrames))
+        return nbytes
+
+    @property
+    def progress(self):
+        """
+        The share of the queued resources which are uploaded, 1 when the
+        queue is empty.
+        """
+        return self.nDone / self.nTotal if self.nTotal else 1.
+
+    def stats(self):
+        """
+        Return a dict of the number of queued, pending and uploaded
+        resources, the bytes uploaded and the frames they took.
+        """
+        return {
+            'nTotal': self.nTotal,
+            'nPending': len(self.pending),
+            'nDone': self.nDone,
+            'nBytes': self.nBytes,
+            'nFrames': self.nFrames,
+        }
+
+    def clear(self):
+        """
+        Drop the queued resources, which are then allocated on first use.
+        """
+        for resource in self.pending:
+            resource.pending = False
+        self.pending.clear()
+        self.nTotal = self.nDone = self.nBytes = self.nFrames = 0
+
+    def free(self):
+        self.clear()
+        self.unpackBuffer.free()
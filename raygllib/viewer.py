@@ -4,11 +4,19 @@ from OpenGL.GL import *
 import pyglet
 
 from .render import (
-    Renderer, SilhouetteRenderer, WireframeRenderer
+    Renderer, SilhouetteRenderer, WireframeRenderer, set_camera, set_lights,
 )
 from .camera import Camera
+from .gllib import glState
 from .model import Scene
-# from .utils import debug
+from .lod import LodSelector
+from .instancing import Instancing
+from .batching import StaticBatching
+from .indirect import IndirectDraws
+from .arena import BufferArena
+from .uploads import UploadQueue
+from .renderqueue import RenderQueue, view_depth
+from .utils import debug
 from . import config
 import raygllib.ui as ui
 import pyglet.window.key as K
@@ -246,6 +254,10 @@ class ControlPanel(ui.Widget):
 
 
 class ViewerCanvas(ui.Canvas):
+    # Passes of the render queue
+    MAIN_PASS = 0
+    SILHOUETTE_PASS = 1
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.scene = None
@@ -261,6 +273,17 @@ class ViewerCanvas(ui.Canvas):
 
         self._scale = 1.
         self.camera = Camera((0, -10, 0), (0, 0, 0), (0, 0, 1))
+        # Its stats tell the level of detail drawn for each model.
+        self.lodSelector = LodSelector(config.lodTrianglesPerPixel, config.lodHysteresis)
+        self.instancing = Instancing(config.instancingMinCount)
+        self.batching = StaticBatching()
+        self.indirect = IndirectDraws()
+        # Its stats count the draws and state changes of the frame.
+        self.renderQueue = RenderQueue()
+        # Uniform uploads skipped (hits) and made (misses) by the last frame
+        self.uniformStats = {'hits': 0, 'misses': 0}
+        # Its progress tells how much of the scene is uploaded.
+        self.uploads = UploadQueue(config.uploadBudgetMs, config.uploadBudgetBytes)
 
     def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
         self.camera.on_mouse_drag(x, y, dx, dy, buttons, modifiers)
@@ -292,42 +315,102 @@ class ViewerCanvas(ui.Canvas):
         # Rw = self.wireframeRenderer
 
         self.fill_background()
+        for program in (R, Rs):
+            program.reset_uniform_stats()
 
-        glEnable(GL_DEPTH_TEST)
-        glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-        # glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
+        glState.enable(GL_DEPTH_TEST)
+        glState.polygon_mode(GL_FILL)
+        # glState.polygon_mode(GL_LINE)
         glCullFace(GL_BACK)
-        glDisable(GL_BLEND)
-
+        glState.disable(GL_BLEND)
+
+        uploads = self.uploads
+        uploads.run()
+        models = scene.models
+        self.lodSelector.select(
+            models, camera.viewMat, camera.projMat, self.width, self.height)
+        # Batching is given all the models and instancing all the visible
+        # ones, so that they aren't remade each frame while the scene is
+        # uploaded. What they draw waits for its buffers instead.
+        batches = groups = []
+        indirect = None
+        if config.staticBatching:
+            batches, models = self.batching.update(models)
+            if config.uploadQueueEnable:
+                for batch in batches:
+                    uploads.push(batch.vertices)
+                    uploads.push(batch.indices)
+                batches = [batch for batch in batches if batch.ready]
+        # Batches skip their hidden models when they are drawn, the other
+        # paths only get the visible ones.
+        models = [model for model in models if model.visible]
+        if config.indirectDraw:
+            # Its commands need the offsets of the buffers in their arena,
+            # so it is made once they are all uploaded.
+            if not uploads.pending:
+                indirect = self.indirect
+                models = indirect.update(models, self.silhouetteEnable)
+        elif config.instancingEnable:
+            groups, models = self.instancing.update(models)
+            if uploads.pending:
+                groups = [group for group in groups if group.geometry.ready]
+        if uploads.pending:
+            models = [model for model in models if model.geometry.ready]
+        queue = None
+        if config.renderQueueEnable:
+            queue = self.renderQueue
+            queue.clear()
+            for model in models:
+                geometry = model.geometry
+                depth = view_depth(model, camera.viewMat)
+                queue.submit(self.MAIN_PASS, R, geometry.material, geometry, depth, model)
+                if self.silhouetteEnable:
+                    queue.submit(self.SILHOUETTE_PASS, Rs, None, geometry, depth, model)
+            queue.sort()
+            models = []
+        # Read by all programs
+        set_camera(camera.viewMat, camera.projMat)
+        set_lights(scene.lights)
         with R.batch_draw():
             # if self.selectedJoint is None:
             #     glUniform1i(R.get_uniform_loc('targetJoint'), -1)
             # else:
             #     glUniform1i(R.get_uniform_loc('targetJoint'), self.selectedJoint.id)
-            R.set_matrix('viewMat', camera.viewMat)
-            R.set_matrix('projMat', camera.projMat)
-            # print(camera.projMat.dot(camera.viewMat).dot([0, 0, 0, 1]))
-            R.set_lights(scene.lights)
-            for model in scene.models:
+            for batch in batches:
+                R.draw_batch(batch)
+            if indirect is not None:
+                R.draw_indirect(indirect)
+            for group in groups:
+                R.draw_instances(group)
+            for model in models:
                 R.draw_model(model)
+            if queue is not None:
+                queue.execute(
+                    self.MAIN_PASS, lambda model: R.draw_model(model, False), R.set_material)
 
         if self.silhouetteEnable:
             with Rs.batch_draw():
-                Rs.set_matrix('viewMat', camera.viewMat)
-                Rs.set_matrix('projMat', camera.projMat)
-                glUniform1f(Rs.get_uniform_loc('edgeWidth'), self.silhouetteWidth)
-                for model in scene.models:
+                Rs.set_uniform('edgeWidth', self.silhouetteWidth)
+                for batch in batches:
+                    Rs.draw_batch(batch)
+                if indirect is not None:
+                    Rs.draw_indirect(indirect)
+                for group in groups:
+                    Rs.draw_instances(group)
+                for model in models:
                     Rs.draw_model(model)
+                if queue is not None:
+                    queue.execute(self.SILHOUETTE_PASS, Rs.draw_model)
 
         # if self.wireframeEnable:
         #     with Rw.batch_draw():
-        #         Rw.set_matrix('viewMat', camera.viewMat)
-        #         Rw.set_matrix('projMat', camera.projMat)
         #         for model in models:
         #             Rw.draw_model(model)
 
-        glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-        glDisable(GL_DEPTH_TEST)
+        glState.polygon_mode(GL_FILL)
+        glState.disable(GL_DEPTH_TEST)
+        stats = [program.uniform_stats() for program in (R, Rs)]
+        self.uniformStats = {key: sum(item[key] for item in stats) for key in ('hits', 'misses')}
 
 class Viewer(ui.Window):
     FPS = 30
@@ -368,20 +451,30 @@ class Viewer(ui.Window):
         panel.add_control('misc', EdgesControl(self))
 
         self.canvas.camera.set_target(None)
+        self.canvas.instancing.free()
+        self.canvas.batching.free()
+        self.canvas.indirect.free()
+        self.canvas.uploads.clear()
         if self.scene is not None:
             self.scene.free()
+            if config.bufferArenaEnable:
+                arena = BufferArena.get_default()
+                arena.compact()
+                debug('buffer arena:', arena.stats())
         self.canvas.scene = self.scene = scene
+        if config.uploadQueueEnable:
+            self.canvas.uploads.push_scene(scene)
 
         for light in scene.lights:
             panel.add_control('lights', LightControl(light))
 
         materials = []
         for model in scene.models:
-            material = model.geometry.material
-            if material in materials:
-                continue
-            # panel.add_control('materials', MaterialControl(material))
-            materials.append(material)
+            for material in model.geometry.materials:
+                if material in materials:
+                    continue
+                # panel.add_control('materials', MaterialControl(material))
+                materials.append(material)
 
         joints = []
         for model in scene.models:
@@ -0,0 +1,54 @@
+"""
+Benchmark make_single_index_1 against make_single_index_3.
+
+Usage: python tests/bench_single_index.py [nIndices ...]
+"""
+import sys
+import time
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import config
+from raygllib import _model
+
+SIZES = [10000, 100000, 1000000, 5000000]
+
+
+def make_mesh(nIndices, seed=0):
+    """
+    Make a random triangle soup that shares attributes the way an exported
+    mesh does: every position is used by ~6 corners, normals and uvs are
+    shared among fewer corners.
+    """
+    rng = np.random.RandomState(seed)
+    nVertices = max(nIndices // 6, 1)
+    vertices = rng.rand(nVertices, 3).astype(np.float32)
+    normals = rng.rand(max(nIndices // 3, 1), 3).astype(np.float32)
+    texcoords = rng.rand(max(nIndices // 4, 1), 2).astype(np.float32)
+    index = np.empty((nIndices, 3), dtype=np.uint32)
+    index[:, 0] = rng.randint(0, len(vertices), nIndices)
+    index[:, 1] = index[:, 0] % len(normals)
+    index[:, 2] = rng.randint(0, len(texcoords), nIndices) % (index[:, 0] % 3 + 1)
+    return [vertices, normals, texcoords], index
+
+
+def measure(func, bufs, index):
+    startTime = time.time()
+    result = func(bufs, index)
+    return time.time() - startTime, result
+
+
+def main(sizes):
+    config.debug = False
+    print('{:>10} {:>12} {:>12} {:>8}'.format('nIndices', 'dict (s)', 'sort (s)', 'speedup'))
+    for n in sizes:
+        bufs, index = make_mesh(n)
+        t1, (bufs1, index1) = measure(_model.make_single_index_1, bufs, index)
+        t3, (bufs3, index3) = measure(_model.make_single_index_3, bufs, index)
+        assert np.array_equal(np.asarray(index1), index3)
+        assert all(np.array_equal(a, b) for a, b in zip(bufs1, bufs3))
+        print('{:>10} {:>12.3f} {:>12.3f} {:>8.1f}'.format(n, t1, t3, t1 / t3))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
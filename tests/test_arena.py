@@ -0,0 +1,42 @@
+import unittest
+from raygllib.arena import FreeList, plan_pages
+
+
+class TestFreeList(unittest.TestCase):
+    def test_alloc_release(self):
+        freeList = FreeList(100)
+        self.assertEqual(freeList.alloc(10), 0)
+        # Aligned to a stride of 12, leaving a hole at 10.
+        self.assertEqual(freeList.alloc(24, 12), 12)
+        self.assertEqual(freeList.blocks, [(10, 2), (36, 64)])
+        self.assertEqual(freeList.alloc(2), 10)
+        self.assertIsNone(freeList.alloc(65))
+        self.assertEqual(freeList.used, 36)
+        freeList.release(12)
+        self.assertEqual(freeList.blocks, [(12, 88)])
+        freeList.release(0)
+        freeList.release(10)
+        self.assertEqual(freeList.blocks, [(0, 100)])
+        self.assertEqual(freeList.largestFree, 100)
+
+    def test_first_fit(self):
+        freeList = FreeList(64)
+        offsets = [freeList.alloc(16) for i in range(4)]
+        self.assertIsNone(freeList.alloc(1))
+        freeList.release(offsets[1])
+        freeList.release(offsets[3])
+        self.assertEqual(freeList.alloc(8), 16)
+        self.assertEqual(freeList.alloc(16), 48)
+        self.assertEqual(freeList.blocks, [(24, 8)])
+
+
+class TestPlanPages(unittest.TestCase):
+    def test_pack(self):
+        placement, freeLists = plan_pages([(40, 4), (30, 4), (20, 4), (150, 4)], 64)
+        self.assertEqual(placement, [(0, 0), (1, 0), (0, 40), (2, 0)])
+        self.assertEqual([f.capacity for f in freeLists], [64, 64, 150])
+        self.assertEqual(freeLists[0].used, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import config
+from raygllib import batching
+from raygllib import matlib as M
+from raygllib.model import Geometry, Model, ArmaturedModel
+from raygllib.uploads import UploadQueue
+from tests.test_model import grid_indices
+
+
+def make_geometry(material, compact=False, lod_levels=0):
+    indices = grid_indices(20, 10, True)
+    rng = np.random.RandomState(0)
+    vertices = rng.rand(200, 3)
+    normals = rng.rand(200, 3) - .5
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    arrays = Geometry.process(
+        vertices, normals, None, np.stack([indices, indices], axis=1),
+        compact, 0, False, lod_levels)
+    return Geometry.from_arrays('grid', arrays, material)
+
+
+class TestStaticBatching(unittest.TestCase):
+    def setUp(self):
+        self.staticBatching = config.staticBatching
+        config.staticBatching = True
+
+    def tearDown(self):
+        config.staticBatching = self.staticBatching
+
+    def test_transform_store(self):
+        geometry = make_geometry('red')
+        matrix = M.translate(1, 2, 3).dot(M.scale(2))
+        arrays = batching.transform_store(geometry.arrays, matrix)
+        self.assertTrue(np.allclose(
+            arrays['vertices'], geometry.arrays['vertices'] * 2 + [1, 2, 3]))
+        self.assertTrue(np.allclose(arrays['normals'], geometry.arrays['normals'] * 2))
+        compact = make_geometry('red', compact=True)
+        arrays = batching.transform_store(compact.arrays, matrix)
+        self.assertEqual(arrays['normals'].dtype, np.int16)
+        self.assertLessEqual(
+            np.abs(arrays['normals'] - compact.arrays['normals'].astype(int)).max(), 2)
+
+    def test_batches(self):
+        a = make_geometry('red', lod_levels=1)
+        b = make_geometry('red')
+        c = make_geometry('blue')
+        models = [
+            Model('a', a, np.eye(4)), Model('b', b, M.translate(5, 0, 0)),
+            Model('c', c, np.eye(4)), Model('a2', a, M.translate(0, 5, 0)),
+        ]
+        skinned = ArmaturedModel.__new__(ArmaturedModel)
+        skinned.geometry = a
+        batches, others = batching.StaticBatching().update(models + [skinned])
+        self.assertEqual(others, [skinned])
+        red, blue = batches
+        self.assertEqual([m.name for m in red.models], ['a', 'b', 'a2'])
+        self.assertEqual(len(blue.models), 1)
+        nVertices = len(a.arrays['vertices'])
+        self.assertEqual(red.vertexStarts.tolist(), [0, nVertices, 2 * nVertices, 3 * nVertices])
+        self.assertIs(red.model_at(nVertices + 3), models[1])
+        # b has one level, it stands for the missing ones.
+        self.assertEqual(red.ranges.shape, (3, 2, 2))
+        self.assertTrue(np.array_equal(red.ranges[1, 0], red.ranges[1, 1]))
+        store = red.vertices.data
+        self.assertTrue(np.allclose(
+            store['vertexPos'][nVertices:2 * nVertices], b.arrays['vertices'] + [5, 0, 0]))
+        indices = red.indices.data
+        offset, count = red.ranges[2, 0]
+        self.assertTrue(np.array_equal(
+            indices[offset:offset + count], a.arrays['indices'] + 2 * nVertices))
+        # Hidden models and levels of detail pick the ranges of the draw.
+        models[1].visible = False
+        models[3].lod = 1
+        offsets, counts = red.visible_ranges(red.ranges, np.array([0, 0, 1]))
+        self.assertEqual(counts.tolist(), [red.ranges[0, 0, 1], red.ranges[2, 1, 1]])
+        self.assertEqual(offsets.tolist(), [0, red.ranges[2, 1, 0] * 2])
+        self.assertLess(counts[1], counts[0])
+
+    def test_ready(self):
+        a = make_geometry('red')
+        batches, _ = batching.StaticBatching().update([Model('a', a, np.eye(4))])
+        queue = UploadQueue()
+        queue.push(batches[0].vertices)
+        self.assertFalse(batches[0].ready)
+        queue.clear()
+        self.assertTrue(batches[0].ready)
+
+    def test_moved_models_leave_their_batch(self):
+        geometry = make_geometry('red')
+        models = [Model(name, geometry, np.eye(4)) for name in 'ab']
+        batchingSet = batching.StaticBatching()
+        batches, others = batchingSet.update(models)
+        self.assertEqual((len(batches), others), (1, []))
+        self.assertIs(batchingSet.update(models)[0][0], batches[0])
+        models[0].matrix = M.translate(1, 0, 0)
+        batches, others = batchingSet.update(models)
+        self.assertEqual([m.name for m in batches[0].models], ['b'])
+        self.assertEqual(others, [models[0]])
+        batchingSet.unbatch(models[1])
+        batches, others = batchingSet.update(models)
+        self.assertEqual((batches, others), ([], models))
+
+
+if __name__ == '__main__':
+    unittest.main()
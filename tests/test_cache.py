@@ -0,0 +1,89 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from raygllib import config
+from raygllib.cache import ArrayCache
+from raygllib.model import scene_cache_key
+
+
+class TestArrayCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ArrayCache(self.path, 1 << 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_round_trip(self):
+        data = {
+            'name': 'a', 'none': None, 'list': [1, 2.5, (3, 4)],
+            'big': np.arange(1000, dtype=np.float32).reshape((-1, 2)),
+            'small': np.eye(4), 'empty': np.zeros((0, 3), dtype=np.uint32),
+        }
+        self.cache.put('key', data)
+        result = self.cache.get('key')
+        self.assertEqual(result['name'], 'a')
+        self.assertIsNone(result['none'])
+        self.assertEqual(result['list'], [1, 2.5, [3, 4]])
+        self.assertIsInstance(result['big'], np.memmap)
+        for name in ('big', 'small', 'empty'):
+            self.assertEqual(result[name].dtype, data[name].dtype)
+            self.assertTrue(np.array_equal(result[name], data[name]))
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_lru_eviction(self):
+        array = np.zeros(100000, dtype=np.uint8)
+        self.cache.maxBytes = 250000
+        for key in ('a', 'b'):
+            self.cache.put(key, array)
+            time.sleep(0.01)
+        # Using 'a' makes 'b' the least recently used one.
+        self.cache.get('a')
+        self.cache.put('c', array)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_invalidate(self):
+        self.cache.put('a', [np.ones(10)])
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('b', [np.ones(10)])
+        self.cache.clear()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_file_key(self):
+        filename = os.path.join(self.path, 'model.obj')
+        with open(filename, 'w') as outfile:
+            outfile.write('v 0 0 0')
+        key = self.cache.file_key(filename, 1)
+        self.assertNotEqual(self.cache.file_key(filename, 2), key)
+        # Same mtime and size: the stored hash is trusted.
+        stat = os.stat(filename)
+        with open(filename, 'w') as outfile:
+            outfile.write('v 1 0 0')
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.cache.file_key(filename, 1), key)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        newKey = self.cache.file_key(filename, 1)
+        self.assertNotEqual(newKey, key)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.cache.file_key(filename, 1), newKey)
+        self.assertEqual(self.cache.entries(), [])
+
+
+class TestSceneCacheKey(unittest.TestCase):
+    def test_settings_in_key(self):
+        path = os.path.join(os.path.dirname(__file__), 'models', 'scene.dae')
+        key = scene_cache_key(path)
+        with mock.patch.object(config, 'maxJointsPerVertex', config.maxJointsPerVertex + 4):
+            self.assertNotEqual(scene_cache_key(path), key)
+        self.assertEqual(scene_cache_key(path), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
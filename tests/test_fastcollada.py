@@ -0,0 +1,263 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import model
+from raygllib import fastcollada
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+
+SKINNED_DAE = """<?xml version="1.0" encoding="utf-8"?>
+<COLLADA xmlns="http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">
+  <library_effects>
+    <effect id="red-effect">
+      <profile_COMMON>
+        <technique sid="common">
+          <phong>
+            <ambient><color>0.1 0 0 1</color></ambient>
+            <diffuse><color>1 0 0 1</color></diffuse>
+            <specular><color>0.5 0.5 0.5 1</color></specular>
+            <shininess><float>20</float></shininess>
+          </phong>
+        </technique>
+      </profile_COMMON>
+    </effect>
+  </library_effects>
+  <library_materials>
+    <material id="red-material" name="red">
+      <instance_effect url="#red-effect"/>
+    </material>
+  </library_materials>
+  <library_geometries>
+    <geometry id="quad-mesh" name="quad">
+      <mesh>
+        <source id="quad-positions">
+          <float_array id="quad-positions-array" count="12">0 0 0 1 0 0 1 1 0 0 1 0</float_array>
+          <technique_common>
+            <accessor source="#quad-positions-array" count="4" stride="3">
+              <param name="X" type="float"/><param name="Y" type="float"/><param name="Z" type="float"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <source id="quad-normals">
+          <float_array id="quad-normals-array" count="3">0 0 1</float_array>
+          <technique_common>
+            <accessor source="#quad-normals-array" count="1" stride="3">
+              <param name="X" type="float"/><param name="Y" type="float"/><param name="Z" type="float"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <vertices id="quad-vertices">
+          <input semantic="POSITION" source="#quad-positions"/>
+        </vertices>
+        <triangles material="red-material" count="2">
+          <input semantic="VERTEX" source="#quad-vertices" offset="0"/>
+          <input semantic="NORMAL" source="#quad-normals" offset="1"/>
+          <p>0 0 1 0 2 0 0 0 2 0 3 0</p>
+        </triangles>
+      </mesh>
+    </geometry>
+  </library_geometries>
+  <library_controllers>
+    <controller id="arm-skin" name="Arm.001">
+      <skin source="#quad-mesh">
+        <bind_shape_matrix>1 0 0 0 0 1 0 0 0 0 1 2 0 0 0 1</bind_shape_matrix>
+        <source id="arm-skin-joints">
+          <Name_array id="arm-skin-joints-array" count="2">tip root</Name_array>
+          <technique_common>
+            <accessor source="#arm-skin-joints-array" count="2" stride="1">
+              <param name="JOINT" type="name"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <source id="arm-skin-bind_poses">
+          <float_array id="arm-skin-bind_poses-array" count="32">1 0 0 0 0 1 0 -1 0 0 1 0 0 0 0 1 1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1</float_array>
+          <technique_common>
+            <accessor source="#arm-skin-bind_poses-array" count="2" stride="16">
+              <param name="TRANSFORM" type="float4x4"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <source id="arm-skin-weights">
+          <float_array id="arm-skin-weights-array" count="3">1 0.75 0.25</float_array>
+          <technique_common>
+            <accessor source="#arm-skin-weights-array" count="3" stride="1">
+              <param name="WEIGHT" type="float"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <joints>
+          <input semantic="JOINT" source="#arm-skin-joints"/>
+          <input semantic="INV_BIND_MATRIX" source="#arm-skin-bind_poses"/>
+        </joints>
+        <vertex_weights count="4">
+          <input semantic="JOINT" source="#arm-skin-joints" offset="0"/>
+          <input semantic="WEIGHT" source="#arm-skin-weights" offset="1"/>
+          <vcount>1 2 2 1</vcount>
+          <v>1 0 1 1 0 2 0 1 1 2 0 0</v>
+        </vertex_weights>
+      </skin>
+    </controller>
+  </library_controllers>
+  <library_visual_scenes>
+    <visual_scene id="Scene" name="Scene">
+      <node id="Arm" name="Arm_001" type="NODE">
+        <translate sid="location">0 0 1</translate>
+        <rotate sid="rotationZ">0 0 1 90</rotate>
+        <node id="root" name="root" sid="root" type="JOINT">
+          <matrix sid="transform">1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1</matrix>
+          <node id="tip" name="tip" sid="tip" type="JOINT">
+            <matrix sid="transform">1 0 0 0 0 1 0 1 0 0 1 0 0 0 0 1</matrix>
+          </node>
+        </node>
+      </node>
+      <node id="Quad" name="Quad" type="NODE">
+        <matrix sid="transform">1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1</matrix>
+        <instance_controller url="#arm-skin">
+          <skeleton>#root</skeleton>
+        </instance_controller>
+      </node>
+      <node id="Plain" name="Plain" type="NODE">
+        <scale sid="scale">2 2 2</scale>
+        <instance_geometry url="#quad-mesh"/>
+      </node>
+      <node id="Empty" name="Empty" type="NODE">
+        <translate sid="location">1 2 3</translate>
+      </node>
+    </visual_scene>
+  </library_visual_scenes>
+  <scene>
+    <instance_visual_scene url="#Scene"/>
+  </scene>
+</COLLADA>
+"""
+
+
+def assert_same(test, a, b, path=''):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a, b = np.asarray(a), np.asarray(b)
+        test.assertEqual(a.dtype, b.dtype, path)
+        test.assertTrue(np.array_equal(a, b), path)
+    elif isinstance(a, dict):
+        test.assertEqual(a.keys(), b.keys(), path)
+        for key in a:
+            assert_same(test, a[key], b[key], path + '/' + key)
+    elif isinstance(a, (list, tuple)):
+        test.assertEqual(len(a), len(b), path)
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_same(test, x, y, '{}/{}'.format(path, i))
+    else:
+        test.assertEqual(a, b, path)
+
+
+class TestParseArray(unittest.TestCase):
+    def test_chunks(self):
+        values = np.random.RandomState(0).rand(1000).astype(np.float32)
+        text = '\n'.join(' '.join(map(repr, row.tolist())) for row in values.reshape((-1, 10)))
+        chunkSize = fastcollada.CHUNK_SIZE
+        fastcollada.CHUNK_SIZE = 100
+        try:
+            for count in (None, 1000, 999):
+                result = fastcollada.parse_array(text, np.float32, count)
+                self.assertTrue(np.array_equal(result, values))
+        finally:
+            fastcollada.CHUNK_SIZE = chunkSize
+        self.assertEqual(len(fastcollada.parse_array('  ', np.int32)), 0)
+
+
+class TestReadScene(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def check_same(self, path):
+        expected = model.read_scene(path, workers=1)
+        result = fastcollada.read_scene_fast(path, workers=1)
+        assert_same(self, expected, result)
+        return result
+
+    def test_scene(self):
+        result = self.check_same(os.path.join(MODEL_DIR, 'scene.dae'))
+        self.assertEqual(len(result['lights']), 4)
+
+    def test_skinned(self):
+        path = os.path.join(self.path, 'skinned.dae')
+        with open(path, 'w') as outfile:
+            outfile.write(SKINNED_DAE)
+        result = self.check_same(path)
+        self.assertEqual(result['armatures']['Arm_001']['names'], ['root', 'tip'])
+        skinned = result['models'][0]
+        self.assertEqual(skinned['jointOrder'], [1, 0])
+        self.assertEqual(skinned['weights'][1].tolist(), [.75, .25, 0, 0])
+        self.assertEqual(list(result['emptyNodes']), ['Empty'])
+
+    def test_primitives(self):
+        # The second triangle of the quad gets a material of its own.
+        dae = SKINNED_DAE.replace('</library_materials>', """
+    <material id="blue-material" name="blue">
+      <instance_effect url="#blue-effect"/>
+    </material>
+  </library_materials>""").replace('</library_effects>', """
+    <effect id="blue-effect">
+      <profile_COMMON>
+        <technique sid="common">
+          <phong>
+            <ambient><color>0 0 0.1 1</color></ambient>
+            <diffuse><color>0 0 1 1</color></diffuse>
+            <specular><color>0.5 0.5 0.5 1</color></specular>
+            <shininess><float>10</float></shininess>
+          </phong>
+        </technique>
+      </profile_COMMON>
+    </effect>
+  </library_effects>""").replace("""
+          <p>0 0 1 0 2 0 0 0 2 0 3 0</p>
+        </triangles>""", """
+          <p>0 0 1 0 2 0</p>
+        </triangles>
+        <triangles material="blue-material" count="1">
+          <input semantic="VERTEX" source="#quad-vertices" offset="0"/>
+          <input semantic="NORMAL" source="#quad-normals" offset="1"/>
+          <p>0 0 2 0 3 0</p>
+        </triangles>""")
+        path = os.path.join(self.path, 'primitives.dae')
+        with open(path, 'w') as outfile:
+            outfile.write(dae)
+        result = self.check_same(path)
+        for geometry in result['geometries']:
+            self.assertEqual(
+                [result['materials'][i]['name'] for i in geometry['materials']],
+                ['red', 'blue'])
+            arrays = geometry['arrays']
+            self.assertEqual(arrays['subRanges'].tolist(), [0, 3, 6])
+            # Both primitives share the positions, so the skin still applies.
+            self.assertEqual(len(arrays['vertices']), 4)
+        self.assertEqual(result['models'][0]['weights'][1].tolist(), [.75, .25, 0, 0])
+
+    def test_shared_geometry(self):
+        dae = SKINNED_DAE.replace('''      <node id="Empty"''', '''\
+      <node id="Plain2" name="Plain2" type="NODE">
+        <translate sid="location">3 0 0</translate>
+        <instance_geometry url="#quad-mesh"/>
+      </node>
+      <node id="Empty"''')
+        path = os.path.join(self.path, 'shared.dae')
+        with open(path, 'w') as outfile:
+            outfile.write(dae)
+        result = self.check_same(path)
+        # The skinned placement has its own copy.
+        self.assertEqual(len(result['geometries']), 2)
+        self.assertEqual([m['geometry'] for m in result['models']], [0, 1, 1])
+        scene = model.build_scene(result)
+        geometries = [m.geometry for m in scene.models]
+        self.assertIs(geometries[1], geometries[2])
+        self.assertIsNot(geometries[0], geometries[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+from OpenGL.GL import (
+    GL_ARRAY_BUFFER, GL_BLEND, GL_DEPTH_TEST, GL_ELEMENT_ARRAY_BUFFER, GL_TEXTURE0,
+    GL_TEXTURE_2D,
+)
+from raygllib import gllib
+from raygllib.gllib import GLState
+
+GL_FUNCTIONS = [
+    'glEnable', 'glDisable', 'glBindBuffer', 'glBindVertexArray', 'glActiveTexture',
+    'glBindTexture', 'glEnableVertexAttribArray', 'glDisableVertexAttribArray',
+]
+
+
+class TestGLState(unittest.TestCase):
+    def setUp(self):
+        self.state = GLState()
+        self.calls = []
+        for name in GL_FUNCTIONS:
+            patcher = mock.patch.object(
+                gllib, name, lambda *args, name=name: self.calls.append((name,) + args))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_skip_unchanged(self):
+        state = self.state
+        state.enable(GL_DEPTH_TEST)
+        state.enable(GL_DEPTH_TEST)
+        state.disable(GL_BLEND)
+        state.disable(GL_DEPTH_TEST)
+        self.assertEqual(self.calls, [
+            ('glEnable', GL_DEPTH_TEST), ('glDisable', GL_BLEND),
+            ('glDisable', GL_DEPTH_TEST)])
+        self.assertEqual(state.stats(), {'calls': 3, 'skipped': 1})
+        state.invalidate()
+        state.disable(GL_DEPTH_TEST)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_element_buffer_of_vertex_array(self):
+        state = self.state
+        state.bind_vertex_array(1)
+        state.bind_buffer(GL_ELEMENT_ARRAY_BUFFER, 5)
+        state.bind_buffer(GL_ARRAY_BUFFER, 5)
+        state.bind_vertex_array(2)
+        state.bind_buffer(GL_ELEMENT_ARRAY_BUFFER, 5)
+        state.bind_buffer(GL_ARRAY_BUFFER, 5)
+        state.bind_vertex_array(1)
+        state.bind_buffer(GL_ELEMENT_ARRAY_BUFFER, 5)
+        self.assertEqual(
+            [call for call in self.calls if call[0] == 'glBindBuffer'],
+            [('glBindBuffer', GL_ELEMENT_ARRAY_BUFFER, 5), ('glBindBuffer', GL_ARRAY_BUFFER, 5),
+             ('glBindBuffer', GL_ELEMENT_ARRAY_BUFFER, 5)])
+
+    def test_forget(self):
+        state = self.state
+        state.active_texture(GL_TEXTURE0)
+        state.bind_texture(GL_TEXTURE_2D, 3)
+        state.bind_buffer(GL_ARRAY_BUFFER, 3)
+        state.forget_texture(3)
+        state.forget_buffer(3)
+        state.bind_texture(GL_TEXTURE_2D, 0)
+        state.bind_buffer(GL_ARRAY_BUFFER, 0)
+        self.assertEqual(len(self.calls), 3)
+        state.bind_texture(GL_TEXTURE_2D, 3)
+        self.assertEqual(self.calls[-1], ('glBindTexture', GL_TEXTURE_2D, 3))
+
+    def test_attrib_arrays(self):
+        state = self.state
+        state.bind_vertex_array(0)
+        state.set_attrib_arrays([0, 1])
+        state.set_attrib_arrays([1, 2])
+        state.set_attrib_arrays([1, 2])
+        self.assertEqual(self.calls[1:], [
+            ('glEnableVertexAttribArray', 0), ('glEnableVertexAttribArray', 1),
+            ('glDisableVertexAttribArray', 0), ('glEnableVertexAttribArray', 2)])
+        # Those of another VAO are its own.
+        state.bind_vertex_array(4)
+        state.set_attrib_arrays([])
+        state.enable_attrib_array(1)
+        self.assertEqual(self.calls[-1], ('glEnableVertexAttribArray', 1))
+        # Deleting the bound VAO binds 0, and its id may be reused.
+        state.forget_vertex_array(4)
+        state.bind_vertex_array(0)
+        state.bind_vertex_array(4)
+        state.enable_attrib_array(1)
+        self.assertEqual(self.calls[-2:], [
+            ('glBindVertexArray', 4), ('glEnableVertexAttribArray', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import indirect
+from raygllib.model import Model, ArmaturedModel
+
+
+class Geometry(SimpleNamespace):
+    """
+    Stands for a model.Geometry in a buffer arena, whose buffers are never
+    allocated by the tests.
+    """
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+
+def make_geometry():
+    page = SimpleNamespace(page=0)
+    return Geometry(
+        vertices=SimpleNamespace(arena=object(), slice=page),
+        indices=SimpleNamespace(slice=page, offset=0, itemSize=4, glType=0),
+        format=SimpleNamespace(spec='vertexPos:3f'), subRanges=[[(0, 6)]],
+        materials=[object()], baseVertex=0)
+
+
+class TestMakeRuns(unittest.TestCase):
+    def test_runs(self):
+        red, blue = object(), object()
+        draws = [
+            ('a', red, (6, 1, 0, 0, 0)),
+            ('b', red, (3, 2, 0, 10, 1)),
+            ('a', blue, (9, 1, 6, 0, 3)),
+            ('a', red, (12, 1, 30, 20, 4)),
+        ]
+        commands, runs = indirect.make_runs(draws)
+        self.assertEqual(commands.dtype.itemsize, 20)
+        self.assertEqual(
+            [(key, material is red, first, count) for key, material, first, count in runs],
+            [('a', True, 0, 2), ('b', True, 2, 1), ('a', False, 3, 1)])
+        self.assertEqual(commands['firstIndex'].tolist(), [0, 30, 0, 6])
+        self.assertEqual(commands['baseInstance'].tolist(), [0, 4, 1, 3])
+        self.assertEqual(commands[1].tolist(), (12, 1, 30, 20, 4))
+
+    def test_empty(self):
+        commands, runs = indirect.make_runs([])
+        self.assertEqual((len(commands), runs), (0, []))
+
+
+class TestIndirectDraws(unittest.TestCase):
+    def test_nothing_drawn(self):
+        skinned = ArmaturedModel.__new__(ArmaturedModel)
+        skinned.geometry = make_geometry()
+        draws = indirect.IndirectDraws()
+        for models in ([], [skinned], [skinned]):
+            self.assertEqual(draws.update(models), models)
+            self.assertEqual((draws.models, draws.runs, draws.nUpdated), ([], [], 0))
+
+    def test_unchanged_key(self):
+        geometry = make_geometry()
+        models = [Model('a{}'.format(i), geometry, np.eye(4)) for i in range(3)]
+        draws = indirect.IndirectDraws()
+        self.assertEqual(draws.update(models), [])
+        self.assertEqual(draws.nUpdated, 3)
+        self.assertEqual(len(draws.runs), 1)
+        records = draws._records
+        draws._records = mock.Mock()
+        draws.update(models)
+        self.assertEqual(draws.nUpdated, 0)
+        models[1].matrix = np.eye(4) * 2
+        draws.update(models)
+        self.assertEqual(draws.nUpdated, 1)
+        self.assertEqual(draws._records.update.call_args[0][1], 1)
+        draws._records = records
+        # Hidden, the models are left out.
+        for model in models:
+            model.visible = False
+        draws.update(models)
+        draws.update(models)
+        self.assertEqual((draws.models, draws.nUpdated), ([], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import instancing
+from raygllib.model import Model, ArmaturedModel
+
+
+class Geometry:
+    """Stands for a model.Geometry; grouping doesn't touch its buffers."""
+
+
+class TestInstancing(unittest.TestCase):
+    def test_pack_matrices(self):
+        matrices = np.arange(32, dtype=np.float32).reshape((2, 4, 4))
+        items = instancing.pack_matrices(matrices)
+        self.assertEqual(items.dtype.itemsize, 64)
+        # Columns, as mat4(instanceMat0, ...) takes them.
+        self.assertEqual(items['instanceMat1'][1].tolist(), [17, 21, 25, 29])
+        flat = items.view(np.float32).reshape((2, 4, 4))
+        self.assertTrue(np.array_equal(flat.transpose((0, 2, 1)), matrices))
+
+    def test_groups(self):
+        a, b = Geometry(), Geometry()
+        models = [Model('a{}'.format(i), a, np.eye(4)) for i in range(3)]
+        models.append(Model('b', b, np.eye(4)))
+        skinned = ArmaturedModel.__new__(ArmaturedModel)
+        skinned.geometry = a
+        models.append(skinned)
+        inst = instancing.Instancing(min_instances=2)
+        groups, singles = inst.update(models)
+        self.assertEqual(len(groups), 1)
+        self.assertIs(groups[0].geometry, a)
+        self.assertEqual([m.name for m in groups[0].models], ['a0', 'a1', 'a2'])
+        self.assertEqual(singles, [models[3], skinned])
+        models[1].lod = 2
+        models[2].lod = 1
+        self.assertEqual(groups[0].level, 0)
+        # Nothing moved, so nothing is uploaded.
+        self.assertIs(inst.update(models)[0][0], groups[0])
+        self.assertEqual(groups[0].nUpdated, 0)
+        # Removing a model regroups.
+        groups, singles = inst.update(models[1:])
+        self.assertEqual([m.name for m in groups[0].models], ['a1', 'a2'])
+        self.assertEqual(groups[0].level, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import lod
+from raygllib import model
+from raygllib import matlib as M
+from tests.test_model import grid_indices
+
+
+def torus(w, h):
+    indices = grid_indices(w, h, True)
+    u = np.arange(w * h) // h / w * 2 * np.pi
+    v = np.arange(w * h) % h / h * 2 * np.pi
+    vertices = np.stack([
+        (2 + np.cos(v)) * np.cos(u), (2 + np.cos(v)) * np.sin(u), np.sin(v)], axis=1)
+    return vertices, indices, u
+
+
+class TestMakeLods(unittest.TestCase):
+    def test_chain(self):
+        vertices, indices, _ = torus(80, 40)
+        lods = lod.make_lods(vertices, indices, 3, .25)
+        self.assertEqual(len(lods), 3)
+        counts = [len(indices)] + [len(indices) for indices in lods]
+        for finer, coarser in zip(counts[:-1], counts[1:]):
+            self.assertLess(coarser, finer / 2)
+        for indices in lods:
+            self.assertEqual(indices.dtype, np.uint32)
+            triangles = indices.reshape((-1, 3))
+            self.assertTrue((triangles[:, 0] != triangles[:, 1]).all())
+            self.assertLess(indices.max(), len(vertices))
+            # Coarse vertices stay close to the surface.
+            v = vertices[indices]
+            distance = np.abs(np.hypot(np.hypot(v[:, 0], v[:, 1]) - 2, v[:, 2]) - 1)
+            self.assertLess(distance.max(), 1e-6)
+
+    def test_stops_when_small(self):
+        vertices, indices, _ = torus(8, 6)
+        self.assertEqual(lod.make_lods(vertices, indices, 3, .25), [])
+
+    def test_joints_kept_apart(self):
+        vertices, indices, u = torus(80, 40)
+        joints = (u > np.pi).astype(np.uint8)
+        nClusters, cluster = lod.cluster_vertices(vertices, 10., joints)
+        self.assertEqual(nClusters, 2)
+        self.assertTrue(np.array_equal(cluster, joints))
+        for indices in lod.make_lods(vertices, indices, 3, .25, joints):
+            # Every vertex of a level is still bound to its joint, and the
+            # seam between the joints is kept.
+            used = np.unique(indices)
+            self.assertEqual(set(joints[used]), {0, 1})
+
+    def test_process(self):
+        vertices, indices, u = torus(80, 40)
+        index = np.stack([indices, indices], axis=1)
+        arrays = model.Geometry.process(
+            vertices, vertices, None, index, True, 16, False, 2, .25, u > np.pi)
+        self.assertEqual(arrays['lodIndices'].dtype, np.uint16)
+        offsets = arrays['lodOffsets']
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual(offsets[-1], len(arrays['lodIndices']))
+        arrays = model.Geometry.process(vertices, vertices, None, index)
+        self.assertNotIn('lodIndices', arrays)
+
+    def test_sub_ranges(self):
+        vertices, indices, u = torus(80, 40)
+        # Two primitives, split by the side of their first corner.
+        triangles = indices.reshape((-1, 3))
+        side = u[triangles[:, 0]] > np.pi
+        indices = np.concatenate([triangles[~side], triangles[side]]).ravel()
+        index = np.stack([indices, indices], axis=1)
+        ranges = [0, 3 * (~side).sum(), len(indices)]
+        arrays = model.Geometry.process(
+            vertices, vertices, None, index, False, 16, True, 2, .25, None, ranges)
+        self.assertEqual(arrays['subRanges'].tolist(), ranges)
+        # The triangles are reordered within their primitive only.
+        positions = arrays['vertexIds'][arrays['indices']]
+        for start, end in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(
+                sorted(map(sorted, positions[start:end].reshape((-1, 3)).tolist())),
+                sorted(map(sorted, indices[start:end].reshape((-1, 3)).tolist())))
+        subRanges = arrays['lodSubRanges']
+        self.assertEqual(subRanges.shape, (2, 3))
+        self.assertEqual(subRanges[:, 0].tolist(), arrays['lodOffsets'][:-1].tolist())
+        self.assertEqual(subRanges[-1, -1], len(arrays['lodIndices']))
+        for offsets in subRanges:
+            counts = np.diff(offsets)
+            self.assertTrue((counts > 0).all())
+            self.assertTrue((counts < np.diff(ranges) / 2).all())
+
+
+class TestLodSelector(unittest.TestCase):
+    def test_hysteresis(self):
+        selector = lod.LodSelector(1., .25)
+        counts = [1000, 250, 60]
+        self.assertEqual(selector.select_level(counts, 2000, 2), 0)
+        self.assertEqual(selector.select_level(counts, 100, 0), 2)
+        # 250 triangles fit the budget, but not with the margin.
+        self.assertEqual(selector.select_level(counts, 300, 2), 2)
+        self.assertEqual(selector.select_level(counts, 320, 2), 1)
+        # Going back up needs the budget to fall under the count by the margin.
+        self.assertEqual(selector.select_level(counts, 900, 0), 0)
+        self.assertEqual(selector.select_level(counts, 790, 0), 1)
+
+    def test_projected_radius(self):
+        projMat = M.ortho_view(-2, 2, -1, 1, -100, 100)
+        viewMat = M.look_at(np.array([0., -10, 0]), np.zeros(3), np.array([0., 0, 1]))
+        matrix = np.diag([2., 2., 2., 1.])
+        radius = lod.projected_radius(np.zeros(3), .5, matrix, viewMat, projMat, 400, 200)
+        self.assertAlmostEqual(radius, 100.)
+
+    def test_select(self):
+        vertices, indices, _ = torus(8, 6)
+        geometry = model.Geometry.__new__(model.Geometry)
+        geometry.lodTriangles = [1000, 100]
+        geometry.boundCenter, geometry.boundRadius = lod.bounding_sphere(vertices)
+        self.assertAlmostEqual(geometry.boundRadius, 3.)
+        m = model.Model('torus', geometry, np.eye(4))
+        selector = lod.LodSelector()
+        projMat = M.ortho_view(-100, 100, -100, 100, -100, 100)
+        selector.select([m], np.eye(4), projMat, 100, 100)
+        self.assertEqual(m.lod, 1)
+        self.assertEqual(selector.stats[0][:3], ('torus', 1, 100))
+        self.assertIn('total: 100 triangles', selector.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+import os
+import unittest
+import pyximport
+pyximport.install()
+import numpy as np
+from raygllib import _model
+from raygllib import model
+
+
+def random_index(rng, n, sizes):
+    return np.stack([rng.randint(0, size, n) for size in sizes], axis=1)
+
+
+def grid_indices(w, h, wrap):
+    """
+    Triangulate a w x h grid of vertices. If wrap is true the grid is closed
+    into a torus, which is a manifold without boundary.
+    """
+    nx, ny = (w, h) if wrap else (w - 1, h - 1)
+    indices = []
+    for i in range(nx):
+        for j in range(ny):
+            a = i * h + j
+            b = (i + 1) % w * h + j
+            c = (i + 1) % w * h + (j + 1) % h
+            d = i * h + (j + 1) % h
+            indices.extend([a, b, c, a, c, d])
+    return np.array(indices, dtype=np.uint32)
+
+
+class TestAdjIndices(unittest.TestCase):
+    def test_same_as_half_edge_version(self):
+        for wrap in (True, False):
+            indices = grid_indices(7, 5, wrap)
+            expected = np.asarray(_model.make_adj_indices(indices))
+            result = _model.make_adj_indices_1(indices)
+            self.assertEqual(result.dtype, np.uint32)
+            self.assertTrue(np.array_equal(expected, result))
+
+    def test_non_manifold(self):
+        # Three triangles share the edge (0, 1).
+        indices = np.array([0, 1, 2, 1, 0, 3, 1, 0, 4], dtype=np.uint32)
+        result = _model.make_adj_indices_1(indices)
+        self.assertEqual(list(result[:2]), [0, 3])
+        self.assertEqual(list(result[6:8]), [1, 2])
+        self.assertEqual(list(result[12:14]), [1, 2])
+
+
+class TestSingleIndex(unittest.TestCase):
+    def test_same_as_dict_version(self):
+        rng = np.random.RandomState(0)
+        vertices = rng.randint(0, 5, (50, 3)).astype(np.float64)
+        vertices[0] = -0.
+        vertices[1] = 0.
+        normals = rng.randint(0, 2, (30, 3)).astype(np.float32)
+        texcoords = rng.randint(0, 3, (20, 2)).astype(np.float64)
+        bufs = [vertices, normals, texcoords]
+        for n in (1, 10, 1000, 20000):
+            index = random_index(rng, n, (50, 30, 20))
+            bufs1, index1 = _model.make_single_index_1(bufs, index)
+            bufs3, index3 = _model.make_single_index_3(bufs, index)
+            self.assertTrue(np.array_equal(np.asarray(index1), index3))
+            for buf1, buf3 in zip(bufs1, bufs3):
+                self.assertEqual(buf3.dtype, np.float32)
+                self.assertTrue(np.array_equal(buf1, buf3))
+
+    def test_empty(self):
+        bufs, index = _model.make_single_index_3(
+            [np.zeros((3, 3)), np.zeros((3, 3))], np.zeros((0, 2), dtype=np.uint32))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(bufs[0].shape, (0, 3))
+
+
+class TestGeometryStore(unittest.TestCase):
+    def make_mesh(self):
+        rng = np.random.RandomState(0)
+        indices = grid_indices(6, 5, True)
+        # Texcoords split each position into a few store vertices, like seams.
+        index = np.stack([indices, indices % 7, rng.randint(0, 3, len(indices))], axis=1)
+        return rng.rand(30, 3), rng.rand(7, 3), rng.rand(3, 2), index
+
+    def test_process(self):
+        vertices, normals, texcoords, index = self.make_mesh()
+        arrays = model.Geometry.process(vertices, normals, texcoords, index)
+        indices = arrays['indices']
+        self.assertLess(len(arrays['vertices']), len(index))
+        self.assertTrue(np.array_equal(
+            arrays['vertices'][indices], vertices[index[:, 0]].astype(np.float32)))
+        self.assertTrue(np.array_equal(
+            arrays['normals'][indices], normals[index[:, 1]].astype(np.float32)))
+        self.assertTrue(np.array_equal(
+            arrays['texcoords'][indices], texcoords[index[:, 2]].astype(np.float32)))
+        self.assertTrue(np.array_equal(arrays['vertexIds'][indices], index[:, 0]))
+
+    def test_adjacency_across_seams(self):
+        vertices, normals, texcoords, index = self.make_mesh()
+        arrays = model.Geometry.process(vertices, normals, texcoords, index)
+        vertexIds = arrays['vertexIds']
+        adjIndices = model.AdjacencyVertexBuffer.make_store_indices(
+            arrays['indices'], vertexIds)
+        expected = _model.make_adj_indices_1(index[:, 0].astype(np.uint32))
+        self.assertTrue(np.array_equal(vertexIds[adjIndices], expected))
+        # Each position is referred to by a single store vertex.
+        for position in np.unique(expected):
+            self.assertEqual(len(np.unique(adjIndices[expected == position])), 1)
+
+    def test_compact(self):
+        vertices, normals, texcoords, index = self.make_mesh()
+        normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+        arrays = model.Geometry.process(vertices, normals, texcoords, index)
+        compact = model.Geometry.process(vertices, normals, texcoords, index, compact=True)
+        self.assertEqual(compact['normals'].dtype, np.int16)
+        self.assertEqual(compact['texcoords'].dtype, np.float16)
+        self.assertEqual(compact['indices'].dtype, np.uint16)
+        self.assertTrue(np.array_equal(compact['indices'], arrays['indices']))
+        self.assertTrue(np.allclose(compact['normals'] / 32767., arrays['normals'], atol=1e-4))
+        self.assertTrue(np.allclose(compact['texcoords'], arrays['texcoords'], atol=1e-3))
+
+    def test_eight_joints(self):
+        arrays = {
+            'vertices': np.zeros((3, 3), dtype=np.float32),
+            'weights': np.arange(24, dtype=np.float32).reshape((3, 8)),
+            'jointIds': np.arange(24, dtype=np.uint8).reshape((3, 8)),
+        }
+        attributes = {
+            name: array for name, array, _ in model.Geometry.vertex_attributes(arrays)}
+        self.assertEqual(sorted(attributes), [
+            'vertexJointIds', 'vertexJointIds1', 'vertexPos',
+            'vertexWeights', 'vertexWeights1'])
+        self.assertEqual(attributes['vertexWeights1'].tolist(), arrays['weights'][:, 4:].tolist())
+        self.assertEqual(attributes['vertexJointIds'].tolist(), arrays['jointIds'][:, :4].tolist())
+
+
+class TestVertexCache(unittest.TestCase):
+    def triangle_set(self, indices):
+        # Triangles up to rotation of their corners
+        triangles = indices.reshape((-1, 3))
+        rotations = [np.roll(triangles, k, axis=1) for k in range(3)]
+        return sorted(min(map(tuple, rows)) for rows in zip(*rotations))
+
+    def test_tipsify(self):
+        rng = np.random.RandomState(0)
+        indices = grid_indices(40, 30, False)
+        # Shuffle the triangles, like an exporter may.
+        indices = indices.reshape((-1, 3))[rng.permutation(len(indices) // 3)].ravel()
+        newIndices, starts = _model.tipsify(indices, 1200, 16)
+        self.assertEqual(self.triangle_set(newIndices), self.triangle_set(indices))
+        self.assertEqual(starts[0], 0)
+        self.assertTrue((np.diff(starts) > 0).all())
+        acmr, atvr = _model.vertex_cache_stats(indices, 1200, 16)
+        newAcmr, newAtvr = _model.vertex_cache_stats(newIndices, 1200, 16)
+        self.assertLess(newAcmr, 0.8)
+        self.assertLess(newAcmr, acmr / 2)
+        self.assertLess(newAtvr, atvr)
+
+    def test_stats(self):
+        # A strip of two triangles misses each vertex once.
+        indices = np.array([0, 1, 2, 2, 1, 3], dtype=np.uint32)
+        self.assertEqual(_model.vertex_cache_stats(indices, 4, 16), (2., 1.))
+        self.assertEqual(_model.vertex_cache_stats(indices, 4, 1), (2.5, 1.25))
+        self.assertEqual(_model.vertex_cache_stats(indices[:0], 4, 16), (0., 0.))
+
+    def test_first_use_order(self):
+        order, newIndices = _model.first_use_order(np.array([5, 2, 5, 0, 2], dtype=np.uint32))
+        self.assertEqual(order.tolist(), [5, 2, 0])
+        self.assertEqual(newIndices.tolist(), [0, 1, 0, 2, 1])
+
+    def test_optimized_store(self):
+        vertices, normals, texcoords, index = TestGeometryStore().make_mesh()
+        expected = model.Geometry.process(vertices, normals, texcoords, index)
+        for overdraw in (False, True):
+            arrays = model.Geometry.process(
+                vertices, normals, texcoords, index, cache_size=8, overdraw=overdraw)
+            indices = arrays['indices']
+            # Vertices are numbered by first use.
+            self.assertEqual(_model.first_use_order(indices)[0].tolist(),
+                             list(range(len(arrays['vertices']))))
+            # The same triangles are drawn, with the same attributes.
+            self.assertEqual(self.attribute_triangles(arrays),
+                             self.attribute_triangles(expected))
+
+    def attribute_triangles(self, arrays):
+        corners = np.concatenate([
+            arrays[key][arrays['indices']]
+            for key in ('vertices', 'normals', 'texcoords')], axis=1)
+        corners = np.concatenate([corners, arrays['vertexIds'][arrays['indices'], None]], axis=1)
+        rows = [tuple(row) for row in corners.tolist()]
+        ids = {row: i for i, row in enumerate(sorted(set(rows)))}
+        return self.triangle_set(np.array([ids[row] for row in rows]))
+
+
+class TestQuantize(unittest.TestCase):
+    def test_weights_sum_to_one(self):
+        rng = np.random.RandomState(0)
+        weights = rng.rand(1000, 4)
+        weights /= weights.sum(axis=1, keepdims=True)
+        weights[0] = 0
+        result = model.quantize_weights(weights)
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertEqual(result[0].tolist(), [0, 0, 0, 0])
+        self.assertTrue((result[1:].sum(axis=1, dtype=int) == 255).all())
+        self.assertLess(np.abs(result / 255. - weights).max(), 2. / 255)
+
+    def test_weights_keep_their_sum(self):
+        weights = np.array([[.5, .2, 0, 0], [.3, .3, .3, 0]])
+        result = model.quantize_weights(weights)
+        self.assertEqual(result.sum(axis=1, dtype=int).tolist(), [178, 229])
+        self.assertLess(np.abs(result / 255. - weights).max(), 2. / 255)
+
+    def test_snorm16(self):
+        result = model.quantize_snorm16(np.array([-1., -.5, 0, 1., 2.]))
+        self.assertEqual(result.tolist(), [-32767, -16384, 0, 32767, 32767])
+
+
+def pack_skin_weights_loop(weightData, weightIndex, jointIndex, maxJointsPerVertex):
+    """The per vertex loop load_scene used to run."""
+    nVertices = len(weightIndex)
+    weights = np.zeros((nVertices, maxJointsPerVertex), dtype=np.float32)
+    jointIds = np.zeros((nVertices, maxJointsPerVertex), dtype=np.float32)
+    for i in range(nVertices):
+        wIndex = weightIndex[i]
+        jIndex = jointIndex[i]
+        nJoints = len(jIndex)
+        if nJoints > maxJointsPerVertex:
+            data = list(zip(-weightData[wIndex], jIndex))
+            data.sort()
+            data = data[:maxJointsPerVertex]
+            weights[i, :] = [-w for w, _ in data]
+            weights[i] /= weights[i].sum()
+            jointIds[i, :] = [j for _, j in data]
+        else:
+            weights[i, :nJoints] = weightData[wIndex]
+            jointIds[i, :nJoints] = jIndex
+    return weights, jointIds
+
+
+class TestPackSkinWeights(unittest.TestCase):
+    def test_same_as_loop(self):
+        rng = np.random.RandomState(0)
+        weightData = rng.rand(50)
+        for maxJoints in (4, 8):
+            counts = rng.randint(0, 12, 300)
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            weightIndex = rng.randint(0, len(weightData), offsets[-1])
+            jointIndex = rng.randint(0, 30, offsets[-1])
+            weights, jointIds, nTruncated, maxError = model.pack_skin_weights(
+                weightData, offsets, weightIndex, jointIndex, maxJoints)
+            expectedWeights, expectedJointIds = pack_skin_weights_loop(
+                weightData,
+                [weightIndex[a:b] for a, b in zip(offsets[:-1], offsets[1:])],
+                [jointIndex[a:b] for a, b in zip(offsets[:-1], offsets[1:])],
+                maxJoints)
+            self.assertEqual(weights.dtype, np.float32)
+            self.assertEqual(jointIds.dtype, np.float32)
+            self.assertTrue(np.allclose(weights, expectedWeights))
+            self.assertTrue(np.array_equal(jointIds, expectedJointIds))
+            self.assertEqual(nTruncated, (counts > maxJoints).sum())
+            self.assertTrue(0 < maxError < 1)
+
+    def test_no_truncation(self):
+        weights, jointIds, nTruncated, maxError = model.pack_skin_weights(
+            np.array([.5, .25]), [0, 2, 3], [0, 1, 1], [3, 4, 5])
+        self.assertEqual(weights.tolist(), [[.5, .25, 0, 0], [.25, 0, 0, 0]])
+        self.assertEqual(jointIds.tolist(), [[3, 4, 0, 0], [5, 0, 0, 0]])
+        self.assertEqual((nTruncated, maxError), (0, 0.))
+
+
+class TestProcessGeometries(unittest.TestCase):
+    def test_parallel_same_as_serial(self):
+        rng = np.random.RandomState(0)
+        tasks = []
+        for i in range(4):
+            indices = grid_indices(6 + i, 5, True)
+            index = np.stack([indices, indices % 7, indices % 5], axis=1)
+            tasks.append((
+                rng.rand(indices.max() + 1, 3), rng.rand(7, 3),
+                rng.rand(5, 2) if i % 2 else None, index))
+        serial = model.process_geometries(tasks, workers=1)
+        parallel = model.process_geometries(tasks, workers=2)
+        for arrays1, arrays2 in zip(serial, parallel):
+            self.assertEqual(arrays1.keys(), arrays2.keys())
+            for name in arrays1:
+                if arrays1[name] is None:
+                    self.assertIsNone(arrays2[name])
+                else:
+                    self.assertEqual(arrays1[name].dtype, arrays2[name].dtype)
+                    self.assertTrue(np.array_equal(arrays1[name], arrays2[name]))
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), 'needs /dev/shm')
+    def test_failure_frees_shared_memory(self):
+        indices = grid_indices(6, 5, True)
+        index = np.stack([indices] * 3, axis=1)
+        task = (np.random.rand(indices.max() + 1, 3),) * 2 + (None, index)
+        before = set(os.listdir('/dev/shm'))
+        with self.assertRaises(TypeError):
+            model.process_geometries([task, (None, None, None, index), task, task], workers=2)
+        self.assertEqual(set(os.listdir('/dev/shm')) - before, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from raygllib import modellib
+
+OBJ = """# comment
+mtllib scene.mtl
+o Quad
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 1 1
+vn 0 0 1
+usemtl red
+f 1/1/1 2/2/1 3/3/1 4/1/1
+usemtl blue
+f -4//-1 -3//-1 -2//-1
+o Triangle
+v 0 0 1
+f 5 1 2
+f 5/1 1/2 2/3
+"""
+
+
+class TestReadObj(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'scene.obj')
+        with open(self.filename, 'w') as outfile:
+            outfile.write(OBJ)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_read(self):
+        for blockSize in (7, 1 << 20):
+            data = modellib.read_obj(self.filename, blockSize)
+            self.assertEqual(data['mtllib'], 'scene.mtl')
+            quad, quad2, triangle = data['objects']
+            self.assertEqual((quad['name'], quad['material']), ('Quad', 'red'))
+            self.assertEqual((quad2['name'], quad2['material']), ('Quad', 'blue'))
+            self.assertEqual(quad['vertices'].tolist(), [
+                [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 0, 0], [1, 1, 0], [0, 1, 0]])
+            self.assertEqual(quad['texcoords'].tolist(), [
+                [0, 0], [1, 0], [1, 1], [0, 0], [1, 1], [0, 0]])
+            self.assertEqual(quad2['vertices'].tolist(), [[0, 0, 0], [1, 0, 0], [1, 1, 0]])
+            self.assertEqual(quad2['texcoords'].tolist(), [[0, 0]] * 3)
+            self.assertEqual(quad2['normals'].tolist(), [[0, 0, 1]] * 3)
+            self.assertEqual(
+                triangle['texcoords'].tolist(), [[0, 0]] * 3 + [[0, 0], [1, 0], [1, 1]])
+            # Faces without normals get their flat normal.
+            self.assertEqual(triangle['normals'].tolist(), [[0, -1, 0]] * 6)
+            for obj in data['objects']:
+                self.assertEqual(obj['vertices'].dtype, np.float32)
+
+    def test_tabs(self):
+        expected = modellib.read_obj(self.filename)
+        with open(self.filename, 'w') as outfile:
+            outfile.write(OBJ.replace(' ', '\t'))
+        data = modellib.read_obj(self.filename)
+        self.assertEqual(data['mtllib'], expected['mtllib'])
+        self.assertEqual(len(data['objects']), len(expected['objects']))
+        for obj, expectedObj in zip(data['objects'], expected['objects']):
+            self.assertEqual(obj['name'], expectedObj['name'])
+            self.assertEqual(obj['material'], expectedObj['material'])
+            self.assertEqual(obj['vertices'].tolist(), expectedObj['vertices'].tolist())
+
+    def test_parse_faces(self):
+        corners = modellib.parse_faces(['1/2/3 4/5/6 7/8/9 10/11/12 13/14/15', '1 2 3'])
+        self.assertEqual(corners[:, 0].tolist(), [1, 4, 7, 1, 7, 10, 1, 10, 13, 1, 2, 3])
+        self.assertEqual(corners[9:, 1:].tolist(), [[0, 0]] * 3)
+        # Mixed corner formats
+        corners = modellib.parse_faces(['1/2 3//4 5/6/7'])
+        self.assertEqual(corners.tolist(), [[1, 2, 0], [3, 0, 4], [5, 6, 7]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+from raygllib.model import Material
+from raygllib.renderqueue import RenderQueue, make_keys, radix_sort
+
+
+class TestKeys(unittest.TestCase):
+    def test_make_keys(self):
+        keys = make_keys([1, 0], [2, 0], [3, 1 << 20], [4, 0], [1., .5])
+        self.assertEqual(keys.dtype, np.uint64)
+        self.assertEqual(int(keys[0]), (1 << 60) | (2 << 56) | (3 << 40) | (4 << 24) | 0xffffff)
+        # Clipped to its 16 bits
+        self.assertEqual(int(keys[1]) >> 24, 0xffff << 16)
+        self.assertEqual(int(keys[1]) & 0xffffff, 0x800000)
+
+    def test_radix_sort(self):
+        keys = np.random.RandomState(0).randint(0, 1 << 62, 1000, dtype=np.int64).astype(np.uint64)
+        keys[::3] = keys[1]
+        order = radix_sort(keys)
+        self.assertEqual(order.tolist(), np.argsort(keys, kind='stable').tolist())
+        self.assertEqual(radix_sort(np.zeros(0, dtype=np.uint64)).tolist(), [])
+
+
+class TestRenderQueue(unittest.TestCase):
+    def setUp(self):
+        self.red = Material('red', Material.DIFFUSE_COLOR, (1., 0., 0.))
+        self.image = Material('image', Material.DIFFUSE_TEXTURE, [np.zeros((1, 1, 4), np.uint8)])
+        self.image2 = Material('image2', Material.DIFFUSE_COLOR, (0., 0., 0.))
+        self.image2.diffuseType = Material.DIFFUSE_TEXTURE
+        self.image2.diffuse = self.image.diffuse
+
+    def test_order(self):
+        queue = RenderQueue()
+        draws = [
+            ('a', self.image, 'g1', 3.), ('b', self.red, 'g2', 1.), ('c', self.image, 'g1', 2.),
+            ('d', self.image2, 'g3', 0.), ('e', self.red, 'g1', 0.),
+        ]
+        for model, material, geometry, depth in draws:
+            queue.submit(0, 'program', material, geometry, depth, model)
+            queue.submit(1, 'other', None, geometry, depth, model)
+        queue.sort()
+        drawn, materials = [], []
+        queue.execute(0, drawn.append, materials.append)
+        # By material, the textured ones together, then geometry and depth.
+        self.assertEqual(drawn, ['c', 'a', 'd', 'e', 'b'])
+        self.assertEqual(materials, [self.image, self.image2, self.red])
+        self.assertEqual(queue.stats, {'draws': 5, 'stateChanges': 7, 'bindsAvoided': 3})
+        drawn = []
+        queue.execute(1, drawn.append)
+        self.assertEqual(drawn, ['e', 'c', 'a', 'b', 'd'])
+
+    def test_draw_leaves_material(self):
+        queue = RenderQueue()
+        for model in 'ab':
+            queue.submit(0, 'program', self.red, 'g', 0., model)
+        queue.sort()
+        materials = []
+        queue.execute(0, lambda model: model == 'a', materials.append)
+        self.assertEqual(materials, [self.red, self.red])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import wait
+from unittest import mock
+import numpy as np
+from PIL import Image
+from raygllib import textures
+from raygllib.cache import ArrayCache
+from raygllib.gllib import Texture2D
+
+
+def encode(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, 'png')
+    return np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+
+
+class TestMakeMips(unittest.TestCase):
+    def test_shapes(self):
+        rgba = np.zeros((10, 30, 4), dtype=np.uint8)
+        self.assertEqual(
+            [level.shape[:2] for level in textures.make_mips(rgba)],
+            [(10, 30), (5, 15), (2, 7), (1, 3), (1, 1)])
+
+    def test_values(self):
+        rgba = np.zeros((2, 4, 4), dtype=np.uint8)
+        rgba[:, :2] = 200
+        rgba[0, 2:] = 100
+        levels = textures.make_mips(rgba)
+        self.assertEqual(levels[1][..., 0].tolist(), [[200, 50]])
+        self.assertEqual(levels[2][..., 0].tolist(), [[125]])
+
+    def test_odd(self):
+        # The single texel of the next level averages all three.
+        rgba = np.zeros((1, 3, 4), dtype=np.uint8)
+        rgba[0, :, 0] = [0, 0, 180]
+        self.assertEqual(textures.make_mips(rgba)[1][0, 0, 0], 60)
+
+    def test_odd_coverage(self):
+        # Each of the 2 texels covers 2.5 of the 5, half of the middle one.
+        level = np.array([10., 20., 40., 80., 160.])
+        self.assertTrue(np.allclose(textures.halve(level, 0), [20., 104.]))
+
+
+class TestLoadMips(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cache(self):
+        rgba = np.random.RandomState(0).randint(0, 255, (8, 6, 4)).astype(np.uint8)
+        encoded = encode(rgba)
+        cache = ArrayCache(self.dir, 1 << 20)
+        levels = textures.load_mips(encoded, cache)
+        self.assertTrue((levels[0] == rgba).all())
+        self.assertEqual(len(levels), 4)
+        cached = textures.load_mips(encoded, cache)
+        self.assertEqual(len(cached), len(levels))
+        for a, b in zip(levels, cached):
+            self.assertTrue((a == b).all())
+
+    def test_future(self):
+        rgba = np.full((4, 4, 4), 7, dtype=np.uint8)
+        levels = textures.load_texture(encode(rgba)).result()
+        self.assertEqual(levels[-1].tolist(), [[[7] * 4]])
+
+
+class TestFailedTexture(unittest.TestCase):
+    def test_placeholder_image(self):
+        future = textures.load_texture(b'not an image')
+        wait([future])
+        texture = Texture2D(future)
+        self.assertTrue(texture.loaded)
+        self.assertEqual(texture.nbytes, 4)
+        with mock.patch.object(Texture2D, 'make_texture_levels', return_value=5) as make, \
+                mock.patch.object(Texture2D, 'configure'):
+            texture.upload()
+        self.assertIs(make.call_args[0][0], Texture2D.PLACEHOLDER_IMAGE)
+        self.assertTrue(texture.ready)
+        texture._id = None
+
+
+if __name__ == '__main__':
+    unittest.main()
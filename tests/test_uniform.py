@@ -0,0 +1,121 @@
+import unittest
+from unittest import mock
+import numpy as np
+from OpenGL.GL import GL_FLOAT, GL_FLOAT_MAT4, GL_FLOAT_VEC3, GL_SAMPLER_2D
+from raygllib import gllib
+from raygllib.gllib import Uniform, UniformBlock, UniformBuffer, expand_uniform_blocks
+
+
+def make_uniform(type, size=1):
+    """
+    Return a Uniform recording the calls it makes instead of making them.
+    """
+    uniform = Uniform('name', 3, type, size)
+    uniform.calls = []
+    uniform.func = lambda *args: uniform.calls.append(args)
+    return uniform
+
+
+class TestUniform(unittest.TestCase):
+    def test_skip_same_value(self):
+        uniform = make_uniform(GL_SAMPLER_2D)
+        uniform.set(0)
+        uniform.set(0)
+        uniform.set(1)
+        self.assertEqual([args[:2] for args in uniform.calls], [(3, 1), (3, 1)])
+        self.assertEqual([args[2].tolist() for args in uniform.calls], [0, 1])
+        self.assertEqual((uniform.nHits, uniform.nMisses), (1, 2))
+
+    def test_array_content(self):
+        uniform = make_uniform(GL_FLOAT_VEC3, 4)
+        value = np.ones((2, 3), dtype=np.float32)
+        uniform.set(value)
+        # Changed in place, it is a new value.
+        value[1, 2] = 5
+        uniform.set(value)
+        uniform.set(value.tolist())
+        self.assertEqual((uniform.nHits, uniform.nMisses), (1, 2))
+        self.assertEqual(uniform.calls[-1][1], 2)
+        # A shorter array is a new value too.
+        uniform.set(value[:1])
+        self.assertEqual(uniform.calls[-1][1], 1)
+
+    def test_empty(self):
+        uniform = make_uniform(GL_FLOAT, 10)
+        uniform.set([])
+        uniform.set([])
+        self.assertEqual(uniform.calls, [])
+        self.assertEqual((uniform.nHits, uniform.nMisses), (1, 1))
+
+    def test_matrix_transpose(self):
+        uniform = make_uniform(GL_FLOAT_MAT4)
+        matrix = np.eye(4)
+        uniform.set(matrix, transpose=True)
+        uniform.set(matrix, transpose=False)
+        uniform.set(matrix, transpose=False)
+        self.assertEqual([args[1:3] for args in uniform.calls], [(1, True), (1, False)])
+        self.assertEqual(uniform.calls[0][3].dtype, np.float32)
+
+
+class TestUniformBlock(unittest.TestCase):
+    def make_block(self, name, binding, members):
+        block = UniformBlock(name, binding, members)
+        self.addCleanup(UniformBlock.blocks.pop, name, None)
+        return block
+
+    def test_std140_layout(self):
+        block = self.make_block('TestBlock', 10, [
+            ('a', 'float'), ('b', 'vec3'), ('c', 'float'), ('d', 'vec2'),
+            ('e', 'float', 3), ('f', 'vec3'), ('g', 'mat4'), ('h', 'int'),
+            ('i', 'vec3', 2),
+        ])
+        fields = block.dtype.fields
+        self.assertEqual(
+            {name: fields[name][1] for name in block.dtype.names},
+            {'a': 0, 'b': 16, 'c': 28, 'd': 32, 'e': 48, 'f': 96, 'g': 112, 'h': 176,
+             'i': 192})
+        self.assertEqual(fields['e'][0].shape, (3, 4))
+        self.assertEqual(fields['g'][0].shape, (4, 4))
+        self.assertEqual(block.dtype.itemsize, 224)
+
+    def test_glsl(self):
+        self.make_block('TestBlock', 10, [('m', 'mat4'), ('n', 'float', 8)])
+        source = '# version 330 core\n  #pragma uniform_block TestBlock\nvoid main() {}\n'
+        self.assertEqual(expand_uniform_blocks(source), (
+            '# version 330 core\n'
+            'layout(std140, row_major) uniform TestBlock {\n'
+            '    mat4 m;\n'
+            '    float n[8];\n'
+            '};\n'
+            'void main() {}\n'))
+        with self.assertRaises(KeyError):
+            expand_uniform_blocks('#pragma uniform_block NoBlock\n')
+
+    def test_binding_taken(self):
+        self.make_block('TestBlock', 10, [('a', 'float')])
+        with self.assertRaises(ValueError):
+            UniformBlock('OtherBlock', 10, [('a', 'float')])
+        # Made again, a block keeps its binding.
+        self.make_block('TestBlock', 10, [('a', 'float'), ('b', 'float')])
+
+    def test_update_skips_same_data(self):
+        buffer = UniformBuffer(self.make_block('TestBlock', 10, [('a', 'vec3', 2)]))
+        buffer._id = 1
+        calls = []
+        with mock.patch.object(gllib, 'glBufferSubData', lambda *args: calls.append(args)), \
+                mock.patch.object(gllib.glState, 'bind_buffer', lambda *args: None):
+            buffer.data['a'][1, :3] = (1, 2, 3)
+            buffer.update()
+            buffer.update()
+            buffer.data['a'][0, 0] = 4
+            buffer.update()
+        buffer._id = None
+        self.assertEqual((buffer.nHits, buffer.nMisses), (1, 2))
+        self.assertEqual(calls[0][1:3], (0, 32))
+        self.assertEqual(
+            np.frombuffer(calls[-1][3].tobytes(), np.float32).tolist(),
+            [4, 0, 0, 0, 1, 2, 3, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
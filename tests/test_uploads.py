@@ -0,0 +1,67 @@
+import unittest
+from raygllib.gllib import GLResource
+from raygllib.uploads import UploadQueue
+
+
+class FakeResource(GLResource):
+    def __init__(self, nbytes, loaded=True):
+        super().__init__()
+        self.nbytes = nbytes
+        self.isLoaded = loaded
+
+    @property
+    def loaded(self):
+        return self.isLoaded
+
+    def allocate(self):
+        return 1
+
+    def dealloc(self):
+        pass
+
+
+class TestUploadQueue(unittest.TestCase):
+    def test_byte_budget(self):
+        queue = UploadQueue(max_ms=1000., max_bytes=100)
+        resources = [FakeResource(n) for n in (60, 30, 50, 200)]
+        for resource in resources:
+            queue.push(resource)
+        queue.push(resources[0])
+        self.assertEqual(queue.nTotal, 4)
+        self.assertFalse(resources[0].ready)
+        self.assertEqual(queue.run(), 90)
+        self.assertTrue(resources[1].ready)
+        self.assertFalse(resources[2].ready)
+        self.assertEqual(queue.progress, .5)
+        # One resource a frame at least, even over the budget.
+        self.assertEqual(queue.run(), 50)
+        self.assertEqual(queue.run(), 200)
+        self.assertEqual(queue.run(), 0)
+        self.assertEqual(queue.stats(), {
+            'nTotal': 4, 'nPending': 0, 'nDone': 4, 'nBytes': 340, 'nFrames': 3})
+        self.assertTrue(all(resource._id == 1 for resource in resources))
+
+    def test_pass_over_unloaded(self):
+        queue = UploadQueue(max_ms=1000., max_bytes=1000)
+        waiting, other = FakeResource(10, loaded=False), FakeResource(10)
+        queue.push(waiting)
+        queue.push(other)
+        queue.run()
+        self.assertEqual((waiting.ready, other.ready), (False, True))
+        self.assertEqual(queue.run(), 0)
+        waiting.isLoaded = True
+        self.assertEqual(queue.run(), 10)
+        self.assertTrue(waiting.ready)
+
+    def test_clear(self):
+        queue = UploadQueue()
+        resource = FakeResource(10)
+        queue.push(resource)
+        queue.clear()
+        self.assertTrue(resource.ready)
+        self.assertIsNone(resource._id)
+        self.assertEqual(queue.progress, 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import numpy as np
+from OpenGL.GL import GL_FLOAT, GL_UNSIGNED_BYTE, GL_HALF_FLOAT
+from raygllib.gllib import VertexFormat
+
+
+class TestVertexFormat(unittest.TestCase):
+    def test_layout(self):
+        format = VertexFormat('vertexPos:3f, vertexJointIds:4ub, vertexUV:2h, vertexNormal:3bn')
+        names = [f[0] for f in format.fields]
+        self.assertEqual(names, ['vertexPos', 'vertexJointIds', 'vertexUV', 'vertexNormal'])
+        # Fields are aligned to 4 bytes.
+        self.assertEqual([f[5] for f in format.fields], [0, 12, 16, 20])
+        self.assertEqual(format.stride, 24)
+        self.assertEqual([f[3] for f in format.fields[:3]],
+            [GL_FLOAT, GL_UNSIGNED_BYTE, GL_HALF_FLOAT])
+        self.assertEqual([f[4] for f in format.fields], [False, False, False, True])
+        with self.assertRaises(ValueError):
+            VertexFormat('vertexPos:5f')
+
+    def test_pack(self):
+        format = VertexFormat('vertexPos:3f, vertexUV:2f')
+        pos = np.arange(12, dtype=np.float32).reshape((4, 3))
+        uv = -np.arange(8, dtype=np.float32).reshape((4, 2))
+        data = format.pack({'vertexPos': pos, 'vertexUV': uv})
+        self.assertEqual(data.nbytes, 4 * format.stride)
+        floats = data.view(np.float32).reshape((4, 5))
+        self.assertTrue(np.array_equal(floats[:, :3], pos))
+        self.assertTrue(np.array_equal(floats[:, 3:], uv))
+
+
+if __name__ == '__main__':
+    unittest.main()